@@ -5,6 +5,11 @@ import os
 INTERNAL_BACKUP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "DTA"))
 MIN_FREE_MB = 50
 MEDIA_BASE_PATH = "/media/pi"
+# Detección de USB por eventos de montaje (poll sobre USB_MOUNTINFO_PATH); False = sondeo cada 5 s
+USB_MOUNT_WATCHER = True
+USB_MOUNTINFO_PATH = "/proc/self/mountinfo"
+# Refresco periódico del servicio de raíces (ruta USB/interna y espacio libre); entre refrescos se descuenta lo escrito
+STORAGE_ROOTS_REFRESH_SECONDS = 60
 
 # Identificación de la estación
 STATION_NAME = "REVS2"
@@ -15,8 +20,67 @@ RAIN_INTERVAL_MINUTES = 1
 SEISMIC_INTERVAL_MINUTES = 1
 GPS_INTERVAL_MINUTES = 1
 
-# Definición del tipo de partición de archivos para almacenamiento
+# Definición del tipo de partición de archivos para almacenamiento: "hour", "day" o "Nmin" (p. ej. "10min")
 BLOCK_TYPE = "hour"
+# Cerrar cada bloque en su límite de reloj aunque el sensor deje de enviar datos (un temporizador compartido)
+STORAGE_TIMED_ROLLOVER = True
+# Bloques abiertos en memoria por almacenamiento (LRU): lecturas tardías van al bloque de su FECHA/TIEMPO
+STORAGE_MAX_OPEN_BLOCKS = 2
+# Backend de almacenamiento: "json" (EC.*.json por bloque) o "sqlite" (una base por raíz DTA; JSON exportable a pedido)
+STORAGE_BACKEND = "json"
+# Tope de lecturas en memoria por almacenamiento (bloques "day" con sensores frecuentes); al superarlo
+# las lecturas pasan a un segmento en disco (.spill) que se fusiona al cerrar el bloque. None = sin tope
+STORAGE_MAX_RESIDENT_READINGS = None
+# Modo de escritura de bloques: "rewrite" (reescritura periódica del JSON) o "journal" (append-only + JSON al cerrar)
+STORAGE_WRITE_MODE = "rewrite"
+# Escritor asíncrono: el hilo lector solo encola; un hilo dedicado serializa y hace fsync
+STORAGE_ASYNC_WRITER = False
+STORAGE_QUEUE_SIZE = 1000
+STORAGE_QUEUE_OVERFLOW = "drop_oldest"  # "drop_oldest", "drop_newest" o "block"
+# Formato de bloques sísmicos: "json" (EC.*.json), "json_compact" (EC.*.json sin sangría, escrito en streaming)
+# o "columnar" (EC.*.col binario; exportable a JSON)
+SEISMIC_BLOCK_FORMAT = "json"
+# Formato de bloques del pluviómetro: "json" o "json_compact"
+PLUVI_BLOCK_FORMAT = "json"
+# Commit agrupado: una sola ronda de fsync por ventana para todos los almacenamientos (0 = desactivado)
+STORAGE_COMMIT_WINDOW_SECONDS = 0
+# Archivado comprimido de bloques cerrados en el almacenamiento interno (un archivo por día + índice)
+ARCHIVE_ENABLED = False
+ARCHIVE_CODEC = "gzip"  # "gzip" o "lzma"
+ARCHIVE_MIN_AGE_HOURS = 2
+ARCHIVE_INTERVAL_SECONDS = 3600
+# Hilos de la migración interna -> USB (solapan la latencia de la USB con las lecturas de la memoria interna)
+MIGRATION_WORKERS = 4
+# Presupuesto de E/S de la migración (MB/s, p. ej. 4). Por defecto None: sin límite, de modo que el primer
+# volcado de un atraso completo al conectar la USB corre a toda velocidad. Con un valor, los guardados en
+# vivo tienen prioridad y, si su fsync supera MIGRATION_FSYNC_TARGET_MS, la tasa se reduce automáticamente
+MIGRATION_MAX_MB_S = None
+MIGRATION_FSYNC_TARGET_MS = 100
+# Modo espejo: los bloques se escriben siempre en MIRROR_PRIMARY_DIR (interna o tmpfs) y un reconciliador
+# los replica a la USB por lotes cada MIRROR_INTERVAL_SECONDS (o al acumular MIRROR_BATCH_MB sin replicar).
+# Reemplaza a la migración: la primaria nunca deja de tener todos los datos
+STORAGE_MIRROR_ENABLED = False
+MIRROR_PRIMARY_DIR = INTERNAL_BACKUP_DIR
+MIRROR_INTERVAL_SECONDS = 300
+MIRROR_BATCH_MB = 8
+# Recorte de la primaria: bloques cerrados y ya replicados sin cambios se eliminan de ella pasadas estas
+# horas (None: la primaria solo se libera con la retención de su raíz, RETENTION_INTERNAL_BUDGET_MB)
+MIRROR_TRIM_AFTER_HOURS = 48
+# Caché persistente de sha256 por raíz (<raíz>.hashes.sqlite junto a DTA) para la detección de duplicados
+MIGRATION_HASH_CACHE = True
+# Manifiesto de migración (en la memoria interna, fuera de DTA): permite retomar una migración cortada
+MIGRATION_MANIFEST_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "migration_manifest.sqlite"))
+# Catálogo SQLite de bloques (fuera de DTA para que la migración no lo mueva)
+CATALOG_ENABLED = False
+CATALOG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "catalog.sqlite"))
+# Retención y cuotas: presupuesto por raíz (MB, None = sin límite propio) y por tipo dentro de cada raíz.
+# Nivel 1 comprime desde RETENTION_COMPRESS_AT * presupuesto; nivel 2 elimina lo más antiguo al excederlo.
+RETENTION_ENABLED = False
+RETENTION_INTERNAL_BUDGET_MB = None
+RETENTION_USB_BUDGET_MB = None
+RETENTION_TIPO_BUDGETS_MB = {}  # p. ej. {"SIS": 2048, "RGA": 256}
+RETENTION_COMPRESS_AT = 0.8
+RETENTION_INTERVAL_SECONDS = 600
 
 # Sensor de lluvia
 RAIN_SENSOR_PIN = 17
@@ -6,7 +6,7 @@ import lgpio
 
 
 from config import RAIN_SENSOR_PIN, MIN_FREE_MB
-from utils.storage.storage_utils import find_mounted_usb, has_enough_space
+from utils.storage.storage_roots import get_storage_roots
 from sensors.network import is_connected, network_status_lines
 from utils.sensors.battery_utils import BatteryMonitor
 
@@ -46,11 +46,12 @@ def startup_diagnostics(leds, logger=None):
         logger.error(f"Sensor de lluvia: error al configurar ({e})")
         leds.set("ERROR", True)
 
-    # 2. Verificación de la memoria USB
-    usb = find_mounted_usb()
+    # 2. Verificación de la memoria USB (servicio de raíces: una sola exploración, compartida con el almacenamiento)
+    roots = get_storage_roots()
+    usb = roots.mounted_usb
     if usb:
         try:
-            free_mb = shutil.disk_usage(usb).free // (1024 ** 2)
+            free_mb = roots.free_bytes(usb) // (1024 ** 2)
             logger.info(f"Memoria USB detectada | Ruta: {usb} | Espacio libre: {free_mb} MB")
             if free_mb < MIN_FREE_MB:
                 logger.warning(f"Memoria USB: espacio bajo (<{MIN_FREE_MB} MB)")
@@ -66,7 +67,8 @@ def startup_diagnostics(leds, logger=None):
     # 3. Verificación de espacio local
     local_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
     try:
-        local_free_mb = shutil.disk_usage(local_path).free // (1024 ** 2)
+        local_free = roots.free_bytes(roots.internal_dir)
+        local_free_mb = (local_free if local_free is not None else shutil.disk_usage(local_path).free) // (1024 ** 2)
         logger.info(f"Espacio local configurado | Ruta: {local_path} | Espacio libre: {local_free_mb} MB")
     except Exception as e:
         logger.error(f"Espacio local: error al verificar ({e})")
@@ -2,13 +2,21 @@ from utils.log_utils import setup_logger
 import os
 import threading
 from utils.storage.block_storage import BlockStorage
-from utils.storage.storage_utils import find_mounted_usb
+from utils.storage.storage_roots import get_storage_roots
 from utils.leds_utils import LEDManager
 from diagnostics.startup import startup_diagnostics
 from config import (
     STATION_NAME, IDENTIFIER, SEISMIC_STATION_TYPE, SEISMIC_MODEL, SEISMIC_SERIAL_NUMBER,
     SEISMIC_PORT, SEISMIC_BAUDRATE, PLUVI_STATION_TYPE, PLUVI_MODEL, PLUVI_SERIAL_NUMBER,
-    BLOCK_TYPE, SENSORS
+    BLOCK_TYPE, SENSORS, STORAGE_WRITE_MODE, STORAGE_ASYNC_WRITER, STORAGE_QUEUE_SIZE,
+    STORAGE_QUEUE_OVERFLOW, STORAGE_COMMIT_WINDOW_SECONDS, SEISMIC_BLOCK_FORMAT, PLUVI_BLOCK_FORMAT,
+    ARCHIVE_ENABLED, ARCHIVE_CODEC, ARCHIVE_MIN_AGE_HOURS, ARCHIVE_INTERVAL_SECONDS,
+    CATALOG_ENABLED, CATALOG_PATH, MIN_FREE_MB, RETENTION_ENABLED, RETENTION_INTERNAL_BUDGET_MB,
+    RETENTION_USB_BUDGET_MB, RETENTION_TIPO_BUDGETS_MB, RETENTION_COMPRESS_AT, RETENTION_INTERVAL_SECONDS,
+    STORAGE_TIMED_ROLLOVER, STORAGE_MAX_OPEN_BLOCKS, STORAGE_BACKEND, STORAGE_MAX_RESIDENT_READINGS,
+    MIGRATION_WORKERS, MIGRATION_MANIFEST_PATH, MIGRATION_HASH_CACHE, MIGRATION_MAX_MB_S, MIGRATION_FSYNC_TARGET_MS,
+    STORAGE_MIRROR_ENABLED, MIRROR_PRIMARY_DIR, MIRROR_INTERVAL_SECONDS, MIRROR_BATCH_MB, MIRROR_TRIM_AFTER_HOURS,
+    USB_MOUNT_WATCHER, USB_MOUNTINFO_PATH, MEDIA_BASE_PATH
 )
 from managers.seismic_manager import SeismicManager
 from managers.rain_manager import RainManager
@@ -28,8 +36,11 @@ logger = setup_logger("main")
 from utils.network_monitor import start_network_monitor
 start_network_monitor(leds, logger)
 
-# Selección dinámica de ruta de almacenamiento
-usb_path = find_mounted_usb()
+# Selección dinámica de ruta de almacenamiento (servicio de raíces: ruta y espacio libre en memoria,
+# creado por startup_diagnostics; se refresca ante cambios de montaje y cada STORAGE_ROOTS_REFRESH_SECONDS)
+storage_roots = get_storage_roots()
+storage_roots.start()
+usb_path = storage_roots.usb_path
 if usb_path:
     output_dir = os.path.join(usb_path, "DTA")
     logger.info(f"Almacenamiento USB detectado: {output_dir}")
@@ -46,31 +57,131 @@ rain_sensor = next((s for s in SENSORS if s["name"] == "rain"), None)
 pluvi_interval_minutes = rain_sensor["interval_minutes"] if rain_sensor else 1
 
 # Almacenamiento
+# Presupuesto de E/S de la migración (cede ante los fsync en vivo y se adapta a su latencia)
+io_throttle = None
+if MIGRATION_MAX_MB_S:
+    from utils.storage.io_throttle import IOThrottle
+    io_throttle = IOThrottle(MIGRATION_MAX_MB_S, target_fsync_ms=MIGRATION_FSYNC_TARGET_MS, logger=logger)
+# Modo espejo: escritura en la primaria y réplica por lotes a la USB (en lugar de cambiar de raíz y migrar)
+mirror = None
+storage_dir = output_dir
+
+
+def on_mirror_trimmed(path, target_root):
+    """Bloque recortado de la primaria: ya solo existe en la USB."""
+    if retention is not None:
+        retention.note_removed(path)
+    if catalog is not None:
+        catalog.relocate(MIRROR_PRIMARY_DIR, target_root, os.path.relpath(path, MIRROR_PRIMARY_DIR))
+
+
+if STORAGE_MIRROR_ENABLED:
+    from utils.storage.mirror import MirrorReconciler
+    mirror = MirrorReconciler(MIRROR_PRIMARY_DIR, interval_seconds=MIRROR_INTERVAL_SECONDS,
+                              batch_bytes=MIRROR_BATCH_MB * 2 ** 20, io_throttle=io_throttle,
+                              trim_after_seconds=MIRROR_TRIM_AFTER_HOURS * 3600 if MIRROR_TRIM_AFTER_HOURS else None,
+                              block_type=BLOCK_TYPE, on_trimmed=on_mirror_trimmed, logger=logger)
+    storage_dir = MIRROR_PRIMARY_DIR
+    # El destino (USB) lo fija el monitor de hotplug en su primera vuelta: set_target recorre la primaria
+# Coordinador de commits compartido (fsync agrupado) si está habilitado
+from utils.storage.commit_coordinator import get_commit_coordinator
+commit_coordinator = (
+    get_commit_coordinator(STORAGE_COMMIT_WINDOW_SECONDS, logger, io_throttle=io_throttle)
+    if STORAGE_COMMIT_WINDOW_SECONDS > 0 else None
+)
+# Planificador compartido de cierres de bloque por límite de reloj
+from utils.storage.rollover import get_rollover_scheduler
+rollover_scheduler = get_rollover_scheduler(logger) if STORAGE_TIMED_ROLLOVER else None
+# Catálogo SQLite de bloques (resumen por bloque, actualizado en cada guardado)
+catalog = None
+if CATALOG_ENABLED:
+    from utils.storage.catalog import BlockCatalog
+    catalog = BlockCatalog(CATALOG_PATH, logger)
+# Manifiesto de la migración interna -> USB (retoma migraciones interrumpidas sin recalcular hashes)
+from utils.storage.migration_manifest import MigrationManifest
+migration_manifest = MigrationManifest(MIGRATION_MANIFEST_PATH, logger)
+# Retención y cuotas por raíz/tipo (uso incremental, compresión y eliminación de lo más antiguo)
+retention = None
+if RETENTION_ENABLED:
+    from utils.storage.retention import RetentionManager
+    retention = RetentionManager(
+        tipo_budgets={t: mb * 2 ** 20 for t, mb in RETENTION_TIPO_BUDGETS_MB.items()},
+        min_free_bytes=MIN_FREE_MB * 2 ** 20,
+        compress_at=RETENTION_COMPRESS_AT,
+        codec=ARCHIVE_CODEC,
+        interval_seconds=RETENTION_INTERVAL_SECONDS,
+        catalog=catalog,
+        block_type=BLOCK_TYPE,
+        storage_roots=storage_roots,
+        logger=logger
+    )
+    retention.add_root(
+        INTERNAL_BACKUP_DIR,
+        RETENTION_INTERNAL_BUDGET_MB * 2 ** 20 if RETENTION_INTERNAL_BUDGET_MB else None
+    )
+    # La raíz de la USB la registra el monitor de hotplug al detectarla (también al arrancar): un solo recorrido
+    retention.start()
+# El reconciliador arranca con retención y catálogo ya creados (on_mirror_trimmed los usa)
+if mirror is not None:
+    mirror.start()
+# Backend de almacenamiento (misma interfaz: add_data, flush, set_output_dir)
+if STORAGE_BACKEND == "sqlite":
+    from utils.storage.sqlite_storage import SQLiteBlockStorage as StorageBackend
+else:
+    StorageBackend = BlockStorage
 from utils.extractors.data_extractors import extract_seismic
-seismic_storage = BlockStorage(
+seismic_storage = StorageBackend(
     station_name=STATION_NAME,
     identifier=IDENTIFIER,
     model=SEISMIC_MODEL,
     serial_number=SEISMIC_SERIAL_NUMBER,
     logger=logger,
-    output_dir=output_dir,
+    output_dir=storage_dir,
     block_type=BLOCK_TYPE,
     tipo=SEISMIC_STATION_TYPE,
     interval_minutes=interval_minutes,
-    extractor_func=extract_seismic
+    extractor_func=extract_seismic,
+    write_mode=STORAGE_WRITE_MODE,
+    async_writer=STORAGE_ASYNC_WRITER,
+    queue_size=STORAGE_QUEUE_SIZE,
+    overflow_policy=STORAGE_QUEUE_OVERFLOW,
+    commit_coordinator=commit_coordinator,
+    catalog=catalog,
+    retention=retention,
+    rollover_scheduler=rollover_scheduler,
+    max_open_blocks=STORAGE_MAX_OPEN_BLOCKS,
+    max_resident_readings=STORAGE_MAX_RESIDENT_READINGS,
+    io_throttle=io_throttle,
+    mirror=mirror,
+    storage_roots=storage_roots,
+    block_format=SEISMIC_BLOCK_FORMAT
 )
 from utils.extractors.data_extractors import extract_rain
-pluvi_storage = BlockStorage(
+pluvi_storage = StorageBackend(
     station_name=STATION_NAME,
     identifier=IDENTIFIER,
     model=PLUVI_MODEL,
     serial_number=PLUVI_SERIAL_NUMBER,
     logger=logger,
-    output_dir=output_dir,
+    output_dir=storage_dir,
     block_type=BLOCK_TYPE,
     tipo=PLUVI_STATION_TYPE,
     interval_minutes=pluvi_interval_minutes,
-    extractor_func=extract_rain
+    extractor_func=extract_rain,
+    write_mode=STORAGE_WRITE_MODE,
+    async_writer=STORAGE_ASYNC_WRITER,
+    queue_size=STORAGE_QUEUE_SIZE,
+    overflow_policy=STORAGE_QUEUE_OVERFLOW,
+    commit_coordinator=commit_coordinator,
+    catalog=catalog,
+    retention=retention,
+    rollover_scheduler=rollover_scheduler,
+    max_open_blocks=STORAGE_MAX_OPEN_BLOCKS,
+    max_resident_readings=STORAGE_MAX_RESIDENT_READINGS,
+    io_throttle=io_throttle,
+    mirror=mirror,
+    storage_roots=storage_roots,
+    block_format=PLUVI_BLOCK_FORMAT
 )
 
 # ------------------- Inicialización de managers -------------------
@@ -99,45 +210,87 @@ for t in threads:
 
 # ------------------- Monitor de USB hotplug y migración de datos -------------------
 import time
-from utils.storage.migrate_to_usb import migrate_internal_to_usb
+from utils.storage.hash_cache import close_hash_cache
+from utils.storage.migration_job import MigrationJob
+
 
-def usb_hotplug_monitor(seismic_storage, pluvi_storage, logger, internal_dir, leds, check_interval=5, disconnect_threshold=3):
+def on_migration_done(usb_dir, files_migrated):
+    if retention is not None:
+        retention.rescan(INTERNAL_BACKUP_DIR)
+
+
+# Migración en segundo plano: el monitor solo la inicia o la cancela y sigue atento a la USB
+migration_job = MigrationJob(logger, on_done=on_migration_done, catalog=catalog, workers=MIGRATION_WORKERS,
+                             manifest=migration_manifest, hash_cache=MIGRATION_HASH_CACHE, io_throttle=io_throttle,
+                             storage_roots=storage_roots)
+
+
+def usb_hotplug_monitor(seismic_storage, pluvi_storage, logger, internal_dir, leds, check_interval=5, disconnect_threshold=3,
+                        watcher=None):
     usb_connected = False
     last_usb_path = None
     failure_count = 0
     while True:
-        usb_path = find_mounted_usb()
+        # Refrescar raíces y espacio libre al despertar (cambio de montajes o check_interval); con watcher
+        # (MountWatcher), los candidatos salen de la tabla de montajes ya leída
+        usb_path = storage_roots.refresh()
         if usb_path:
             # Conexión nueva o cambio de ruta
             if not usb_connected or (last_usb_path and usb_path != last_usb_path):
                 output_dir = os.path.join(usb_path, "DTA")
-                logger.info(f"Memoria USB detectada: {output_dir}. Cambiando almacenamiento y migrando datos...")
-                seismic_storage.set_output_dir(output_dir)
-                pluvi_storage.set_output_dir(output_dir)
-                logger.info(f"Ruta de almacenamiento cambiada a: {output_dir}")
-                # Migrar archivos pendientes
-                files_migrated = migrate_internal_to_usb(internal_dir, output_dir, logger)
-                logger.info(f"Migración completada. Archivos migrados: {files_migrated}")
+                if retention is not None:
+                    retention.add_root(output_dir, RETENTION_USB_BUDGET_MB * 2 ** 20 if RETENTION_USB_BUDGET_MB else None)
+                if mirror is not None:
+                    # Modo espejo: los almacenamientos siguen en la primaria; la USB pasa a ser el destino de la réplica
+                    logger.info(f"Memoria USB detectada: {output_dir}. Replicando en modo espejo...")
+                    mirror.set_target(output_dir)
+                else:
+                    logger.info(f"Memoria USB detectada: {output_dir}. Cambiando almacenamiento y migrando datos...")
+                    seismic_storage.set_output_dir(output_dir)
+                    pluvi_storage.set_output_dir(output_dir)
+                    logger.info(f"Ruta de almacenamiento cambiada a: {output_dir}")
+                    # Migrar archivos pendientes (en segundo plano; cancela la corrida hacia la ruta anterior)
+                    migration_job.start(internal_dir, output_dir)
                 # Apagar LED MEDIA (USB presente)
                 if leds:
                     leds.set("MEDIA", False)
                 usb_connected = True
                 last_usb_path = usb_path
+            elif mirror is None and migration_job.status()["state"] == "cancelled":
+                # Falso negativo tras una cancelación: retomar la migración pendiente
+                migration_job.start(internal_dir, os.path.join(usb_path, "DTA"))
             # Resetear contador de fallos si la USB está presente
             failure_count = 0
         else:
             # Evitar falsos negativos: si la última ruta sigue montada, mantenemos la conexión
-            still_mounted = bool(last_usb_path) and os.path.ismount(last_usb_path)
+            if watcher is not None:
+                still_mounted = bool(last_usb_path) and watcher.is_mounted(last_usb_path)
+            else:
+                still_mounted = bool(last_usb_path) and os.path.ismount(last_usb_path)
             if usb_connected and still_mounted:
                 logger.debug(f"USB aparentemente ausente en escaneo, pero {last_usb_path} sigue montada. Manteniendo conexión.")
                 failure_count = 0
             elif usb_connected:
+                # Sin la USB no tiene sentido seguir copiando: cancelar ya, sin esperar el umbral
+                migration_job.cancel()
                 failure_count += 1
+                if watcher is not None:
+                    # La tabla de montajes es definitiva: desmontada significa retirada (sin reintentos)
+                    failure_count = disconnect_threshold
                 if failure_count >= disconnect_threshold:
                     logger.warning("Memoria USB desconectada. Volviendo a almacenamiento interno.")
-                    seismic_storage.set_output_dir(internal_dir)
-                    pluvi_storage.set_output_dir(internal_dir)
-                    logger.info(f"Ruta de almacenamiento cambiada a: {internal_dir}")
+                    if retention is not None:
+                        retention.remove_root(os.path.join(last_usb_path, "DTA"))
+                    # La caché de hashes de la USB se reabre en la próxima conexión (si la migración
+                    # sigue terminando, la cierra ella al salir)
+                    if not migration_job.running:
+                        close_hash_cache(os.path.join(last_usb_path, "DTA"))
+                    if mirror is not None:
+                        mirror.clear_target()
+                    else:
+                        seismic_storage.set_output_dir(internal_dir)
+                        pluvi_storage.set_output_dir(internal_dir)
+                        logger.info(f"Ruta de almacenamiento cambiada a: {internal_dir}")
                     # Encender LED MEDIA (USB ausente)
                     if leds:
                         leds.set("MEDIA", True)
@@ -145,16 +298,42 @@ def usb_hotplug_monitor(seismic_storage, pluvi_storage, logger, internal_dir, le
                     last_usb_path = None
                     failure_count = 0
             # Si no está conectada, no hacer nada más
-        time.sleep(check_interval)
+        if watcher is not None:
+            # Sin reintentos pendientes, dormir hasta el próximo cambio de la tabla de montajes (sin despertares);
+            # una USB montada pero rechazada (p. ej. sin espacio) se sigue revisando cada check_interval
+            steady = (watcher.event_driven and failure_count == 0 and
+                      (usb_connected or not watcher.media_mounts()))
+            watcher.wait_for_change(None if steady else check_interval)
+        else:
+            time.sleep(check_interval)
 
+# Detección de USB por eventos de la tabla de montajes (con sondeo si no hay eventos)
+mount_watcher = None
+if USB_MOUNT_WATCHER:
+    from utils.storage.mount_watcher import MountWatcher
+    mount_watcher = MountWatcher(USB_MOUNTINFO_PATH, media_base=MEDIA_BASE_PATH, logger=logger)
+    storage_roots.watcher = mount_watcher
 # Lanzar el monitor en un hilo aparte
 t_monitor = threading.Thread(
     target=usb_hotplug_monitor,
     args=(seismic_storage, pluvi_storage, logger, INTERNAL_BACKUP_DIR, leds),
+    kwargs={"watcher": mount_watcher},
     daemon=True
 )
 t_monitor.start()
 
+# ------------------- Archivado comprimido del almacenamiento interno -------------------
+if ARCHIVE_ENABLED:
+    from utils.storage.archiver import BlockArchiver
+    archiver = BlockArchiver(
+        INTERNAL_BACKUP_DIR,
+        codec=ARCHIVE_CODEC,
+        min_age_seconds=ARCHIVE_MIN_AGE_HOURS * 3600,
+        interval_seconds=ARCHIVE_INTERVAL_SECONDS,
+        logger=logger
+    )
+    archiver.start()
+
 # ------------------- Bucle principal (keep-alive y limpieza) -------------------
 
 try:
@@ -162,5 +341,13 @@ try:
         time.sleep(1)  # El sistema sigue corriendo, managers activos en hilos
 except KeyboardInterrupt:
     logger.info("Terminando y guardando datos pendientes...")
+    for storage in (seismic_storage, pluvi_storage):
+        try:
+            storage.close()
+        except Exception as e:
+            logger.error(f"Error al guardar datos pendientes: {e}")
+    if mirror is not None:
+        # Última ronda de réplica con lo que dejaron los cierres de bloque
+        mirror.stop()
     # Aquí podrías agregar métodos de parada para los managers si lo deseas
     leds.cleanup()
@@ -0,0 +1,672 @@
+#!/usr/bin/env python3
+"""
+Benchmarks de almacenamiento (BlockStorage y utilidades asociadas).
+
+Uso (desde la raíz del proyecto):
+    python3 test/bench_storage.py journal --dir /media/pi/USB/bench --readings 60
+    python3 test/bench_storage.py journal --dir /home/pi/bench          # SD interna
+    python3 test/bench_storage.py slots --day-seconds 86400
+    python3 test/bench_storage.py columnar --readings 3600
+    python3 test/bench_storage.py compact --readings 3600
+    python3 test/bench_storage.py accumulate --readings 3600
+    python3 test/bench_storage.py out_of_order --day-seconds 86400
+    python3 test/bench_storage.py paths --dir /media/pi/USB/bench --readings 600
+    python3 test/bench_storage.py spill --day-seconds 86400 --readings 3600
+    python3 test/bench_storage.py migrate --src /home/pi/bench --dir /media/pi/USB/bench --blocks 10000
+    python3 test/bench_storage.py throttle --src /home/pi/bench --dir /media/pi/USB/bench --blocks 5000 --rate 4
+    python3 test/bench_storage.py mirror --src /home/pi/bench --dir /media/pi/USB/bench --readings 3600
+    python3 test/bench_storage.py rehash --src /home/pi/bench --dir /media/pi/USB/bench --blocks 2000
+    python3 test/bench_storage.py roots --dir /home/pi/bench --readings 10000
+    python3 test/bench_storage.py sqlite --dir /home/pi/bench --readings 8640 --batch 60   # SD interna
+
+Cada escenario crea un directorio temporal dentro de --dir y lo elimina al terminar.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.storage.block_storage import BlockStorage  # noqa: E402
+
+
+def quiet_logger():
+    logger = logging.getLogger("bench_storage")
+    logger.setLevel(logging.WARNING)
+    return logger
+
+
+def io_written_bytes():
+    """Bytes pasados a write() por el proceso (wchar de /proc/self/io, solo Linux)."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except Exception:
+        pass
+    return None
+
+
+def io_disk_bytes():
+    """Bytes enviados al dispositivo de bloques (write_bytes de /proc/self/io; 0 en tmpfs)."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except Exception:
+        pass
+    return None
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def make_storage(output_dir, **kwargs):
+    params = dict(
+        station_name="BENCH",
+        identifier=1,
+        model="rpi-5",
+        serial_number="0000",
+        logger=quiet_logger(),
+        output_dir=output_dir,
+        block_type="hour",
+        tipo="SIS",
+        interval_minutes=1,
+    )
+    params.update(kwargs)
+    return BlockStorage(**params)
+
+
+def seismic_reading(ts):
+    return {
+        "FECHA": ts.strftime("%Y-%m-%d"),
+        "TIEMPO": ts.strftime("%H:%M:%S"),
+        "LATITUD": -0.212183,
+        "LONGITUD": -78.491557,
+        "ALTURA": 2814.1,
+        "ALERTA": False,
+        "PASA_BANDA": "0017",
+        "PASA_BAJO": "0013",
+        "PASA_ALTO": "0057",
+        "BATERIA": 12.47,
+    }
+
+
+def bench_journal(args):
+    """Compara 'rewrite' vs 'journal': bytes escritos por lectura y latencia p99 de add_data."""
+    base = datetime.now().replace(minute=0, second=0, microsecond=0)
+    readings = [seismic_reading(base + timedelta(minutes=i % 60, seconds=i // 60)) for i in range(args.readings)]
+    print(f"Directorio: {args.dir} | lecturas: {args.readings}")
+    print(f"{'modo':<10} {'bytes/lectura':>14} {'p50 ms':>9} {'p99 ms':>9} {'cierre ms':>10}")
+    for mode in ("rewrite", "journal"):
+        workdir = tempfile.mkdtemp(prefix=f"bench_{mode}_", dir=args.dir)
+        try:
+            storage = make_storage(workdir, write_mode=mode)
+            # Una escritura por lectura: equivale a lecturas cada minuto con write_interval_seconds=10
+            storage.set_write_interval(0)
+            latencies = []
+            w0 = io_written_bytes()
+            for r in readings:
+                t0 = time.perf_counter()
+                storage.add_data(r)
+                latencies.append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            storage._close_block(storage.current_block)
+            close_ms = (time.perf_counter() - t0) * 1000
+            w1 = io_written_bytes()
+            per_reading = (w1 - w0) / len(readings) if w0 is not None else float("nan")
+            print(f"{mode:<10} {per_reading:>14.0f} {percentile(latencies, 50):>9.2f} "
+                  f"{percentile(latencies, 99):>9.2f} {close_ms:>10.2f}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _legacy_slot_lookup(block_data, data, interval_minutes):
+    """Búsqueda lineal previa al índice de intervalos (solo como referencia)."""
+    minuto = int(data["TIEMPO"][3:5])
+    return next((i for i, d in enumerate(block_data)
+                 if d["FECHA"] == data["FECHA"] and
+                 int(d["TIEMPO"][3:5]) // interval_minutes == minuto // interval_minutes and
+                 d["TIEMPO"][:2] == data["TIEMPO"][:2]), None)
+
+
+def bench_slots(args):
+    """Costo de deduplicar por intervalo en bloques diarios (sin E/S: write_interval muy alto)."""
+    base = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    print(f"{'tasa':<8} {'lecturas':>9} {'índice us/lect':>15} {'lineal us/lect':>15}")
+    for label, step, count in (("1 min", 60, 1440), ("1 s", 1, args.day_seconds)):
+        readings = [seismic_reading(base + timedelta(seconds=i * step)) for i in range(count)]
+        storage = make_storage(tempfile.gettempdir(), block_type="day", interval_minutes=1)
+        storage.write_interval_seconds = 10 ** 9
+        t0 = time.perf_counter()
+        for r in readings:
+            storage.add_data(r)
+        indexed_us = (time.perf_counter() - t0) * 1e6 / count
+        # Referencia: búsqueda lineal sobre un bloque equivalente
+        block_data = []
+        t0 = time.perf_counter()
+        for r in readings:
+            idx = _legacy_slot_lookup(block_data, r, 1)
+            if idx is not None:
+                block_data[idx] = r
+            else:
+                block_data.append(r)
+        linear_us = (time.perf_counter() - t0) * 1e6 / count
+        print(f"{label:<8} {count:>9} {indexed_us:>15.2f} {linear_us:>15.2f}")
+
+
+def _legacy_accumulate(storage, directory, data, interval_end_str, date_str):
+    """Ruta de acumulación previa (solo como referencia): raíz resuelta y archivo releído/reescrito por llamada."""
+    from utils.storage.storage_utils import find_mounted_usb
+    find_mounted_usb()  # get_dta_path -> get_storage_base en cada llamada
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, f"legacy_{interval_end_str[:2]}00.json")
+    if os.path.exists(filename):
+        with open(filename, 'r') as file:
+            content = json.load(file)
+    else:
+        content = storage.create_empty_structure()
+    if not any(interval_end_str == lectura["TIEMPO"] for lectura in content["LECTURAS"]):
+        content["LECTURAS"].append({"FECHA": date_str, "TIEMPO": interval_end_str, "DATOS": [data]})
+    tmp = filename + ".tmp"
+    with open(tmp, 'w') as file:
+        json.dump(content, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, filename)
+
+
+def bench_accumulate(args):
+    """accumulate() con una muestra por segundo (intervalo de 1 min): ruta actual vs ruta previa por llamada."""
+    base = datetime.now().replace(minute=0, second=0, microsecond=0)
+    stamps = [base + timedelta(seconds=i) for i in range(args.readings)]
+    print(f"Directorio: {args.dir} | muestras: {len(stamps)} (1/s)")
+    print(f"{'ruta':<10} {'us/muestra':>11} {'p99 ms':>9} {'MB escritos':>12}")
+    for label in ("previa", "actual"):
+        workdir = tempfile.mkdtemp(prefix="bench_acc_", dir=args.dir)
+        try:
+            storage = make_storage(workdir)
+            latencies = []
+            w0 = io_written_bytes()
+            for ts in stamps:
+                sample = {"PASA_BANDA": "0017", "BATERIA": 12.47}
+                t0 = time.perf_counter()
+                if label == "actual":
+                    storage.accumulate(sample, acquisition_interval=1, timestamp=ts)
+                else:
+                    _legacy_accumulate(storage, workdir, sample, storage.get_current_interval_end(1, ts),
+                                       ts.strftime("%Y-%m-%d"))
+                latencies.append((time.perf_counter() - t0) * 1000)
+            storage.close()
+            w1 = io_written_bytes()
+            mb = (w1 - w0) / 2 ** 20 if w0 is not None else float("nan")
+            print(f"{label:<10} {sum(latencies) * 1000 / len(latencies):>11.1f} {percentile(latencies, 99):>9.3f} "
+                  f"{mb:>12.2f}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_columnar(args):
+    """Bytes en disco y CPU de serialización por guardado: JSON indent=4 vs columnar."""
+    base = datetime.now().replace(minute=0, second=0, microsecond=0)
+    readings = [seismic_reading(base + timedelta(seconds=i * 3600 // args.readings)) for i in range(args.readings)]
+    print(f"Lecturas por bloque: {args.readings}")
+    print(f"{'formato':<10} {'bytes':>10} {'CPU ms/guardado':>16}")
+    for fmt in ("json", "columnar"):
+        storage = make_storage(tempfile.gettempdir(), block_format=fmt)
+        t0 = time.process_time()
+        rounds = 20
+        for _ in range(rounds):
+            payload = storage._serialize_block(base, readings)
+        cpu_ms = (time.process_time() - t0) * 1000 / rounds
+        print(f"{fmt:<10} {len(payload):>10} {cpu_ms:>16.2f}")
+
+
+def bench_compact(args):
+    """Guardado completo de un bloque: 'json' (indent=4) vs 'json_compact' (streaming). Tamaño, CPU y memoria pico."""
+    base = datetime.now().replace(minute=0, second=0, microsecond=0)
+    readings = [seismic_reading(base + timedelta(seconds=i * 3600 // args.readings)) for i in range(args.readings)]
+    print(f"Directorio: {args.dir} | lecturas por bloque: {args.readings}")
+    print(f"{'formato':<13} {'bytes':>10} {'CPU ms/guardado':>16} {'pico KiB':>9}")
+    for fmt in ("json", "json_compact"):
+        workdir = tempfile.mkdtemp(prefix=f"bench_{fmt}_", dir=args.dir)
+        try:
+            storage = make_storage(workdir, block_format=fmt)
+            filename = storage.save_block_file(base, readings)
+            rounds = 20
+            t0 = time.process_time()
+            for _ in range(rounds):
+                storage.save_block_file(base, readings)
+            cpu_ms = (time.process_time() - t0) * 1000 / rounds
+            tracemalloc.start()
+            storage.save_block_file(base, readings)
+            peak_kib = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+            print(f"{fmt:<13} {os.path.getsize(filename):>10} {cpu_ms:>16.2f} {peak_kib:>9.0f}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_out_of_order(args):
+    """Un día de lecturas cada 10 s con llegadas tardías (lotes LoRa, reenvíos) según max_open_blocks."""
+    base = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    rng = random.Random(1234)
+    arrivals = []
+    for i in range(0, args.day_seconds, 10):
+        ts = base + timedelta(seconds=i)
+        # 30 % de las lecturas llega con hasta 70 min de retraso
+        delay = rng.uniform(0, 4200) if rng.random() < 0.3 else 0
+        arrivals.append((ts + timedelta(seconds=delay), seismic_reading(ts)))
+    arrivals.sort(key=lambda a: a[0])
+    readings = [r for _, r in arrivals]
+    print(f"Lecturas: {len(readings)} (fuera de orden: {sum(1 for a, b in zip(readings, readings[1:]) if b['TIEMPO'] < a['TIEMPO'] and b['FECHA'] == a['FECHA'])})")
+    print(f"{'bloques abiertos':<17} {'us/lectura':>11} {'guardados':>10} {'lecturas disco':>15} {'MB escritos':>12}")
+    for max_open in (1, 2, 4):
+        workdir = tempfile.mkdtemp(prefix=f"bench_ooo_{max_open}_", dir=args.dir)
+        try:
+            storage = make_storage(workdir, max_open_blocks=max_open)
+            storage.write_interval_seconds = 10 ** 9  # solo se escribe al cerrar/desalojar bloques
+            counts = {"save": 0, "load": 0}
+            save, load = storage.save_block_file, storage._load_existing_block
+
+            def counted_save(*a, **kw):
+                counts["save"] += 1
+                return save(*a, **kw)
+
+            def counted_load(*a, **kw):
+                counts["load"] += 1
+                return load(*a, **kw)
+
+            storage.save_block_file, storage._load_existing_block = counted_save, counted_load
+            w0 = io_written_bytes()
+            t0 = time.perf_counter()
+            for r in readings:
+                storage.add_data(r)
+            storage.close()
+            elapsed = time.perf_counter() - t0
+            w1 = io_written_bytes()
+            mb = (w1 - w0) / 2 ** 20 if w0 is not None else float("nan")
+            print(f"{max_open:<17} {elapsed * 1e6 / len(readings):>11.1f} {counts['save']:>10} "
+                  f"{counts['load']:>15} {mb:>12.1f}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_sqlite(args):
+    """
+    Backend JSON vs SQLite: lecturas/s y amplificación de escritura (bytes escritos / bytes de las lecturas
+    en JSON compacto). Ambos confirman en disco cada --batch lecturas; usar --dir sobre la SD a evaluar.
+    """
+    from utils.storage.sqlite_storage import SQLiteBlockStorage
+    base = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    step = max(1, 86400 // args.readings)
+    readings = [seismic_reading(base + timedelta(seconds=i * step)) for i in range(args.readings)]
+    payload = sum(len(json.dumps(r, separators=(",", ":"))) for r in readings)
+    print(f"Directorio: {args.dir} | lecturas: {len(readings)} (cada {step} s) | commit cada {args.batch} | "
+          f"datos: {payload / 1024:.0f} KiB")
+    print(f"{'backend':<8} {'lecturas/s':>11} {'write() MB':>11} {'ampl.':>7} {'disco MB':>9} {'ampl. disco':>12}")
+    for backend in ("json", "sqlite"):
+        workdir = tempfile.mkdtemp(prefix=f"bench_{backend}_", dir=args.dir)
+        try:
+            if backend == "json":
+                storage = make_storage(workdir)
+            else:
+                storage = SQLiteBlockStorage("BENCH", 1, "rpi-5", "0000", logger=quiet_logger(), output_dir=workdir,
+                                             tipo="SIS", batch_size=args.batch)
+            storage.write_interval_seconds = 10 ** 9
+            w0, d0 = io_written_bytes(), io_disk_bytes()
+            t0 = time.perf_counter()
+            for i, r in enumerate(readings, 1):
+                storage.add_data(r)
+                if backend == "json" and i % args.batch == 0:
+                    storage.flush()
+            storage.close()
+            elapsed = time.perf_counter() - t0
+            w1, d1 = io_written_bytes(), io_disk_bytes()
+            written = (w1 - w0) if w0 is not None else float("nan")
+            disk = (d1 - d0) if d0 is not None else float("nan")
+            print(f"{backend:<8} {len(readings) / elapsed:>11.0f} {written / 2 ** 20:>11.2f} {written / payload:>7.1f} "
+                  f"{disk / 2 ** 20:>9.2f} {disk / payload:>12.1f}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_paths(args):
+    """Costo de resolver la ruta del bloque y hacer fsync de su carpeta por guardado: con y sin caché de rutas."""
+    base = datetime.now().replace(minute=0, second=0, microsecond=0)
+    readings = [seismic_reading(base + timedelta(seconds=i * 3600 // args.readings)) for i in range(args.readings)]
+    print(f"Directorio: {args.dir} | guardados: {len(readings)} (uno por lectura)")
+    print(f"{'rutas':<10} {'ms/guardado':>12} {'p99 ms':>9}")
+    for cached in (False, True):
+        workdir = tempfile.mkdtemp(prefix="bench_paths_", dir=args.dir)
+        try:
+            storage = make_storage(workdir)
+            latencies = []
+            for r in readings:
+                if not cached:
+                    storage._drop_paths()
+                t0 = time.perf_counter()
+                storage.save_block_file(base, [r])
+                latencies.append((time.perf_counter() - t0) * 1000)
+            storage.close()
+            label = "caché" if cached else "sin caché"
+            print(f"{label:<10} {sum(latencies) / len(latencies):>12.3f} {percentile(latencies, 99):>9.3f}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_spill(args):
+    """Bloque diario con --day-seconds lecturas repartidas en el día y guardado cada 600 lecturas: sin tope vs tope de --readings."""
+    base = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    print(f"Lecturas: {args.day_seconds} (bloque 'day', intervalo 1 min) | tope: {args.readings}")
+    print(f"{'tope':<8} {'s total':>8} {'pico ingesta MiB':>17} {'pico cierre MiB':>16} {'MB escritos':>12} {'residentes':>11}")
+    for cap in (None, args.readings):
+        workdir = tempfile.mkdtemp(prefix="bench_spill_", dir=args.dir)
+        try:
+            storage = make_storage(workdir, block_type="day", interval_minutes=1, max_resident_readings=cap)
+            storage.write_interval_seconds = 10 ** 9
+            tracemalloc.start()
+            w0 = io_written_bytes()
+            t0 = time.perf_counter()
+            for i in range(args.day_seconds):
+                storage.add_data(seismic_reading(base + timedelta(seconds=i * 86400 // args.day_seconds)))
+                if (i + 1) % 600 == 0:
+                    storage.flush()
+            resident = storage.memory_usage()["resident_readings"]
+            ingest_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.reset_peak()
+            storage.close()
+            elapsed = time.perf_counter() - t0
+            close_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+            w1 = io_written_bytes()
+            mb = (w1 - w0) / 2 ** 20 if w0 is not None else float("nan")
+            print(f"{str(cap):<8} {elapsed:>8.1f} {ingest_peak:>17.1f} {close_peak:>16.1f} {mb:>12.1f} {resident:>11}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _legacy_migrate(internal_dir, usb_dir, durable=False):
+    """
+    Migración previa (solo como referencia): sha256 de origen y destino si existe, luego shutil.move.
+    Con durable=True se agrega un fsync por archivo movido, para comparar con la misma durabilidad.
+    """
+    from utils.storage.migrate_to_usb import _sha256
+    moved = 0
+    for root, dirs, files in os.walk(internal_dir):
+        rel_path = os.path.relpath(root, internal_dir)
+        dest_root = os.path.join(usb_dir, rel_path) if rel_path != '.' else usb_dir
+        os.makedirs(dest_root, exist_ok=True)
+        for file in files:
+            src_file, dest_file = os.path.join(root, file), os.path.join(dest_root, file)
+            if os.path.exists(dest_file) and _sha256(src_file) == _sha256(dest_file):
+                os.remove(src_file)
+                continue
+            shutil.move(src_file, dest_file)
+            if durable:
+                fd = os.open(dest_file, os.O_RDONLY)
+                os.fsync(fd)
+                os.close(fd)
+            moved += 1
+    return moved
+
+
+def _synthetic_tree(root, blocks, readings_per_block=60):
+    """Árbol DTA con 'blocks' bloques horarios JSON (dos tipos). Devuelve los bytes totales."""
+    base = datetime(2024, 1, 1)
+    total = 0
+    for i in range(blocks):
+        tipo = ("SIS", "RGA")[i % 2]
+        start = base + timedelta(hours=i // 2)
+        directory = os.path.join(root, start.strftime("%Y"), start.strftime("%m"), start.strftime("%d"), tipo)
+        os.makedirs(directory, exist_ok=True)
+        lecturas = [seismic_reading(start + timedelta(minutes=m)) for m in range(readings_per_block)]
+        payload = json.dumps({"TIPO": tipo, "NOMBRE": "BENCH", "IDENTIFICADOR": 1, "LECTURAS": lecturas},
+                             indent=4).encode("utf-8")
+        with open(os.path.join(directory, f"EC.BENCH.{tipo}_rpi-5_0000_{start:%Y%m%d_%H}00.json"), "wb") as f:
+            f.write(payload)
+        total += len(payload)
+    return total
+
+
+def bench_migrate(args):
+    """
+    Migración de un árbol sintético de --blocks bloques desde --src (memoria interna) a --dir (USB):
+    implementación previa vs copia con hash al vuelo y pool de hilos. Para medir la copia entre
+    dispositivos, --src y --dir deben estar en sistemas de archivos distintos.
+    """
+    from utils.storage.migrate_to_usb import migrate_internal_to_usb
+    print(f"Origen: {args.src} | destino: {args.dir} | bloques: {args.blocks}")
+    print(f"{'migración':<12} {'s':>7} {'MB/s':>8} {'archivos/s':>11}")
+    for label in ("previa", "previa+fsync", "pool"):
+        src = tempfile.mkdtemp(prefix="bench_mig_src_", dir=args.src)
+        dest = tempfile.mkdtemp(prefix="bench_mig_dst_", dir=args.dir)
+        try:
+            total = _synthetic_tree(src, args.blocks)
+            os.sync()
+            t0 = time.perf_counter()
+            if label.startswith("previa"):
+                _legacy_migrate(src, dest, durable=label == "previa+fsync")
+                os.sync()  # la implementación previa no sincroniza antes de borrar el origen
+            else:
+                migrate_internal_to_usb(src, dest, logger=quiet_logger(), workers=args.workers)
+            elapsed = time.perf_counter() - t0
+            print(f"{label:<12} {elapsed:>7.2f} {total / 2 ** 20 / elapsed:>8.1f} {args.blocks / elapsed:>11.0f}")
+        finally:
+            shutil.rmtree(src, ignore_errors=True)
+            shutil.rmtree(dest, ignore_errors=True)
+
+
+def bench_throttle(args):
+    """
+    Guardados en vivo (uno por segundo simulado, con fsync) en --dir mientras una migración de --blocks
+    bloques escribe en el mismo medio: migración sin límite vs presupuesto de --rate MB/s.
+    """
+    import threading
+    from utils.storage.io_throttle import IOThrottle
+    from utils.storage.migrate_to_usb import migrate_internal_to_usb
+    base = datetime.now().replace(minute=0, second=0, microsecond=0)
+    print(f"Origen: {args.src} | destino: {args.dir} | bloques: {args.blocks} | presupuesto: {args.rate} MB/s")
+    print(f"{'migración':<12} {'s':>7} {'MB/s':>7} {'guardado p50 ms':>16} {'p99 ms':>9} {'máx ms':>9}")
+    for rate in (None, args.rate):
+        src = tempfile.mkdtemp(prefix="bench_thr_src_", dir=args.src)
+        dest = tempfile.mkdtemp(prefix="bench_thr_dst_", dir=args.dir)
+        try:
+            total = _synthetic_tree(src, args.blocks)
+            os.sync()
+            throttle = IOThrottle(rate, logger=quiet_logger()) if rate else None
+            storage = make_storage(dest, io_throttle=throttle)
+            latencies = []
+            elapsed = []
+
+            def run():
+                t0 = time.perf_counter()
+                migrate_internal_to_usb(src, dest, logger=quiet_logger(), workers=args.workers,
+                                        hash_cache=False, io_throttle=throttle)
+                elapsed.append(time.perf_counter() - t0)
+
+            migration = threading.Thread(target=run)
+            migration.start()
+            i = 0
+            while migration.is_alive():
+                t0 = time.perf_counter()
+                storage.save_block_file(base, [seismic_reading(base + timedelta(seconds=i % 3600))])
+                latencies.append((time.perf_counter() - t0) * 1000)
+                i += 1
+                time.sleep(0.05)
+            migration.join()
+            storage.close()
+            label = f"{rate} MB/s" if rate else "sin límite"
+            print(f"{label:<12} {elapsed[0]:>7.2f} {total / 2 ** 20 / elapsed[0]:>7.1f} {percentile(latencies, 50):>16.2f} "
+                  f"{percentile(latencies, 99):>9.2f} {max(latencies, default=0):>9.2f}")
+        finally:
+            shutil.rmtree(src, ignore_errors=True)
+            shutil.rmtree(dest, ignore_errors=True)
+
+
+def bench_mirror(args):
+    """
+    --readings guardados (uno por lectura, 1 lectura/s) directo en la USB (--dir) vs modo espejo: primaria
+    en --src y una ronda de réplica cada 300 lecturas. Latencia del guardado y escrituras que recibe la USB.
+    """
+    from utils.storage.mirror import MirrorReconciler
+    base = datetime.now().replace(minute=0, second=0, microsecond=0)
+    print(f"Primaria: {args.src} | USB: {args.dir} | guardados: {args.readings}")
+    print(f"{'modo':<8} {'ms/guardado':>12} {'p99 ms':>9} {'escrituras USB':>15} {'MB a la USB':>12}")
+    for mode in ("directo", "espejo"):
+        primary = tempfile.mkdtemp(prefix="bench_mirror_pri_", dir=args.src)
+        usb = tempfile.mkdtemp(prefix="bench_mirror_usb_", dir=args.dir)
+        try:
+            mirror = MirrorReconciler(primary, logger=quiet_logger()) if mode == "espejo" else None
+            if mirror is not None:
+                mirror.set_target(usb)
+            storage = make_storage(primary if mirror is not None else usb, mirror=mirror)
+            storage.write_interval_seconds = 0
+            latencies = []
+            usb_bytes = 0
+            for i in range(args.readings):
+                t0 = time.perf_counter()
+                storage.add_data(seismic_reading(base + timedelta(seconds=i)))
+                latencies.append((time.perf_counter() - t0) * 1000)
+                if mirror is not None and (i + 1) % 300 == 0:
+                    mirror.reconcile()
+                elif mirror is None:
+                    usb_bytes += os.path.getsize(storage._resolve_path(storage.current_block).filename)
+            storage.close()
+            if mirror is not None:
+                mirror.reconcile()
+                usb_writes, usb_bytes = mirror.files_copied, mirror.bytes_copied
+            else:
+                usb_writes = len(latencies)
+            print(f"{mode:<8} {sum(latencies) / len(latencies):>12.3f} {percentile(latencies, 99):>9.3f} "
+                  f"{usb_writes:>15} {usb_bytes / 2 ** 20:>12.1f}")
+        finally:
+            shutil.rmtree(primary, ignore_errors=True)
+            shutil.rmtree(usb, ignore_errors=True)
+
+
+def _drop_page_cache(root):
+    """Descarta de la caché de páginas los archivos (ya sincronizados) bajo root: se releen del medio."""
+    for current, _, files in os.walk(root):
+        for name in files:
+            fd = os.open(os.path.join(current, name), os.O_RDONLY)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            os.close(fd)
+
+
+def bench_rehash(args):
+    """
+    Migración de un árbol cuyos --blocks bloques ya están en la USB (duplicados, p. ej. reconexiones
+    sucesivas): sha256 recalculados siempre vs caché persistente de hashes en frío y ya poblada.
+    """
+    from utils.storage.hash_cache import close_hash_cache, get_hash_cache
+    from utils.storage.migrate_to_usb import migrate_internal_to_usb
+    template = tempfile.mkdtemp(prefix="bench_rehash_tpl_", dir=args.src)
+    src = os.path.join(tempfile.mkdtemp(prefix="bench_rehash_src_", dir=args.src), "DTA")
+    dest = os.path.join(tempfile.mkdtemp(prefix="bench_rehash_dst_", dir=args.dir), "DTA")
+    try:
+        total = _synthetic_tree(template, args.blocks)
+        shutil.copytree(template, dest)
+        print(f"Origen: {args.src} | destino: {args.dir} | bloques: {args.blocks} ({total / 2 ** 20:.1f} MB)")
+        print(f"{'hashes':<14} {'s':>7} {'archivos/s':>11} {'destino releído':>16}")
+        for label, cached in (("sin caché", False), ("caché fría", True), ("caché poblada", True)):
+            # copy2 conserva el mtime: el origen es el mismo árbol en cada corrida
+            shutil.copytree(template, src)
+            os.sync()
+            _drop_page_cache(dest)
+            misses = get_hash_cache(dest).misses
+            t0 = time.perf_counter()
+            migrate_internal_to_usb(src, dest, logger=quiet_logger(), workers=args.workers, hash_cache=cached)
+            elapsed = time.perf_counter() - t0
+            reread = get_hash_cache(dest).misses - misses if cached else args.blocks
+            print(f"{label:<14} {elapsed:>7.2f} {args.blocks / elapsed:>11.0f} {reread:>16}")
+            shutil.rmtree(src, ignore_errors=True)
+    finally:
+        for root in (src, dest):
+            close_hash_cache(root)
+            shutil.rmtree(os.path.dirname(root), ignore_errors=True)
+        shutil.rmtree(template, ignore_errors=True)
+
+
+def bench_roots(args):
+    """
+    Resolución de la raíz y verificación de espacio por guardado (--readings veces): exploración de
+    /media y disk_usage en cada llamada vs servicio de raíces (StorageRoots) con descuento en memoria.
+    """
+    from utils.storage.storage_roots import StorageRoots
+    from utils.storage import storage_utils
+    from utils.storage.storage_utils import find_mounted_usb, has_enough_space
+    storage_utils.logger.setLevel(logging.ERROR)  # sin /media, cada exploración advertiría
+    workdir = tempfile.mkdtemp(prefix="bench_roots_", dir=args.dir)
+    try:
+        print(f"Directorio: {args.dir} | resoluciones: {args.readings}")
+        print(f"{'raíz':<10} {'µs/guardado':>12} {'p99 µs':>9}")
+        roots = StorageRoots(workdir, min_free_mb=0, logger=quiet_logger())
+        roots.refresh()
+        for label in ("explorar", "servicio"):
+            latencies = []
+            for _ in range(args.readings):
+                t0 = time.perf_counter()
+                if label == "explorar":
+                    usb_path = find_mounted_usb()
+                    base = usb_path if usb_path else workdir
+                    has_enough_space(base, 0)
+                else:
+                    base = roots.dta_root
+                    roots.has_space(base, 4096)
+                    roots.debit(base, 4096)
+                latencies.append((time.perf_counter() - t0) * 1e6)
+            print(f"{label:<10} {sum(latencies) / len(latencies):>12.1f} {percentile(latencies, 99):>9.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+SCENARIOS = {
+    "accumulate": bench_accumulate,
+    "columnar": bench_columnar,
+    "compact": bench_compact,
+    "journal": bench_journal,
+    "migrate": bench_migrate,
+    "mirror": bench_mirror,
+    "out_of_order": bench_out_of_order,
+    "paths": bench_paths,
+    "rehash": bench_rehash,
+    "roots": bench_roots,
+    "slots": bench_slots,
+    "throttle": bench_throttle,
+    "spill": bench_spill,
+    "sqlite": bench_sqlite,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks de almacenamiento VolcPi")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--dir", default=tempfile.gettempdir(),
+                        help="Directorio en el medio a evaluar (SD interna o USB)")
+    parser.add_argument("--readings", type=int, default=60, help="Cantidad de lecturas a ingresar")
+    parser.add_argument("--src", default=tempfile.gettempdir(), help="Origen en 'migrate', 'rehash' y 'throttle'; primaria en 'mirror' (memoria interna)")
+    parser.add_argument("--blocks", type=int, default=10000, help="Bloques del árbol sintético en 'migrate', 'rehash' y 'throttle'")
+    parser.add_argument("--workers", type=int, default=4, help="Hilos de migración en 'migrate', 'rehash' y 'throttle'")
+    parser.add_argument("--rate", type=float, default=4, help="Presupuesto de E/S (MB/s) en 'throttle'")
+    parser.add_argument("--batch", type=int, default=60, help="Lecturas por commit en 'sqlite'")
+    parser.add_argument("--day-seconds", type=int, default=86400,
+                        help="Segundos simulados en 'slots' (1 lectura/s) y 'out_of_order' (86400 = día completo)")
+    args = parser.parse_args()
+    os.makedirs(args.dir, exist_ok=True)
+    SCENARIOS[args.scenario](args)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Pruebas del modo espejo: una lectura tardía sobre un bloque ya recortado de la primaria nunca reemplaza
+la copia completa de la USB.
+
+Uso (desde la raíz del proyecto):
+    python3 test/test_mirror.py
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.storage.block_storage import BlockStorage  # noqa: E402
+from utils.storage.mirror import MirrorReconciler  # noqa: E402
+
+
+def _reading(ts):
+    return {"FECHA": ts.strftime("%Y-%m-%d"), "TIEMPO": ts.strftime("%H:%M:%S"), "VALOR": ts.minute}
+
+
+class TrimmedBlockTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="test_mirror_")
+        self.primary = os.path.join(self.tmp, "interna")
+        self.usb = os.path.join(self.tmp, "usb", "DTA")
+        os.makedirs(self.primary)
+        logger = logging.getLogger("test_mirror")
+        logger.setLevel(logging.CRITICAL)
+        self.mirror = MirrorReconciler(self.primary, trim_after_seconds=48 * 3600, logger=logger)
+        self.mirror.set_target(self.usb)
+        self.storage = BlockStorage("ST", 1, "M", "SN", logger=logger, output_dir=self.primary, tipo="SIS",
+                                    mirror=self.mirror)
+        self.block_start = (datetime.now() - timedelta(days=5)).replace(minute=0, second=0, microsecond=0)
+        self.readings = [_reading(self.block_start + timedelta(minutes=m)) for m in range(50)]
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _write_replicate_and_trim(self):
+        filename = self.storage.save_block_file(self.block_start, self.readings)
+        old = time.time() - 3 * 86400
+        os.utime(filename, (old, old))
+        self.mirror.mark_dirty(filename, os.path.getsize(filename))
+        self.mirror.reconcile()
+        self.assertEqual(self.mirror.trim(), 1)
+        self.assertFalse(os.path.exists(filename))
+        # El bloque cerrado deja de estar en la caché del almacenamiento
+        self.storage._block_cache.clear()
+        return filename
+
+    def _usb_readings(self, filename):
+        with open(self.mirror.target_path(filename)) as f:
+            return json.load(f)["LECTURAS"]
+
+    def test_late_reading_after_trim_keeps_usb_block(self):
+        filename = self._write_replicate_and_trim()
+        late = _reading(self.block_start + timedelta(minutes=55))
+        self.storage.save_block_file(self.block_start, [late])
+        self.mirror.reconcile()
+        self.assertEqual(self._usb_readings(filename), self.readings + [late])
+
+    def test_late_reading_without_usb_is_merged_on_reconnect(self):
+        filename = self._write_replicate_and_trim()
+        self.mirror.clear_target()
+        late = _reading(self.block_start + timedelta(minutes=55))
+        self.storage.save_block_file(self.block_start, [late])
+        # Sin USB la primaria solo tiene la lectura tardía; al volver, la ronda fusiona en lugar de pisar
+        self.mirror.set_target(self.usb)
+        self.mirror.reconcile()
+        self.assertEqual(self._usb_readings(filename), self.readings + [late])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Pruebas de MountWatcher con un mountinfo falso: altas y bajas de montajes bajo media_base, incluidos
+puntos de montaje con espacios (escapados como \\040), por el camino de eventos (POLLPRI) y por sondeo.
+
+Uso (desde la raíz del proyecto):
+    python3 test/test_mount_watcher.py
+"""
+import os
+import select
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.storage.mount_watcher import MountWatcher, parse_mountinfo  # noqa: E402
+
+_ROOT_LINE = "22 1 179:2 / / rw,noatime shared:1 - ext4 /dev/mmcblk0p2 rw\n"
+
+
+def _usb_line(mount_id, mount_point):
+    """Línea de mountinfo para una USB vfat; el punto de montaje se escapa como lo hace el kernel."""
+    escaped = mount_point.replace("\\", "\\134").replace(" ", "\\040").replace("\t", "\\011")
+    return f"{mount_id} 22 8:1 / {escaped} rw,nosuid,nodev shared:{mount_id} - vfat /dev/sda1 rw\n"
+
+
+class _FakePoller:
+    """
+    Sustituto de select.poll: un archivo regular nunca señala POLLPRI, así que aquí se simula la señal
+    del kernel (un evento por cada cambio escrito en el mountinfo falso).
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.pending = 0
+        self.timeouts = []
+
+    def poll(self, timeout=None):
+        self.timeouts.append(timeout)
+        if self.pending:
+            self.pending -= 1
+            return [(self.fd, select.POLLPRI | select.POLLERR)]
+        return []
+
+
+class ParseMountinfoTest(unittest.TestCase):
+    def test_escaped_spaces_and_backslashes(self):
+        text = _ROOT_LINE + _usb_line(40, "/media/pi/MI USB") + _usb_line(41, "/media/pi/a\\b")
+        self.assertEqual(parse_mountinfo(text), ["/", "/media/pi/MI USB", "/media/pi/a\\b"])
+
+    def test_short_lines_are_ignored(self):
+        self.assertEqual(parse_mountinfo("basura\n\n" + _ROOT_LINE), ["/"])
+
+
+class MountWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="test_mount_watcher_")
+        self.path = os.path.join(self.tmp, "mountinfo")
+        self.media = os.path.join(self.tmp, "media", "pi")
+        self._write(_ROOT_LINE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _write(self, text):
+        with open(self.path, "w") as f:
+            f.write(text)
+
+    def _event_watcher(self):
+        watcher = MountWatcher(self.path, media_base=self.media, use_events=True)
+        self.addCleanup(watcher.close)
+        self.assertTrue(watcher.event_driven)
+        watcher._poller = _FakePoller(watcher._file.fileno())
+        return watcher
+
+    def _change(self, watcher, text):
+        """Escribe el mountinfo falso y, en modo eventos, entrega la señal POLLPRI correspondiente."""
+        self._write(text)
+        if watcher.event_driven:
+            watcher._poller.pending += 1
+
+    def _check_add_remove(self, watcher):
+        usb = os.path.join(self.media, "MI USB")
+        self.assertEqual(watcher.media_mounts(), [])
+        self.assertFalse(watcher.wait_for_change(0.1))
+
+        self._change(watcher, _ROOT_LINE + _usb_line(40, usb))
+        self.assertTrue(watcher.wait_for_change(1.0))
+        self.assertEqual(watcher.media_mounts(), [usb])
+        self.assertTrue(watcher.is_mounted(usb))
+
+        # Montaje fuera de media_base: cambia la tabla, pero no es candidato a USB
+        other = os.path.join(self.tmp, "otro disco")
+        self._change(watcher, _ROOT_LINE + _usb_line(40, usb) + _usb_line(41, other))
+        self.assertTrue(watcher.wait_for_change(1.0))
+        self.assertEqual(watcher.media_mounts(), [usb])
+        self.assertTrue(watcher.is_mounted(other))
+
+        self._change(watcher, _ROOT_LINE)
+        self.assertTrue(watcher.wait_for_change(1.0))
+        self.assertEqual(watcher.media_mounts(), [])
+        self.assertFalse(watcher.is_mounted(usb))
+        self.assertEqual(watcher.changes, 3)
+
+    def test_add_remove_with_events(self):
+        watcher = self._event_watcher()
+        self._check_add_remove(watcher)
+
+    def test_add_remove_with_polling(self):
+        watcher = MountWatcher(self.path, media_base=self.media, poll_interval=0.02, use_events=False)
+        self.assertFalse(watcher.event_driven)
+        self._check_add_remove(watcher)
+
+    def test_event_without_change_keeps_waiting(self):
+        # Señal del kernel sin cambios visibles (p. ej. remontaje idéntico): no cuenta como cambio
+        watcher = self._event_watcher()
+        watcher._poller.pending = 1
+        self.assertFalse(watcher.wait_for_change(0.1))
+        self.assertEqual(watcher.changes, 0)
+        self.assertGreaterEqual(watcher.wakeups, 2)
+
+    def test_wait_without_timeout_blocks_in_poll(self):
+        watcher = self._event_watcher()
+        self._change(watcher, _ROOT_LINE + _usb_line(40, os.path.join(self.media, "USB")))
+        self.assertTrue(watcher.wait_for_change())
+        self.assertEqual(watcher._poller.timeouts, [None])
+
+
+if __name__ == "__main__":
+    unittest.main()
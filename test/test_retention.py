@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Pruebas de RetentionManager: nunca comprime ni elimina un bloque abierto.
+
+Uso (desde la raíz del proyecto):
+    python3 test/test_retention.py
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.storage import archiver  # noqa: E402
+from utils.storage.retention import RetentionManager  # noqa: E402
+
+
+def _write_day_block(root, day, mtime):
+    """Bloque diario EC.ST.SIS_M_SN_<día>_0000.json con lecturas cada 30 min; devuelve su ruta."""
+    directory = os.path.join(root, day.strftime("%Y"), day.strftime("%m"), day.strftime("%d"), "SIS")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"EC.ST.SIS_M_SN_{day:%Y%m%d}_0000.json")
+    readings = [{"FECHA": f"{day:%Y-%m-%d}", "TIEMPO": f"{h:02d}:{m:02d}:00"} for h in range(24) for m in (0, 30)]
+    with open(path, "w") as f:
+        json.dump({"TIPO": "SIS", "NOMBRE": "ST", "IDENTIFICADOR": "SN", "LECTURAS": readings}, f)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+class OpenDayBlockTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="test_retention_")
+        logger = logging.getLogger("test_retention")
+        logger.setLevel(logging.CRITICAL)
+        # Presupuesto de 1 byte: la raíz siempre excede y ambos niveles se ejecutan en cada pasada
+        self.retention = RetentionManager(min_age_seconds=7200, block_type="day", logger=logger)
+        self.today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _run_passes(self, path, passes=3):
+        """Simula escrituras repartidas en los últimos 90 minutos entre pasadas de retención."""
+        now = time.time()
+        for i in range(passes):
+            if not os.path.exists(path):
+                _write_day_block(self.root, self.today, now - 5400 + i * 60)
+            else:
+                os.utime(path, (now - 5400 + i * 60,) * 2)
+            self.retention.rescan(self.root)
+            self.retention.run_once()
+
+    def test_open_day_block_is_not_compressed_or_evicted(self):
+        path = _write_day_block(self.root, self.today, time.time() - 5400)
+        self.retention.add_root(self.root, budget_bytes=1)
+        self._run_passes(path)
+        self.assertTrue(os.path.exists(path))
+        archive = archiver.archive_path_for(os.path.dirname(path), f"EC.ST.SIS_M_SN_{self.today:%Y%m%d}")
+        self.assertFalse(os.path.exists(archive))
+
+    def test_recently_written_old_block_is_kept(self):
+        # Bloque de un día ya terminado pero reescrito hace poco (lecturas tardías): aún no es elegible
+        day = self.today - timedelta(days=3)
+        path = _write_day_block(self.root, day, time.time() - 600)
+        self.retention.add_root(self.root, budget_bytes=1)
+        self.retention.run_once()
+        self.assertTrue(os.path.exists(path))
+
+    def test_open_journal_blocks_eviction(self):
+        day = self.today - timedelta(days=3)
+        path = _write_day_block(self.root, day, time.time() - 3 * 86400)
+        with open(os.path.splitext(path)[0] + ".jsonl", "w") as f:
+            f.write("{}\n")
+        self.retention.add_root(self.root, budget_bytes=1)
+        self.retention.run_once()
+        self.assertTrue(os.path.exists(path))
+
+    def test_closed_day_block_is_compressed(self):
+        day = self.today - timedelta(days=3)
+        path = _write_day_block(self.root, day, time.time() - 3 * 86400)
+        self.retention.add_root(self.root, budget_bytes=10 ** 9)
+        self.retention.compress_at = 0.0  # Solo nivel 1: comprimir sin eliminar
+        self.retention.run_once()
+        self.assertFalse(os.path.exists(path))
+        archive = archiver.archive_path_for(os.path.dirname(path), f"EC.ST.SIS_M_SN_{day:%Y%m%d}")
+        self.assertIn(os.path.basename(path), archiver.load_index(archive)["members"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Pruebas del backend SQLite: ante la misma clave de intervalo prevalece la lectura de TIEMPO más reciente,
+al guardar y al fusionar la base interna con la de la USB.
+
+Uso (desde la raíz del proyecto):
+    python3 test/test_sqlite_storage.py
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.storage.sqlite_storage import _UPSERT, merge_database, open_database  # noqa: E402
+
+
+def _row(fecha, slot, tiempo, valor):
+    data = json.dumps({"FECHA": fecha, "TIEMPO": tiempo, "VALOR": valor})
+    return ("SIS", "ST", "M", "SN", "1", fecha, slot, tiempo, data)
+
+
+def _insert(path, rows):
+    conn = open_database(path)
+    try:
+        conn.executemany(_UPSERT, rows)
+    finally:
+        conn.close()
+
+
+def _values(path):
+    conn = open_database(path)
+    try:
+        rows = conn.execute("SELECT fecha, slot, tiempo, data FROM readings ORDER BY fecha, slot").fetchall()
+    finally:
+        conn.close()
+    return [(fecha, slot, tiempo, json.loads(data)["VALOR"]) for fecha, slot, tiempo, data in rows]
+
+
+class MergeDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="test_sqlite_storage_")
+        self.internal = os.path.join(self.tmp, "interna", "volcpi.sqlite")
+        self.usb = os.path.join(self.tmp, "usb", "volcpi.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_newest_row_wins_on_conflict(self):
+        _insert(self.usb, [
+            _row("2024-05-01", 1000, "10:00:40", "usb-nueva"),    # más nueva que la interna
+            _row("2024-05-01", 1001, "10:01:05", "usb-vieja"),    # más vieja que la interna
+            _row("2024-05-01", 1002, "10:02:00", "usb-empate"),   # mismo TIEMPO: se conserva el destino
+        ])
+        _insert(self.internal, [
+            _row("2024-05-01", 1000, "10:00:10", "interna-vieja"),
+            _row("2024-05-01", 1001, "10:01:50", "interna-nueva"),
+            _row("2024-05-01", 1002, "10:02:00", "interna-empate"),
+            _row("2024-05-01", 1003, "10:03:00", "interna-sola"),
+        ])
+        merge_database(self.internal, self.usb)
+        self.assertEqual(_values(self.usb), [
+            ("2024-05-01", 1000, "10:00:40", "usb-nueva"),
+            ("2024-05-01", 1001, "10:01:50", "interna-nueva"),
+            ("2024-05-01", 1002, "10:02:00", "usb-empate"),
+            ("2024-05-01", 1003, "10:03:00", "interna-sola"),
+        ])
+        self.assertFalse(os.path.exists(self.internal))
+
+    def test_upsert_never_replaces_with_older_reading(self):
+        _insert(self.usb, [_row("2024-05-01", 1000, "10:00:40", "nueva")])
+        _insert(self.usb, [_row("2024-05-01", 1000, "10:00:10", "tardia")])
+        _insert(self.usb, [_row("2024-05-01", 1001, "10:01:10", "a"), _row("2024-05-01", 1001, "10:01:10", "b")])
+        self.assertEqual(_values(self.usb), [
+            ("2024-05-01", 1000, "10:00:40", "nueva"),
+            ("2024-05-01", 1001, "10:01:10", "b"),
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
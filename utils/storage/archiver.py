@@ -0,0 +1,307 @@
+"""
+Archivado comprimido de bloques cerrados, con un archivo por día e índice.
+
+Por cada día y prefijo de bloque (EC.<estación>.<tipo>_<modelo>_<serie>_<YYYYMMDD>) se mantiene,
+en la misma carpeta DTA/YYYY/MM/DD/<TIPO>/:
+    <prefijo>.gz        miembros gzip concatenados, uno por bloque (zcat devuelve todo el día)
+    <prefijo>.gz.idx    índice JSON: bloque -> offset, largo comprimido, tamaño original y sha256
+
+Con el índice, una hora se extrae leyendo y descomprimiendo solo su miembro. Con codec 'lzma'
+la extensión es .xz (los flujos xz concatenados también son un .xz válido).
+"""
+import gzip
+import hashlib
+import json
+import logging
+import lzma
+import os
+import threading
+import time
+
+from utils.storage import columnar
+from utils.storage.block_names import parse_block_filename
+from utils.storage.journal import SPILL_SUFFIX
+
+CODECS = {
+    "gzip": (".gz", lambda data: gzip.compress(data, compresslevel=6), gzip.decompress),
+    "lzma": (".xz", lzma.compress, lzma.decompress),
+}
+INDEX_SUFFIX = ".idx"
+
+
+def _codec_for(archive_path):
+    for name, (ext, _, _) in CODECS.items():
+        if archive_path.endswith(ext):
+            return name
+    raise ValueError(f"Extensión de archivo diario desconocida: {archive_path}")
+
+
+def archive_path_for(directory, day_prefix, codec="gzip"):
+    return os.path.join(directory, day_prefix + CODECS[codec][0])
+
+
+def is_archive_file(name):
+    """True si el nombre corresponde a un archivo diario (EC.*_YYYYMMDD.gz/.xz)."""
+    if not name.startswith("EC."):
+        return False
+    return any(name.endswith(ext) and name[:-len(ext)][-8:].isdigit() for ext, _, _ in CODECS.values())
+
+
+def is_index_file(name):
+    return name.endswith(INDEX_SUFFIX) and is_archive_file(name[:-len(INDEX_SUFFIX)])
+
+
+def load_index(archive_path):
+    """Índice del archivo diario; vacío si aún no existe."""
+    try:
+        with open(archive_path + INDEX_SUFFIX, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"codec": _codec_for(archive_path), "members": {}}
+
+
+def _write_index(archive_path, index):
+    path = archive_path + INDEX_SUFFIX
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    try:
+        dir_fd = os.open(os.path.dirname(path) or ".", os.O_DIRECTORY)
+        os.fsync(dir_fd)
+        os.close(dir_fd)
+    except Exception:
+        pass
+
+
+def read_member(archive_path, name, index=None):
+    """Bytes originales de un bloque archivado (solo se descomprime su miembro) o None."""
+    if index is None:
+        index = load_index(archive_path)
+    entry = index["members"].get(name)
+    if entry is None:
+        return None
+    with open(archive_path, "rb") as f:
+        f.seek(entry["offset"])
+        compressed = f.read(entry["length"])
+    return CODECS[index.get("codec", _codec_for(archive_path))][2](compressed)
+
+
+def decode_member(name, data):
+    """Estructura JSON (TIPO, NOMBRE, IDENTIFICADOR, LECTURAS) de un bloque .json o .col."""
+    if name.endswith(columnar.EXTENSION):
+        return columnar.decode_block(data)
+    return json.loads(data.decode("utf-8"))
+
+
+def load_archived_block(archive_path, name):
+    data = read_member(archive_path, name)
+    return decode_member(name, data) if data is not None else None
+
+
+def find_archived_block(block_path):
+    """Busca un bloque (ruta del archivo suelto) dentro del archivo diario de su carpeta. Devuelve dict o None."""
+    info = parse_block_filename(os.path.basename(block_path))
+    if info is None:
+        return None
+    directory = os.path.dirname(block_path)
+    for codec in CODECS:
+        archive = archive_path_for(directory, info["day_prefix"], codec)
+        if os.path.exists(archive + INDEX_SUFFIX):
+            try:
+                found = load_archived_block(archive, os.path.basename(block_path))
+            except Exception:
+                found = None
+            if found is not None:
+                return found
+    return None
+
+
+def _encode_like(name, structure):
+    """Serializa una estructura en el formato indicado por el nombre del bloque."""
+    if name.endswith(columnar.EXTENSION):
+        info = parse_block_filename(name)
+        return columnar.encode_block(structure["TIPO"], structure["NOMBRE"], structure["IDENTIFICADOR"],
+                                     info["start"], structure["LECTURAS"])
+    return json.dumps(structure, indent=4).encode("utf-8")
+
+
+def _merge_structures(old, new):
+    """Fusiona LECTURAS por (FECHA, TIEMPO); ante duplicados prevalece 'new'."""
+    merged = {(l.get("FECHA"), l.get("TIEMPO")): l for l in old.get("LECTURAS", [])}
+    for l in new.get("LECTURAS", []):
+        merged[(l.get("FECHA"), l.get("TIEMPO"))] = l
+    result = dict(new)
+    result["LECTURAS"] = [merged[k] for k in sorted(merged)]
+    return result
+
+
+def append_block(archive_path, name, data):
+    """
+    Agrega un bloque al archivo diario. Si el bloque ya estaba archivado con otro contenido,
+    se fusionan las lecturas y el índice pasa a apuntar al nuevo miembro.
+    Devuelve False si el contenido ya estaba archivado tal cual.
+    """
+    index = load_index(archive_path)
+    digest = hashlib.sha256(data).hexdigest()
+    entry = index["members"].get(name)
+    if entry is not None:
+        if entry.get("sha256") == digest:
+            return False
+        previous = read_member(archive_path, name, index)
+        merged = _merge_structures(decode_member(name, previous), decode_member(name, data))
+        data = _encode_like(name, merged)
+        digest = hashlib.sha256(data).hexdigest()
+    compressed = CODECS[index["codec"]][1](data)
+    with open(archive_path, "ab") as f:
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        f.write(compressed)
+        f.flush()
+        os.fsync(f.fileno())
+    index["members"][name] = {"offset": offset, "length": len(compressed), "size": len(data), "sha256": digest}
+    # El índice se confirma después del miembro: un corte deja bytes huérfanos, nunca un índice inválido
+    _write_index(archive_path, index)
+    return True
+
+
+def _identity(st):
+    """Identidad de una versión de archivo: un guardado (tmp + replace o reescritura) cambia alguno de los tres."""
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _unchanged(path, identity):
+    try:
+        return _identity(os.stat(path)) == identity
+    except FileNotFoundError:
+        return identity is None
+
+
+def archive_block_file(path, codec="gzip"):
+    """
+    Archiva un bloque suelto en el archivo diario de su carpeta y elimina el original. Devuelve el archivo
+    diario, o None si el bloque se reescribió mientras se archivaba: en ese caso el original se conserva
+    (el próximo archivado fusiona la versión nueva con el miembro ya guardado).
+    """
+    name = os.path.basename(path)
+    info = parse_block_filename(name)
+    if info is None:
+        raise ValueError(f"No es un archivo de bloque: {path}")
+    archive = archive_path_for(os.path.dirname(path), info["day_prefix"], codec)
+    with open(path, "rb") as f:
+        identity = _identity(os.fstat(f.fileno()))
+        data = f.read()
+    append_block(archive, name, data)
+    # Un guardado en vivo entre la lectura y el borrado dejaría sus lecturas nuevas solo en el original
+    if not _unchanged(path, identity):
+        return None
+    os.remove(path)
+    return archive
+
+
+def merge_archive(src_archive, dest_archive):
+    """
+    Incorpora los miembros de un archivo diario a otro (p. ej. interno -> USB) y elimina el origen,
+    salvo que el origen haya cambiado durante la fusión (se conserva para la próxima).
+    """
+    identities = []
+    for path in (src_archive, src_archive + INDEX_SUFFIX):
+        try:
+            identities.append(_identity(os.stat(path)))
+        except FileNotFoundError:
+            identities.append(None)
+    src_index = load_index(src_archive)
+    added = 0
+    for name in sorted(src_index["members"]):
+        data = read_member(src_archive, name, src_index)
+        if append_block(dest_archive, name, data):
+            added += 1
+    paths = (src_archive, src_archive + INDEX_SUFFIX)
+    if not all(_unchanged(path, identity) for path, identity in zip(paths, identities)):
+        return added
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return added
+
+
+def archive_closed_blocks(root, min_age_seconds=7200, codec="gzip", logger=None, pause_seconds=0.0, stop_event=None):
+    """
+    Archiva los bloques cerrados bajo root: sin escrituras desde hace min_age_seconds y sin journal abierto.
+    Devuelve la cantidad de bloques archivados.
+    """
+    logger = logger if logger is not None else logging.getLogger("archiver")
+    cutoff = time.time() - min_age_seconds
+    archived = 0
+    for current_root, dirs, files in os.walk(root):
+        dirs.sort()
+        names = set(files)
+        for name in sorted(files):
+            if stop_event is not None and stop_event.is_set():
+                return archived
+            info = parse_block_filename(name)
+            if info is None:
+                continue
+            # Bloque aún abierto (journal o segmento de desborde) o escrito recientemente: no tocar
+            stem = os.path.splitext(name)[0]
+            if stem + ".jsonl" in names or stem + SPILL_SUFFIX in names:
+                continue
+            path = os.path.join(current_root, name)
+            try:
+                if os.path.getmtime(path) > cutoff or info["start"].timestamp() > cutoff:
+                    continue
+                if archive_block_file(path, codec) is not None:
+                    archived += 1
+            except Exception as e:
+                logger.warning(f"No se pudo archivar {path}: {e}")
+            if pause_seconds:
+                time.sleep(pause_seconds)
+    return archived
+
+
+class BlockArchiver:
+    """Hilo de baja prioridad que archiva periódicamente los bloques cerrados de una raíz DTA."""
+
+    def __init__(self, root, codec="gzip", min_age_seconds=7200, interval_seconds=3600, logger=None):
+        if codec not in CODECS:
+            raise ValueError(f"codec inválido: {codec} (opciones: {', '.join(CODECS)})")
+        self.root = root
+        self.codec = codec
+        self.min_age_seconds = min_age_seconds
+        self.interval_seconds = interval_seconds
+        self.logger = logger if logger is not None else logging.getLogger("archiver")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="block-archiver", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        count = archive_closed_blocks(self.root, self.min_age_seconds, self.codec, self.logger,
+                                      pause_seconds=0.05, stop_event=self._stop)
+        if count:
+            self.logger.info(f"Bloques archivados en {self.root}: {count}")
+        return count
+
+    def _run(self):
+        # En Linux la prioridad (nice) es por hilo: solo este hilo baja su prioridad
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except Exception:
+            pass
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.logger.error(f"Error en el archivado de bloques: {e}")
+            self._stop.wait(self.interval_seconds)
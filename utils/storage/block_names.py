@@ -0,0 +1,62 @@
+import re
+from datetime import datetime, timedelta
+
+# EC.<estación>.<tipo>_<modelo>_<serie>_<YYYYMMDD>_<HHMM>.<json|col>
+BLOCK_FILE_RE = re.compile(
+    r"^EC\.(?P<station>[^.]+)\.(?P<tipo>[^_]+)_(?P<model>.+)_(?P<serial>[^_]+)_"
+    r"(?P<date>\d{8})_(?P<hhmm>\d{4})\.(?P<ext>json|col)$"
+)
+
+
+def block_minutes(block_type):
+    """Duración en minutos de un tipo de bloque: 'hour', 'day' o 'Nmin' (N divisor de 1440, p. ej. '10min')."""
+    if block_type == 'hour':
+        return 60
+    if block_type == 'day':
+        return 1440
+    m = re.fullmatch(r"(\d+)min", str(block_type))
+    if m and int(m.group(1)) > 0 and 1440 % int(m.group(1)) == 0:
+        return int(m.group(1))
+    raise ValueError(f"block_type inválido: {block_type} (opciones: 'hour', 'day' o 'Nmin' con N divisor de 1440)")
+
+
+def block_floor(dt, block_type):
+    """Inicio del bloque que contiene dt (alineado a la medianoche)."""
+    minutes = block_minutes(block_type)
+    of_day = dt.hour * 60 + dt.minute
+    start = of_day - of_day % minutes
+    return dt.replace(hour=start // 60, minute=start % 60, second=0, microsecond=0)
+
+
+def block_end(block_start, block_type):
+    """Instante en que termina el bloque (inicio del siguiente)."""
+    return block_start + timedelta(minutes=block_minutes(block_type))
+
+
+def block_basename(station_name, tipo, model, serial_number, block_start, block_type, ext=".json"):
+    """Nombre del archivo de bloque según el tipo de bloque ('hour', 'day' u otros)."""
+    date_part = block_start.strftime("%Y%m%d")
+    if block_type == 'hour':
+        hour_part = block_start.strftime("%H00")
+    elif block_type == 'day':
+        hour_part = "0000"
+    else:
+        hour_part = block_start.strftime("%H%M")
+    return f"EC.{station_name}.{tipo}_{model}_{serial_number}_{date_part}_{hour_part}{ext}"
+
+
+def parse_block_filename(name):
+    """
+    Descompone un nombre de bloque. Devuelve dict con station, tipo, model, serial, date, hhmm,
+    ext, start (datetime) y day_prefix (nombre sin _HHMM.ext), o None si no es un bloque.
+    """
+    m = BLOCK_FILE_RE.match(name)
+    if not m:
+        return None
+    info = m.groupdict()
+    try:
+        info["start"] = datetime.strptime(info["date"] + info["hhmm"], "%Y%m%d%H%M")
+    except ValueError:
+        return None
+    info["day_prefix"] = f"EC.{info['station']}.{info['tipo']}_{info['model']}_{info['serial']}_{info['date']}"
+    return info
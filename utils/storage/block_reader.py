@@ -0,0 +1,198 @@
+"""
+Lectura por rango de tiempo sobre el árbol DTA/YYYY/MM/DD/<TIPO>/ (almacenamiento interno y USB).
+
+Los bloques que cubren un rango se calculan a partir de las fechas (una carpeta por día), sin
+recorrer el árbol con os.walk. Por cada bloque se combinan todas sus formas posibles en cada raíz:
+archivo suelto (.json o .col), miembro del archivo diario comprimido, segmento de desborde (.spill)
+y journal (.jsonl) del bloque abierto. Las lecturas se entregan en orden cronológico con un generador, un bloque a la vez.
+
+Ejemplo:
+    for lectura in read_range("SIS", datetime(2024, 5, 1, 13, 20), datetime(2024, 5, 1, 15, 5)):
+        ...
+"""
+import bisect
+import io
+import json
+import os
+from datetime import datetime
+
+from utils.storage import archiver, columnar
+from utils.storage.block_names import block_basename, block_end, block_floor, parse_block_filename
+from utils.storage.journal import SPILL_SUFFIX, journal_path_for, read_records, spill_path_for
+
+BLOCK_EXTENSIONS = (".json", columnar.EXTENSION)
+
+
+def default_roots():
+    """Raíces DTA a consultar: almacenamiento interno y, si está montada, la USB."""
+    from config import INTERNAL_BACKUP_DIR
+    from utils.storage.storage_roots import get_storage_roots
+    roots = [INTERNAL_BACKUP_DIR]
+    usb_path = get_storage_roots().mounted_usb
+    if usb_path:
+        roots.append(os.path.join(usb_path, "DTA"))
+    return roots
+
+
+def _reading_key(dt):
+    return (dt.strftime("%Y-%m-%d"), dt.strftime("%H:%M:%S"))
+
+
+def block_starts(start, end, block_type='hour'):
+    """Inicios de los bloques que intersecan [start, end]."""
+    current = block_floor(start, block_type)
+    while current <= end:
+        yield current
+        current = block_end(current, block_type)
+
+
+def block_directory(root, tipo, block_start):
+    """Carpeta DTA de un bloque (misma convención que BlockStorage._block_path)."""
+    return os.path.join(root, block_start.strftime("%Y"), block_start.strftime("%m"),
+                        block_start.strftime("%d"), str(tipo).upper())
+
+
+class _DayDirectory:
+    """Contenido de una carpeta de día/tipo (nombres e índices de archivos diarios), leído una sola vez por consulta."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.names = set(os.listdir(path))
+        except OSError:
+            self.names = set()
+        self._archives = None
+
+    def archives(self, day_prefix=None):
+        """Lista de (ruta, índice) de los archivos diarios de la carpeta, opcionalmente de un solo prefijo."""
+        if self._archives is None:
+            self._archives = {}
+            for name in self.names:
+                if archiver.is_index_file(name):
+                    path = os.path.join(self.path, name[:-len(archiver.INDEX_SUFFIX)])
+                    self._archives[path] = archiver.load_index(path)
+        return [(path, index) for path, index in self._archives.items()
+                if day_prefix is None or os.path.basename(path).startswith(day_prefix + ".")]
+
+
+def _candidate_names(directory, tipo, block_start, block_type, identity):
+    """Nombres de bloque (.json/.col) posibles para block_start en una carpeta."""
+    if identity is not None:
+        station, model, serial = identity
+        return [block_basename(station, tipo, model, serial, block_start, block_type, ext)
+                for ext in BLOCK_EXTENSIONS]
+    candidates = set(directory.names)
+    for _, index in directory.archives():
+        candidates.update(index["members"])
+    names = set()
+    for name in candidates:
+        for suffix in (".jsonl", SPILL_SUFFIX):
+            if name.endswith(suffix):
+                # Bloque abierto (journal o desborde): aún puede no existir el JSON
+                name = name[:-len(suffix)] + ".json"
+        info = parse_block_filename(name)
+        if info is not None and info["tipo"].upper() == tipo and info["start"] == block_start:
+            names.add(name)
+    return sorted(names)
+
+
+def _filter_sorted(lecturas, lo, hi):
+    """Tramo [lo, hi] de lecturas ordenadas por (FECHA, TIEMPO)."""
+    keys = [(l.get("FECHA"), l.get("TIEMPO")) for l in lecturas]
+    return lecturas[bisect.bisect_left(keys, lo):bisect.bisect_right(keys, hi)]
+
+
+def _columnar_rows(f, block_start, start, end):
+    """Lee de un bloque columnar solo las filas del rango, ubicándolas con bisect sobre los offsets."""
+    header = columnar.read_header(f)
+    base = f.tell()
+    offsets = columnar.read_offsets(f, header, base)
+    lo = bisect.bisect_left(offsets, int((start - block_start).total_seconds()))
+    hi = bisect.bisect_right(offsets, int((end - block_start).total_seconds()))
+    return columnar.read_rows(f, header, base, lo, hi)
+
+
+def _read_block_form(name, data_or_path, block_start, start, end, lo, hi):
+    """Lecturas en rango de un bloque, ya sea una ruta en disco o los bytes de un miembro archivado."""
+    if name.endswith(columnar.EXTENSION):
+        if isinstance(data_or_path, bytes):
+            return _columnar_rows(io.BytesIO(data_or_path), block_start, start, end)
+        with open(data_or_path, "rb") as f:
+            return _columnar_rows(f, block_start, start, end)
+    if isinstance(data_or_path, bytes):
+        structure = json.loads(data_or_path.decode("utf-8"))
+    else:
+        with open(data_or_path, "r") as f:
+            structure = json.load(f)
+    return _filter_sorted(structure.get("LECTURAS", []), lo, hi)
+
+
+def _block_readings(directory, name, block_start, start, end, lo, hi):
+    """Combina archivo diario, archivo suelto, desborde y journal de un bloque; ante duplicados prevalece lo más reciente."""
+    merged = {}
+    info = parse_block_filename(name)
+    for archive_path, index in directory.archives(info["day_prefix"]):
+        if name in index["members"]:
+            data = archiver.read_member(archive_path, name, index)
+            for l in _read_block_form(name, data, block_start, start, end, lo, hi):
+                merged[(l.get("FECHA"), l.get("TIEMPO"))] = l
+    if name in directory.names:
+        try:
+            for l in _read_block_form(name, os.path.join(directory.path, name), block_start, start, end, lo, hi):
+                merged[(l.get("FECHA"), l.get("TIEMPO"))] = l
+        except Exception:
+            # Bloque en escritura o dañado: se usa lo que haya en el archivo diario y el journal
+            pass
+    for segment_name in (os.path.basename(spill_path_for(name)), os.path.basename(journal_path_for(name))):
+        if segment_name in directory.names:
+            for l in read_records(os.path.join(directory.path, segment_name)):
+                key = (l.get("FECHA"), l.get("TIEMPO"))
+                if lo <= key <= hi:
+                    merged[key] = l
+    return merged
+
+
+def read_range(tipo, start, end, roots=None, block_type='hour', station_name=None, model=None, serial_number=None):
+    """
+    Genera las lecturas de 'tipo' con start <= FECHA/TIEMPO <= end, en orden cronológico.
+
+    roots: raíces DTA a combinar (por defecto interna + USB). Si se indican station_name, model y
+    serial_number, los nombres de archivo se construyen directamente; si no, se listan una vez las
+    carpetas de cada día y se incluyen todos los equipos de ese tipo.
+    """
+    tipo = str(tipo).upper()
+    if roots is None:
+        roots = default_roots()
+    identity = (station_name, model, serial_number) if None not in (station_name, model, serial_number) else None
+    lo, hi = _reading_key(start), _reading_key(end)
+    directories = {}
+    for block_start in block_starts(start, end, block_type):
+        merged = {}
+        for root in roots:
+            path = block_directory(root, tipo, block_start)
+            directory = directories.get(path)
+            if directory is None:
+                directory = directories[path] = _DayDirectory(path)
+            if not directory.names:
+                continue
+            for name in _candidate_names(directory, tipo, block_start, block_type, identity):
+                merged.update(_block_readings(directory, name, block_start, start, end, lo, hi))
+        for key in sorted(merged):
+            yield merged[key]
+
+
+def count_range(tipo, start, end, **kwargs):
+    """Cantidad de lecturas en el rango (recorre el generador sin acumular)."""
+    return sum(1 for _ in read_range(tipo, start, end, **kwargs))
+
+
+if __name__ == "__main__":
+    # Uso: python3 -m utils.storage.block_reader SIS "2024-05-01 13:20" "2024-05-01 15:05" [raíz ...]
+    import sys
+    if len(sys.argv) < 4:
+        print('Uso: python3 -m utils.storage.block_reader <TIPO> "YYYY-MM-DD HH:MM" "YYYY-MM-DD HH:MM" [raíz ...]')
+        sys.exit(1)
+    fmt = "%Y-%m-%d %H:%M"
+    for lectura in read_range(sys.argv[1], datetime.strptime(sys.argv[2], fmt), datetime.strptime(sys.argv[3], fmt),
+                              roots=sys.argv[4:] or None):
+        print(json.dumps(lectura))
@@ -1,12 +1,92 @@
 import os
 import json
+import hashlib
+import sys
+import itertools
+import queue
 import threading
 import time
+from collections import OrderedDict, deque
+from contextlib import nullcontext
 from datetime import datetime
 from utils.log_utils import setup_logger
+from utils.storage.journal import BlockJournal, iter_records, journal_path_for, read_records, spill_path_for
+from utils.storage import columnar, spill_merge
+from utils.storage.catalog import BlockSummary
+from utils.storage.compact_json import CompactBlockWriter
+from utils.storage.archiver import find_archived_block
+from utils.storage.block_names import block_basename, block_end, block_floor, block_minutes
+
+# Modos de escritura soportados:
+# - 'rewrite': reescribe el JSON completo del bloque cada write_interval_seconds (comportamiento histórico)
+# - 'journal': agrega cada lectura a un journal JSONL con fsync y construye el JSON al cerrar el bloque
+WRITE_MODES = ('rewrite', 'journal')
+
+# Políticas ante cola llena del escritor asíncrono
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+# Formatos de archivo de bloque: 'json' (EC.*.json con indent=4), 'json_compact' (EC.*.json sin sangría,
+# escrito en streaming, ver utils/storage/compact_json.py) o 'columnar' (EC.*.col, binario, ver utils/storage/columnar.py)
+BLOCK_FORMATS = ('json', 'json_compact', 'columnar')
+
+# Marca en la cola: hay pedidos de control (parada, cierres programados) en _control. Los pedidos no viajan
+# en la cola de datos, de modo que drop_oldest nunca los descarta; perder una marca solo retrasa su atención
+# hasta el fin del lote en curso.
+_WAKE = object()
+_STOP = object()  # Pedido de control: detener el hilo escritor tras vaciar la cola
+_PENDING_COMMIT = object()  # Identidad de caché: versión escrita por nosotros, pendiente del coordinador
+# Antigüedad mínima del espacio libre estimado para volver a medirlo ante un guardado sin espacio
+_LOW_SPACE_REFRESH_SECONDS = 30
+
+
+class _OpenBlock:
+    """Estado en memoria de un bloque abierto (lecturas, índice de intervalos, journal y temporizador)."""
+    __slots__ = ("start", "data", "slot_index", "journal", "dirty", "last_write_ts", "rollover_token",
+                 "spill_paths")
+
+    def __init__(self, start, last_write_ts):
+        self.start = start
+        self.data = []
+        # Índice (FECHA, hora, intervalo) -> posición en data para deduplicar en O(1)
+        self.slot_index = {}
+        self.journal = None
+        # Hay lecturas aún no persistidas
+        self.dirty = False
+        self.last_write_ts = last_write_ts
+        self.rollover_token = None
+        # Segmentos de desborde (.spill) con lecturas liberadas de memoria; se fusionan al cerrar el bloque
+        self.spill_paths = []
+
+
+class _BlockPath:
+    """Ruta resuelta de un bloque en una raíz: carpeta (ya creada), archivo y fd de la carpeta para fsync."""
+    __slots__ = ("directory", "filename", "dir_fd")
+
+    def __init__(self, directory, filename):
+        self.directory = directory
+        self.filename = filename
+        self.dir_fd = None
+
+    def fsync_directory(self):
+        if self.dir_fd is None:
+            self.dir_fd = os.open(self.directory, os.O_DIRECTORY)
+        os.fsync(self.dir_fd)
+
+    def close(self):
+        if self.dir_fd is not None:
+            try:
+                os.close(self.dir_fd)
+            except OSError:
+                pass
+            self.dir_fd = None
+
 
 class BlockStorage:
-    def __init__(self, station_name, identifier, model, serial_number, logger=None, output_dir=None, block_type='hour', tipo="GENERIC", interval_minutes=1, extractor_func=None):
+    def __init__(self, station_name, identifier, model, serial_number, logger=None, output_dir=None, block_type='hour', tipo="GENERIC", interval_minutes=1, extractor_func=None, write_mode='rewrite',
+                 async_writer=False, queue_size=1000, overflow_policy='drop_oldest', commit_coordinator=None,
+                 block_format='json', catalog=None, retention=None, rollover_scheduler=None,
+                 rollover_grace_seconds=2.0, max_open_blocks=2, max_resident_readings=None, io_throttle=None,
+                 mirror=None, storage_roots=None, report_interval_seconds=3600):
         self.station_name = station_name
         self.identifier = identifier
         self.model = model
@@ -18,66 +98,653 @@ class BlockStorage:
         else:
             self.logger = setup_logger("block_storage", log_file="block_storage.log")
         self.output_dir = output_dir
-        self.block_type = block_type  # 'hour', 'day', etc.
-        self.current_block = None
-        self.block_data = []
+        block_minutes(block_type)  # valida: 'hour', 'day' o 'Nmin' (p. ej. '10min')
+        self.block_type = block_type
+        # Bloques abiertos (LRU): cada lectura va al bloque de su propia FECHA/TIEMPO, de modo que
+        # las lecturas tardías o reenviadas (lotes LoRa, datos tras un corte serial) no reabren archivos
+        self._blocks = OrderedDict()
+        self.max_open_blocks = max(1, max_open_blocks)
+        # Tope de lecturas en memoria (todos los bloques abiertos); al superarlo se desbordan a disco.
+        # None = sin tope (comportamiento histórico)
+        self.max_resident_readings = max_resident_readings
+        self.spilled_readings = 0
+        self.spilled_bytes = 0
+        self.spill_events = 0
+        self._reading_bytes = None
         self.interval_minutes = interval_minutes
         self.extractor_func = extractor_func
+        # Acumulación por intervalos (accumulate): (FECHA, hora) -> {data, index TIEMPO -> entrada, dirty}
         self.data_accumulator = {}
         self._lock = threading.RLock()
         # Buffer de escritura para reducir desgaste: escribe cada N segundos
         self.write_interval_seconds = 10  # configurable
-        self._last_write_ts = 0.0
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"write_mode inválido: {write_mode} (opciones: {', '.join(WRITE_MODES)})")
+        self.write_mode = write_mode
+        # Caché de bloques abiertos: archivo -> (identidad del archivo, mapa (FECHA,TIEMPO) -> lectura)
+        self._block_cache = {}
+        # Rutas resueltas: (output_dir, inicio de bloque) -> _BlockPath. Evita strftime, makedirs y la
+        # apertura de la carpeta en cada guardado (cada syscall de metadatos cruza el bus USB)
+        self._paths = OrderedDict()
+        if block_format not in BLOCK_FORMATS:
+            raise ValueError(f"block_format inválido: {block_format} (opciones: {', '.join(BLOCK_FORMATS)})")
+        if block_format == 'columnar' and not columnar.supports_tipo(tipo):
+            raise ValueError(f"Formato columnar no disponible para el tipo {tipo}")
+        self.block_format = block_format
+        self._compact_writer = (
+            CompactBlockWriter(tipo, station_name, identifier) if block_format == 'json_compact' else None
+        )
+        # Coordinador de commits compartido (fsync agrupado entre almacenamientos); None = fsync propio
+        self._commit_coordinator = commit_coordinator
+        self._tmp_seq = itertools.count()
+        # Catálogo SQLite de bloques (utils/storage/catalog.py); se actualiza en cada guardado
+        self._catalog = catalog
+        # Gestor de retención/cuotas (utils/storage/retention.py): recibe el tamaño de cada guardado
+        self._retention = retention
+        # Cierre del bloque en su límite de reloj aunque no lleguen más lecturas (utils/storage/rollover.py)
+        self._rollover_scheduler = rollover_scheduler
+        self.rollover_grace_seconds = rollover_grace_seconds
+        # Presupuesto de E/S de la migración (utils/storage/io_throttle.py): los fsync propios tienen
+        # prioridad y su latencia regula la tasa de la migración
+        self._io_throttle = io_throttle
+        # Modo espejo (utils/storage/mirror.py): cada guardado confirmado queda marcado para replicar a la USB
+        self._mirror = mirror
+        # Servicio de raíces (utils/storage/storage_roots.py): cada guardado descuenta su tamaño del espacio libre
+        self._storage_roots = storage_roots
+        self._low_space = False
+        # Escritor asíncrono: los productores (hilo serial, managers) solo encolan
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow_policy inválida: {overflow_policy} (opciones: {', '.join(OVERFLOW_POLICIES)})")
+        self.overflow_policy = overflow_policy
+        self.queue_batch_size = 100
+        self._queue = None
+        self._control = deque()  # Pedidos de control del escritor: _STOP o inicio de bloque a cerrar
+        self._writer_thread = None
+        self._stats_lock = threading.Lock()
+        self.queue_enqueued = 0
+        self.queue_dropped = 0
+        self.queue_max_depth = 0
+        # Reporte periódico de estadísticas en el log (como CommitCoordinator); 0/None lo desactiva
+        self.report_interval_seconds = report_interval_seconds
+        self._last_report_ts = time.time()
+        self._reported_dropped = 0
+        if async_writer:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._writer_thread = threading.Thread(target=self._writer_loop, name=f"writer-{tipo}", daemon=True)
+            self._writer_thread.start()
 
     def get_block_start(self, dt):
-        if self.block_type == 'hour':
-            return dt.replace(minute=0, second=0, microsecond=0)
-        elif self.block_type == 'day':
-            return dt.replace(hour=0, minute=0, second=0, microsecond=0)
-        # Puedes agregar más tipos si lo necesitas
-        return dt
-
-    def add_data(self, raw):
+        return block_floor(dt, self.block_type)
+
+    def get_block_end(self, block_start):
+        return block_end(block_start, self.block_type)
+
+    @property
+    def current_block(self):
+        """Inicio del bloque abierto más reciente (None si no hay bloques abiertos)."""
+        return max(self._blocks) if self._blocks else None
+
+    @property
+    def block_data(self):
+        """Lecturas en memoria del bloque abierto más reciente."""
+        current = self.current_block
+        return self._blocks[current].data if current is not None else []
+
+    def add_data(self, raw, timestamp=None):
+        """
+        Agrega una lectura. El bloque destino sale de la FECHA/TIEMPO de la propia lectura; timestamp
+        (datetime) permite ingresar lecturas tardías o reenviadas con su hora original.
+        """
+        if timestamp is None and isinstance(raw, dict) and "FECHA" in raw and "TIEMPO" in raw:
+            timestamp = self._reading_time(raw)
+        now = timestamp if timestamp is not None else datetime.now()
+        if self._queue is not None:
+            # Modo asíncrono: no bloquear al productor con serialización ni fsync
+            self._enqueue(raw, now)
+            return
+        self._ingest(raw, now)
+
+    @staticmethod
+    def _reading_time(data):
+        """datetime de FECHA ('YYYY-MM-DD') y TIEMPO ('HH:MM:SS') sin strptime; None si no son válidos."""
+        try:
+            f, t = data["FECHA"], data["TIEMPO"]
+            return datetime(int(f[0:4]), int(f[5:7]), int(f[8:10]), int(t[0:2]), int(t[3:5]), int(t[6:8]))
+        except (KeyError, TypeError, ValueError, IndexError):
+            return None
+
+    def _ingest(self, raw, now, persist=True):
+        """Incorpora una lectura a su bloque en memoria; con persist=True aplica la política de escritura."""
         self._lock.acquire()
         try:
-            now = datetime.now()
-            block_start = self.get_block_start(now)
-            # Guardar el dato crudo relevante (sin loguear en logger)
-            if self.current_block and self.current_block != block_start:
-                # Forzar guardado del bloque anterior antes de cambiar
-                self.save_block_file(self.current_block, self.block_data)
-                self.block_data = []
-                # Reiniciar temporizador de escritura para el nuevo bloque
-                self._last_write_ts = time.time()
-            self.current_block = block_start
             # Usar extractor_func si está definido, si no, guardar raw como está
             if self.extractor_func:
                 data = self.extractor_func(raw, now)
             else:
                 data = raw
-            if data:
-                # Guardar solo la última lectura por bloque de interval_minutes minutos
-                minuto = int(data["TIEMPO"][3:5])
-                bloque = (minuto // self.interval_minutes) * self.interval_minutes
-                idx = next((i for i, d in enumerate(self.block_data)
-                            if d["FECHA"] == data["FECHA"] and
-                               int(d["TIEMPO"][3:5]) // self.interval_minutes == minuto // self.interval_minutes and
-                               d["TIEMPO"][:2] == data["TIEMPO"][:2]), None)
-                if idx is not None:
-                    self.block_data[idx] = data  # Sobrescribe la lectura previa de ese bloque
-                else:
-                    self.block_data.append(data)
-                # Guardar en disco solo si pasó el intervalo configurado
-                now_ts = time.time()
-                if (now_ts - self._last_write_ts) >= self.write_interval_seconds:
-                    self.save_block_file(self.current_block, self.block_data)
-                    self._last_write_ts = now_ts
+            if not data:
+                return
+            block_start = self.get_block_start(self._reading_time(data) or now)
+            state = self._get_block(block_start)
+            # Guardar solo la última lectura por bloque de interval_minutes minutos
+            self._put_reading(state, data)
+            state.dirty = True
+            if self.write_mode == 'journal':
+                # Append-only: una línea por lectura; el JSON del bloque se construye al cerrarlo
+                state.journal.append(data, fsync=False)
+            if self.max_resident_readings and self._resident_readings() > self.max_resident_readings:
+                self._spill(max(self._blocks.values(), key=lambda s: len(s.data)))
+            if persist:
+                self._maybe_persist()
         finally:
             self._lock.release()
 
+    def _get_block(self, block_start):
+        """Estado del bloque (abriéndolo si hace falta); al superar max_open_blocks cierra el menos usado."""
+        state = self._blocks.get(block_start)
+        if state is not None:
+            self._blocks.move_to_end(block_start)
+            return state
+        # last_write_ts = 0: la primera lectura de un bloque nuevo se guarda de inmediato (como el original)
+        state = _OpenBlock(block_start, 0.0)
+        self._blocks[block_start] = state
+        if self.write_mode == 'journal':
+            self._open_journal(state)
+        spill_path = spill_path_for(self._resolve_path(block_start).filename)
+        if os.path.exists(spill_path):
+            # Desborde de una ejecución previa: el bloque continúa en modo segmento
+            state.spill_paths.append(spill_path)
+        self._schedule_rollover(state)
+        while len(self._blocks) > self.max_open_blocks:
+            oldest = next(iter(self._blocks))
+            self._close_block(oldest)
+        return state
+
+    def _live_fsync(self):
+        """Contexto de un fsync en vivo (prioridad sobre la migración y latencia para su presupuesto)."""
+        return self._io_throttle.live_fsync() if self._io_throttle is not None else nullcontext()
+
+    def _maybe_persist(self):
+        """Persiste lecturas pendientes: fsync de journals o guardado de bloques cuyo write_interval_seconds pasó."""
+        with self._lock:
+            now_ts = time.time()
+            for state in list(self._blocks.values()):
+                if not state.dirty:
+                    continue
+                if self.write_mode == 'journal':
+                    if self._commit_coordinator is not None:
+                        self._commit_coordinator.request_sync(state.journal.path)
+                    else:
+                        with self._live_fsync():
+                            state.journal.sync()
+                    state.dirty = False
+                    continue
+                # Guardar en disco solo si pasó el intervalo configurado
+                if (now_ts - state.last_write_ts) >= self.write_interval_seconds:
+                    self._save_state(state)
+                    state.last_write_ts = now_ts
+                    state.dirty = False
+            # Acumulación por intervalos: punto de control aunque no lleguen muestras nuevas
+            for hour_key, acc in self.data_accumulator.items():
+                if acc["dirty"] and (now_ts - acc["last_write_ts"]) >= self.write_interval_seconds:
+                    self._save_accumulated_file(hour_key, acc)
+        if self.report_interval_seconds and now_ts - self._last_report_ts >= self.report_interval_seconds:
+            self._last_report_ts = now_ts
+            self._report()
+
+    def _report(self):
+        """
+        Estadísticas en el log: memoria y desbordes (para ajustar max_resident_readings en campo) y cola del
+        escritor asíncrono (advertencia si hubo descartes desde el último reporte).
+        """
+        mem = self.memory_usage()
+        limit = mem["max_resident_readings"] if mem["max_resident_readings"] is not None else "sin tope"
+        self.logger.info(
+            f"[{str(self.tipo).upper()}] Memoria: {mem['resident_readings']} lecturas residentes (tope {limit}) | "
+            f"caché {mem['cached_readings']} | ~{mem['estimated_bytes'] / 2 ** 20:.1f} MB | desbordes "
+            f"{mem['spill_events']} ({mem['spilled_readings']} lecturas, {mem['spilled_bytes'] / 2 ** 20:.1f} MB) | "
+            f"bloques desbordados abiertos {mem['spilled_blocks']}")
+        if self._queue is None:
+            return
+        st = self.queue_stats()
+        new_drops = st["dropped"] - self._reported_dropped
+        self._reported_dropped = st["dropped"]
+        log = self.logger.warning if new_drops else self.logger.info
+        log(f"[{str(self.tipo).upper()}] Cola de escritura: profundidad {st['depth']} (máx {st['max_depth']}) | "
+            f"encoladas {st['enqueued']} | descartadas {st['dropped']} ({new_drops} desde el último reporte, "
+            f"{st['policy']})")
+
+    # --- Escritor asíncrono ---
+    def _enqueue(self, raw, now):
+        item = (raw, now)
+        dropped = 0
+        if self.overflow_policy == 'block':
+            self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                dropped = 1
+                if self.overflow_policy == 'drop_oldest':
+                    try:
+                        if self._queue.get_nowait() is _WAKE:
+                            dropped = 0  # Solo una marca (su pedido sigue en _control)
+                        self._queue.task_done()
+                    except queue.Empty:
+                        pass
+                    try:
+                        self._queue.put_nowait(item)
+                    except queue.Full:
+                        dropped = 1
+        with self._stats_lock:
+            self.queue_enqueued += 1
+            self.queue_dropped += dropped
+            depth = self._queue.qsize()
+            if depth > self.queue_max_depth:
+                self.queue_max_depth = depth
+            total_dropped = self.queue_dropped
+        if dropped and total_dropped % 100 == 1:
+            self.logger.warning(f"[{str(self.tipo).upper()}] Cola de escritura llena ({self.overflow_policy}): "
+                                f"{total_dropped} lecturas descartadas")
+
+    def _writer_loop(self):
+        """Hilo escritor: agrupa lo encolado y lo persiste con una sola escritura por lote."""
+        while True:
+            try:
+                item = self._queue.get(timeout=max(self.write_interval_seconds, 1))
+            except queue.Empty:
+                # Sin datos nuevos: persistir lo pendiente aunque el productor esté en silencio
+                stop = False
+                try:
+                    stop = self._run_control()
+                    self._maybe_persist()
+                except Exception as e:
+                    self.logger.error(f"[{str(self.tipo).upper()}] Error en escritor asíncrono: {e}")
+                if stop:
+                    self._control.clear()
+                    return
+                continue
+            batch = [item]
+            while len(batch) < self.queue_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            try:
+                for it in batch:
+                    if it is _WAKE:
+                        # Pedidos en orden con lo encolado antes de su marca
+                        stop = self._run_control() or stop
+                        continue
+                    try:
+                        self._ingest(it[0], it[1], persist=False)
+                    except Exception as e:
+                        self.logger.error(f"[{str(self.tipo).upper()}] Lectura descartada por error: {e}")
+                # Pedidos cuya marca se descartó por cola llena
+                stop = self._run_control() or stop
+                self._maybe_persist()
+            except Exception as e:
+                self.logger.error(f"[{str(self.tipo).upper()}] Error en escritor asíncrono: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop and self._queue.empty():
+                self._control.clear()
+                return
+
+    def _run_control(self):
+        """Atiende los pedidos de control pendientes. Devuelve True si se pidió detener el escritor."""
+        stop = False
+        while self._control:
+            request = self._control.popleft()
+            if request is _STOP:
+                stop = True
+            else:
+                self._rollover(request)
+        if stop:
+            # La parada se conserva hasta vaciar la cola
+            self._control.append(_STOP)
+        return stop
+
+    def _request_control(self, request):
+        """Encola un pedido de control y despierta al escritor (si la cola está llena, ya está despierto)."""
+        self._control.append(request)
+        try:
+            self._queue.put_nowait(_WAKE)
+        except queue.Full:
+            pass
+
+    def _drain(self):
+        """Espera a que el escritor asíncrono procese todo lo encolado (no llamar con el lock tomado)."""
+        if self._queue is not None and self._writer_thread is not None and self._writer_thread.is_alive():
+            self._queue.join()
+
+    def queue_stats(self):
+        """Contadores del escritor asíncrono (profundidad actual, máxima, descartes)."""
+        with self._stats_lock:
+            return {
+                "async": self._queue is not None,
+                "depth": self._queue.qsize() if self._queue is not None else 0,
+                "max_depth": self.queue_max_depth,
+                "enqueued": self.queue_enqueued,
+                "dropped": self.queue_dropped,
+                "policy": self.overflow_policy,
+            }
+
+    def _schedule_rollover(self, state):
+        """Agenda el cierre del bloque recién abierto para su límite de reloj (más un margen)."""
+        if self._rollover_scheduler is None:
+            return
+        when = self.get_block_end(state.start).timestamp() + self.rollover_grace_seconds
+        state.rollover_token = self._rollover_scheduler.schedule(
+            when, lambda bs=state.start: self._on_rollover_timer(bs))
+
+    def _on_rollover_timer(self, block_start):
+        """Callback del planificador (hilo compartido): no debe bloquearse esperando la cola."""
+        if self._queue is not None and self._writer_thread is not None and self._writer_thread.is_alive():
+            # En orden con lo ya encolado: el escritor cierra el bloque tras ingerir sus últimas lecturas
+            self._request_control(block_start)
+            return
+        self._rollover(block_start)
+
+    def _rollover(self, block_start):
+        """Cierra block_start si sigue abierto (pudo cerrarse antes por el LRU)."""
+        with self._lock:
+            if block_start not in self._blocks:
+                return
+            self._close_block(block_start)
+        self.logger.info(f"[{str(self.tipo).upper()}] Bloque {block_start:%Y-%m-%d %H:%M} cerrado por límite de tiempo")
+
+    def close(self):
+        """Detiene el escritor asíncrono (si existe) y guarda el bloque actual."""
+        if self._rollover_scheduler is not None:
+            with self._lock:
+                for state in self._blocks.values():
+                    self._rollover_scheduler.cancel(state.rollover_token)
+        if self._writer_thread is not None and self._writer_thread.is_alive():
+            self._request_control(_STOP)
+            self._writer_thread.join(timeout=10)
+        self.flush()
+        if self._commit_coordinator is not None:
+            self._commit_coordinator.commit_now()
+        with self._lock:
+            # Bloques desbordados: el JSON queda completo y se eliminan sus segmentos
+            for state in self._blocks.values():
+                if state.spill_paths:
+                    self._compact_spilled(state)
+            self._drop_paths()
+        self._report()
+
+    def _slot_key(self, data):
+        """Clave de intervalo (FECHA, hora, bloque de interval_minutes) de una lectura."""
+        return (data["FECHA"], data["TIEMPO"][:2], int(data["TIEMPO"][3:5]) // self.interval_minutes)
+
+    def _put_reading(self, state, data):
+        """Inserta la lectura o sobrescribe la previa de su mismo intervalo (costo constante)."""
+        key = self._slot_key(data)
+        idx = state.slot_index.get(key)
+        if idx is not None:
+            state.data[idx] = data  # Sobrescribe la lectura previa de ese bloque
+        else:
+            state.slot_index[key] = len(state.data)
+            state.data.append(data)
+
+    def _save_state(self, state):
+        """Guardado periódico de un bloque: JSON completo o, si ya desbordó, append de lo residente a su segmento."""
+        if state.spill_paths:
+            self._spill(state)
+        else:
+            self.save_block_file(state.start, state.data)
+
+    def _resident_readings(self):
+        return sum(len(state.data) for state in self._blocks.values())
+
+    def _spill(self, state):
+        """
+        Desborda a disco las lecturas en memoria de un bloque: se agregan (append + fsync) a su segmento
+        .spill y se liberan, junto con la caché del archivo. Desde ahí los guardados del bloque son appends
+        al segmento y el archivo se reconstruye una sola vez al cerrarlo (_save_spilled_block, en streaming).
+        """
+        filename = self._resolve_path(state.start).filename
+        path = spill_path_for(filename)
+        if state.data:
+            segment = BlockJournal(path)
+            try:
+                for lectura in state.data:
+                    segment.append(lectura, fsync=False)
+                with self._live_fsync():
+                    segment.sync()
+            finally:
+                segment.close()
+            self.spilled_readings += len(state.data)
+            self.spilled_bytes += segment.bytes_written
+            self.spill_events += 1
+        if path not in state.spill_paths:
+            state.spill_paths.append(path)
+            self.logger.info(f"[{str(self.tipo).upper()}] Bloque {state.start:%Y-%m-%d %H:%M} desbordado a {path}")
+        state.data = []
+        state.slot_index = {}
+        state.dirty = False
+        self._block_cache.pop(filename, None)
+        if state.journal is not None:
+            # Lo que contenía el journal ya está en el segmento
+            state.journal.remove()
+            state.journal = None
+            self._open_journal(state)
+
+    def _spill_sources(self, state):
+        """Segmentos del bloque en orden de escritura, más el de la raíz actual si fue trasladado (p. ej. migrado a la USB)."""
+        paths = list(state.spill_paths)
+        current = spill_path_for(self._resolve_path(state.start).filename)
+        if current not in paths:
+            paths.append(current)
+        return paths
+
+    def _spill_runs(self, paths, run_prefix):
+        return spill_merge.write_runs(paths, self._slot_key, run_prefix,
+                                      self.max_resident_readings or spill_merge.RUN_SIZE)
+
+    def _save_spilled_block(self, state):
+        """
+        Guardado final de un bloque desbordado: archivo previo, segmentos y memoria se fusionan en
+        streaming (spill_merge.py), sin armar la lista completa de lecturas. Devuelve la ruta escrita
+        o None si no había lecturas.
+        """
+        with self._lock:
+            path = self._resolve_path(state.start)
+            cached = self._block_cache.get(path.filename)
+            if cached is not None and cached[0] is _PENDING_COMMIT:
+                # La base se lee de disco: confirmar antes un guardado aún pendiente del coordinador
+                self._commit_coordinator.commit_now()
+            elif self._mirror is not None:
+                self._mirror.restore(path.filename)
+            runs = self._spill_runs(self._spill_sources(state), spill_path_for(path.filename))
+            try:
+                try:
+                    return self._write_spilled(state, path, runs)
+                except ValueError as e:
+                    # Archivo previo desordenado o dañado: fusión en memoria (con su recuperación best-effort)
+                    self.logger.warning(f"[{str(self.tipo).upper()}] Fusión en streaming no aplicable ({e}); "
+                                        f"se fusiona en memoria")
+                    lecturas = list(spill_merge.merge_spilled(runs, state.data, self._slot_key))
+                    return self.save_block_file(state.start, lecturas) if lecturas else None
+            finally:
+                spill_merge.remove_runs(runs)
+
+    def _write_spilled(self, state, path, runs):
+        filename = path.filename
+        self._block_cache.pop(filename, None)
+        identity = self._file_identity(filename)
+        self._ensure_space(filename, identity[2] if identity is not None else 0)
+        summary = BlockSummary() if self._catalog is not None else None
+        count = 0
+
+        def readings():
+            nonlocal count
+            merged = spill_merge.merge_with_base(
+                spill_merge.merge_spilled(runs, state.data, self._slot_key),
+                spill_merge.iter_base_readings(filename, self.block_format))
+            for rec in merged:
+                count += 1
+                if summary is not None:
+                    summary.add(rec)
+                yield rec
+
+        coordinator = self._commit_coordinator
+        tmp_filename = f"{filename}.{next(self._tmp_seq)}.tmp" if coordinator is not None else filename + ".tmp"
+        try:
+            with self._open_tmp(state.start, tmp_filename) as f:
+                size, digest = self._write_stream(f, state.start, readings())
+                if coordinator is None:
+                    f.flush()
+                    with self._live_fsync():
+                        os.fsync(f.fileno())
+        except BaseException:
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+            raise
+        if not count:
+            os.remove(tmp_filename)
+            return None
+        if coordinator is not None:
+            coordinator.register_replace(tmp_filename, filename, lambda ok, fn=filename: self._on_committed(fn, ok))
+        else:
+            os.replace(tmp_filename, filename)
+            if self._mirror is not None:
+                self._mirror.mark_dirty(filename, size)
+            try:
+                with self._live_fsync():
+                    path.fsync_directory()
+            except Exception:
+                path.close()
+        self._record_in_catalog(state.start, filename, None, size, digest,
+                                summary.result() if summary is not None else None)
+        self.logger.info(f"{self.tipo} bloque desbordado guardado: {filename} ({count} lecturas)")
+        return filename
+
+    def _remove_spill_files(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _compact_spilled(self, state):
+        """Escribe el JSON completo de un bloque desbordado y elimina sus segmentos (el bloque sigue abierto)."""
+        filename = self._save_spilled_block(state)
+        if filename:
+            if self._commit_coordinator is not None:
+                self._commit_coordinator.commit_now()
+            self._block_cache.pop(filename, None)
+        self._remove_spill_files(state.spill_paths)
+        state.spill_paths = []
+        state.data = []
+        state.slot_index = {}
+        state.dirty = False
+
+    def _relocate_spill(self, state):
+        """Tras un cambio de raíz, reúne los segmentos del bloque en uno solo dentro de la raíz nueva."""
+        current = spill_path_for(self._resolve_path(state.start).filename)
+        if current in state.spill_paths or os.path.exists(current):
+            return
+        # Segmentos anteriores fusionados en streaming al segmento nuevo; lo residente se agrega después (_spill)
+        runs = self._spill_runs(state.spill_paths, current)
+        try:
+            segment = BlockJournal(current)
+            try:
+                for rec in spill_merge.merge_spilled(runs, [], self._slot_key):
+                    segment.append(rec, fsync=False)
+                with self._live_fsync():
+                    segment.sync()
+            finally:
+                segment.close()
+        finally:
+            spill_merge.remove_runs(runs)
+        old_paths, state.spill_paths = state.spill_paths, []
+        self._spill(state)
+        self._remove_spill_files(old_paths)
+
+    def memory_usage(self):
+        """
+        Medidor de memoria del almacenamiento: lecturas residentes en bloques abiertos y en la caché de
+        archivos, bytes estimados (tamaño de una lectura de muestra) y lecturas desbordadas a disco.
+        """
+        with self._lock:
+            resident = self._resident_readings()
+            cached = sum(len(entry[1]) for entry in self._block_cache.values())
+            if self._reading_bytes is None:
+                sample = next((s.data[0] for s in self._blocks.values() if s.data), None)
+                if sample is not None:
+                    self._reading_bytes = sys.getsizeof(sample) + sum(
+                        sys.getsizeof(k) + sys.getsizeof(v) for k, v in sample.items())
+            per_reading = self._reading_bytes or 0
+            return {
+                "resident_readings": resident,
+                "cached_readings": cached,
+                # Cota superior: la caché suele compartir los dicts de lectura con los bloques abiertos
+                "estimated_bytes": (resident + cached) * per_reading,
+                "spilled_readings": self.spilled_readings,
+                "spilled_bytes": self.spilled_bytes,
+                "spill_events": self.spill_events,
+                "spilled_blocks": sum(1 for s in self._blocks.values() if s.spill_paths),
+                "max_resident_readings": self.max_resident_readings,
+            }
+
+    def _open_journal(self, state):
+        """
+        Abre el journal del bloque y recupera en memoria lecturas de una ejecución previa
+        (por ejemplo tras un reinicio a mitad de hora), para que no se pierdan al compactar.
+        """
+        if state.journal is not None:
+            state.journal.close()
+        _, filename = self._block_path(state.start)
+        state.journal = BlockJournal(journal_path_for(filename))
+        recovered = read_records(state.journal.path)
+        if recovered:
+            for rec in recovered:
+                self._put_reading(state, rec)
+            self.logger.info(f"{self.tipo} journal recuperado: {state.journal.path} ({len(recovered)} lecturas)")
+
+    def _close_block(self, block_start):
+        """Cierra un bloque abierto: guardado final y, en modo journal, eliminación del journal."""
+        state = self._blocks.pop(block_start, None)
+        if state is None:
+            return
+        if self._rollover_scheduler is not None:
+            self._rollover_scheduler.cancel(state.rollover_token)
+        if state.spill_paths:
+            filename = self._save_spilled_block(state)
+        else:
+            filename = self.save_block_file(block_start, state.data) if state.data else None
+        if filename:
+            if self._commit_coordinator is not None:
+                # El bloque debe quedar durable antes de liberar su caché y su journal
+                self._commit_coordinator.commit_now()
+            # El bloque no vuelve a escribirse: liberar la caché
+            self._block_cache.pop(filename, None)
+        self._remove_spill_files(state.spill_paths)
+        self._drop_paths(block_start)
+        if state.journal is not None:
+            state.journal.remove()
+            state.journal = None
+
     def _load_existing_block(self, filename):
         """Carga un archivo de bloque existente y devuelve su contenido o estructura vacía.
-        Si el archivo está corrupto, intenta recuperar LECTURAS válidas línea por línea (best-effort)."""
+        Si el archivo está corrupto, intenta recuperar LECTURAS válidas línea por línea (best-effort).
+        Si el bloque ya fue archivado (archivo diario comprimido), se lee desde allí."""
+        if not os.path.exists(filename):
+            archived = find_archived_block(filename)
+            return archived if archived is not None else self.create_empty_structure()
+        if self.block_format == 'columnar':
+            try:
+                if os.path.exists(filename):
+                    return columnar.read_block(filename)
+            except Exception as e:
+                self.logger.warning(f"Bloque columnar ilegible, se reescribe: {filename} ({e})")
+            return self.create_empty_structure()
         try:
             if os.path.exists(filename):
                 with open(filename, 'r') as f:
@@ -104,144 +771,381 @@ class BlockStorage:
             pass
         return self.create_empty_structure()
 
+    def _block_path(self, block_start):
+        """Devuelve (directorio, archivo) del bloque, creando las subcarpetas si no existen."""
+        entry = self._resolve_path(block_start)
+        return entry.directory, entry.filename
+
+    def _resolve_path(self, block_start):
+        """_BlockPath del bloque en la raíz actual (desde la caché o resuelto y creado en disco)."""
+        key = (self.output_dir, block_start)
+        entry = self._paths.get(key)
+        if entry is not None:
+            return entry
+        # Crea subcarpetas por año/mes/día y tipo (RGA/SIS) automáticamente
+        year = block_start.strftime("%Y")
+        month = block_start.strftime("%m")
+        day = block_start.strftime("%d")
+        tipo_folder = str(self.tipo).upper() if self.tipo else None
+        if tipo_folder:
+            output_dir = os.path.join(self.output_dir, year, month, day, tipo_folder)
+        else:
+            output_dir = os.path.join(self.output_dir, year, month, day)
+        os.makedirs(output_dir, exist_ok=True)
+        # El nombre del archivo depende del tipo de bloque
+        ext = columnar.EXTENSION if self.block_format == 'columnar' else ".json"
+        filename = os.path.join(
+            output_dir,
+            block_basename(self.station_name, self.tipo, self.model, self.serial_number,
+                           block_start, self.block_type, ext)
+        )
+        entry = self._paths[key] = _BlockPath(output_dir, filename)
+        # Acotar la caché: bloques abiertos más los guardados sueltos recientes
+        while len(self._paths) > self.max_open_blocks + 2:
+            self._paths.popitem(last=False)[1].close()
+        return entry
+
+    def _drop_paths(self, block_start=None):
+        """Invalida las rutas cacheadas de un bloque (en cualquier raíz) o todas si block_start es None."""
+        for key in [k for k in self._paths if block_start is None or k[1] == block_start]:
+            self._paths.pop(key).close()
+
+    def _open_tmp(self, block_start, tmp_filename):
+        """Abre el temporal del guardado; si la carpeta cacheada ya no existe (limpieza externa), la recrea."""
+        try:
+            return open(tmp_filename, "wb")
+        except FileNotFoundError:
+            self._drop_paths(block_start)
+            self._resolve_path(block_start)
+            return open(tmp_filename, "wb")
+
+    @staticmethod
+    def _file_identity(filename):
+        """Identidad del archivo (dispositivo, inodo, tamaño, mtime) o None si no existe."""
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _serialize_block(self, block_start, lecturas):
+        """Serializa el bloque completo al formato configurado. Devuelve bytes."""
+        if self.block_format == 'columnar':
+            return columnar.encode_block(self.tipo, self.station_name, self.identifier, block_start, lecturas)
+        if self._compact_writer is not None:
+            return self._compact_writer.encode_block(lecturas)
+        file_data = {
+            "TIPO": self.tipo,
+            "NOMBRE": self.station_name,
+            "IDENTIFICADOR": self.identifier,
+            "LECTURAS": lecturas
+        }
+        return json.dumps(file_data, indent=4).encode("utf-8")
+
+    def _write_payload(self, f, block_start, lecturas):
+        """
+        Escribe el bloque en f. Devuelve (bytes escritos, sha256 hex o None si no hay catálogo).
+        El formato compacto se escribe en streaming, sin armar el archivo completo en memoria.
+        """
+        hasher = hashlib.sha256() if self._catalog is not None else None
+        if self._compact_writer is not None:
+            size = self._compact_writer.write(f, lecturas, hasher)
+        else:
+            payload = self._serialize_block(block_start, lecturas)
+            f.write(payload)
+            size = len(payload)
+            if hasher is not None:
+                hasher.update(payload)
+        return size, hasher.hexdigest() if hasher is not None else None
+
+    def _iter_json_chunks(self, lecturas):
+        """Mismo texto que json.dumps(bloque, indent=4), generado lectura por lectura (bytes)."""
+        head = json.dumps({"TIPO": self.tipo, "NOMBRE": self.station_name, "IDENTIFICADOR": self.identifier,
+                           "LECTURAS": []}, indent=4)
+        prefix = head[:-len("[]\n}")]
+        sep = prefix + "[\n        "
+        for lectura in lecturas:
+            yield (sep + json.dumps(lectura, indent=4).replace("\n", "\n        ")).encode("utf-8")
+            sep = ",\n        "
+        yield ("\n    ]\n}" if sep != prefix + "[\n        " else prefix + "[]\n}").encode("utf-8")
+
+    def _write_stream(self, f, block_start, lecturas):
+        """Como _write_payload, con lecturas como iterable: solo el formato columnar necesita la lista completa."""
+        if self.block_format == 'columnar':
+            return self._write_payload(f, block_start, list(lecturas))
+        if self._compact_writer is not None:
+            return self._write_payload(f, block_start, lecturas)
+        hasher = hashlib.sha256() if self._catalog is not None else None
+        size = 0
+        for chunk in self._iter_json_chunks(lecturas):
+            f.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            size += len(chunk)
+        return size, hasher.hexdigest() if hasher is not None else None
+
     def save_block_file(self, block_start, data):
         self._lock.acquire()
         try:
-            # El nombre del archivo depende del tipo de bloque
-            if self.block_type == 'hour':
-                date_part = block_start.strftime("%Y%m%d")
-                hour_part = block_start.strftime("%H00")
-            elif self.block_type == 'day':
-                date_part = block_start.strftime("%Y%m%d")
-                hour_part = "0000"
-            else:
-                date_part = block_start.strftime("%Y%m%d")
-                hour_part = block_start.strftime("%H%M")
-            # Crea subcarpetas por año/mes/día y tipo (RGA/SIS) automáticamente
-            year = block_start.strftime("%Y")
-            month = block_start.strftime("%m")
-            day = block_start.strftime("%d")
-            tipo_folder = str(self.tipo).upper() if self.tipo else None
-            if tipo_folder:
-                output_dir = os.path.join(self.output_dir, year, month, day, tipo_folder)
+            path = self._resolve_path(block_start)
+            filename = path.filename
+            # Reutilizar el bloque en memoria si el archivo no cambió desde nuestra última escritura
+            cached = self._block_cache.get(filename)
+            identity = self._file_identity(filename)
+            if identity is None and cached is None and self._mirror is not None and self._mirror.restore(filename):
+                # Bloque recortado de la primaria del espejo: se parte de su copia completa en la USB
+                identity = self._file_identity(filename)
+            # El temporal ocupa al menos lo que el archivo actual hasta el replace
+            self._ensure_space(filename, identity[2] if identity is not None else 0)
+            if cached is not None and (
+                    cached[0] is _PENDING_COMMIT or (identity is not None and cached[0] == identity)):
+                lecturas_map = cached[1]
             else:
-                output_dir = os.path.join(self.output_dir, year, month, day)
-            os.makedirs(output_dir, exist_ok=True)
-            filename = os.path.join(
-                output_dir,
-                f"EC.{self.station_name}.{self.tipo}_{self.model}_{self.serial_number}_{date_part}_{hour_part}.json"
-            )
-            # Intentar cargar existente y validar estructura básica
-            existing = self._load_existing_block(filename)
-            if "LECTURAS" not in existing or not isinstance(existing.get("LECTURAS"), list):
-                existing = self.create_empty_structure()
+                # Primera apertura o modificado fuera del proceso (migración, reinicio): releer de disco
+                existing = self._load_existing_block(filename)
+                if "LECTURAS" not in existing or not isinstance(existing.get("LECTURAS"), list):
+                    existing = self.create_empty_structure()
+                lecturas_map = {(l.get("FECHA"), l.get("TIEMPO")): l for l in existing.get("LECTURAS", [])}
             # Fusionar: conservar lecturas existentes y actualizar/insertar las nuevas por (FECHA,TIEMPO)
-            lecturas_map = {(l.get("FECHA"), l.get("TIEMPO")): l for l in existing.get("LECTURAS", [])}
             for new in data:
                 key = (new.get("FECHA"), new.get("TIEMPO"))
                 lecturas_map[key] = new  # actualiza si existe, inserta si no
             merged_lecturas = [lecturas_map[k] for k in sorted(lecturas_map.keys())]
-            file_data = {
-                "TIPO": self.tipo,
-                "NOMBRE": self.station_name,
-                "IDENTIFICADOR": self.identifier,
-                "LECTURAS": merged_lecturas
-            }
+            if self._commit_coordinator is not None:
+                # Commit agrupado: el coordinador hace fsync, replace y fsync de directorio en su ventana
+                tmp_filename = f"{filename}.{next(self._tmp_seq)}.tmp"
+                with self._open_tmp(block_start, tmp_filename) as f:
+                    size, digest = self._write_payload(f, block_start, merged_lecturas)
+                self._block_cache[filename] = (_PENDING_COMMIT, lecturas_map)
+                self._commit_coordinator.register_replace(
+                    tmp_filename, filename, lambda ok, fn=filename: self._on_committed(fn, ok))
+                self._record_in_catalog(block_start, filename, merged_lecturas, size, digest)
+                self.logger.info(f"{self.tipo} data saved (commit pendiente): {filename}")
+                return filename
             tmp_filename = filename + ".tmp"
-            with open(tmp_filename, "w") as f:
-                json.dump(file_data, f, indent=4)
+            with self._open_tmp(block_start, tmp_filename) as f:
+                size, digest = self._write_payload(f, block_start, merged_lecturas)
                 f.flush()
-                os.fsync(f.fileno())
+                with self._live_fsync():
+                    os.fsync(f.fileno())
             os.replace(tmp_filename, filename)
+            self._block_cache[filename] = (self._file_identity(filename), lecturas_map)
+            if self._mirror is not None:
+                self._mirror.mark_dirty(filename, size)
             try:
-                dir_fd = os.open(output_dir, os.O_DIRECTORY)
-                os.fsync(dir_fd)
-                os.close(dir_fd)
+                with self._live_fsync():
+                    path.fsync_directory()
             except Exception:
-                pass
+                path.close()
+            self._record_in_catalog(block_start, filename, merged_lecturas, size, digest)
             self.logger.info(f"{self.tipo} data saved: {filename}")
+            return filename
         finally:
             self._lock.release()
 
+    def _ensure_space(self, filename, nbytes):
+        """
+        Comprueba en el servicio de raíces que quepan nbytes más el mínimo libre antes de escribir. Si no,
+        adelanta la retención y vuelve a medir el espacio si la estimación es vieja (los débitos son
+        conservadores). El guardado se hace igual: el mínimo libre es la reserva que evita perder lecturas.
+        Devuelve True si hay espacio.
+        """
+        roots = self._storage_roots
+        if roots is None or roots.has_space(filename, nbytes):
+            self._low_space = False
+            return True
+        if self._retention is not None:
+            self._retention.request_run()
+        if time.time() - roots.refreshed_ts >= _LOW_SPACE_REFRESH_SECONDS:
+            roots.refresh()
+            if roots.has_space(filename, nbytes):
+                self._low_space = False
+                return True
+        if not self._low_space:
+            self._low_space = True
+            free = roots.free_bytes(filename)
+            self.logger.warning(f"[{str(self.tipo).upper()}] Poco espacio para {filename}: "
+                                f"~{max(free or 0, 0) // 2 ** 20} MB libres; se escribe en la reserva")
+        return False
+
+    def _record_in_catalog(self, block_start, filename, lecturas, size, digest, summary=None):
+        if self._retention is not None:
+            self._retention.note_write(filename, size)
+        if self._storage_roots is not None:
+            self._storage_roots.debit(filename, size)
+        if self._catalog is None:
+            return
+        try:
+            self._catalog.record_block(self.output_dir, filename, self.tipo, block_start, lecturas,
+                                       station=self.station_name, size=size, digest=digest, summary=summary)
+        except Exception as e:
+            # El catálogo es un índice reconstruible: un fallo no debe impedir guardar datos
+            self.logger.warning(f"No se pudo actualizar el catálogo para {filename}: {e}")
+
+    def _on_committed(self, filename, ok):
+        """
+        Callback del coordinador (su propio hilo): registra la identidad del archivo ya confirmado.
+        No toma el lock del almacenamiento para no bloquear la ronda de commit.
+        """
+        identity = self._file_identity(filename) if ok else None
+        if identity is not None and self._mirror is not None:
+            self._mirror.mark_dirty(filename, identity[2])
+        cached = self._block_cache.get(filename)
+        if cached is None:
+            return
+        if identity is not None:
+            self._block_cache[filename] = (identity, cached[1])
+        else:
+            # Releer de disco en el próximo guardado (las lecturas del bloque siguen en memoria)
+            self._block_cache.pop(filename, None)
+
     def flush(self):
+        self._drain()
         self._lock.acquire()
         try:
-            if self.block_data:
-                self.save_block_file(self.current_block, self.block_data)
-                # No vaciar block_data aquí; se mantiene en memoria para continuidad del bloque
-                self._last_write_ts = time.time()
+            self._flush_locked()
         finally:
             self._lock.release()
 
+    def _flush_locked(self):
+        """Guarda los bloques abiertos y la acumulación pendiente; el llamador debe tener el lock tomado."""
+        if self.data_accumulator:
+            self.save_accumulated_data()
+        for state in list(self._blocks.values()):
+            if not state.data:
+                continue
+            self._save_state(state)
+            # No vaciar las lecturas aquí; se mantienen en memoria para continuidad del bloque
+            state.last_write_ts = time.time()
+            if self.write_mode == 'journal':
+                # El JSON ya contiene todo el bloque: el journal se reinicia (posiblemente en la nueva ruta)
+                if self._commit_coordinator is not None:
+                    self._commit_coordinator.commit_now()
+                if state.journal is not None:
+                    state.journal.remove()
+                    state.journal = None
+                self._open_journal(state)
+            state.dirty = False
+
     # --- Métodos de acumulación (fusionados de GenericDataStorage) ---
-    def get_current_interval_end(self, acquisition_interval=2):
-        from datetime import datetime, timedelta
-        now = datetime.now()
+    def get_current_interval_end(self, acquisition_interval=2, now=None):
+        from datetime import timedelta
+        now = now if now is not None else datetime.now()
         minutes = (now.minute // acquisition_interval) * acquisition_interval
         current_end = now.replace(minute=minutes, second=0, microsecond=0)
         if now >= current_end + timedelta(minutes=acquisition_interval):
             current_end += timedelta(minutes=acquisition_interval)
         return current_end.strftime("%H:%M:00")
 
-    def accumulate(self, data, acquisition_interval=2):
-        import time
-        date_str = time.strftime("%Y-%m-%d", time.localtime())
-        interval_end_str = self.get_current_interval_end(acquisition_interval)
-        if interval_end_str not in self.data_accumulator:
-            self.data_accumulator[interval_end_str] = {
-                "FECHA": date_str,
-                "TIEMPO": interval_end_str,
-                "DATOS": []
-            }
-        self.data_accumulator[interval_end_str]["DATOS"].append(data)
-        saved_files = self.save_accumulated_data()
-        return saved_files
-
-    def save_accumulated_data(self):
-        from utils.storage.storage_utils import get_dta_path
-        saved_files = []
+    def accumulate(self, data, acquisition_interval=2, timestamp=None):
+        """
+        Agrega data a la entrada {FECHA, TIEMPO, DATOS} de su intervalo dentro del archivo horario.
+        Todo se mantiene en memoria (índice TIEMPO -> entrada por archivo) y el archivo horario se
+        reescribe como punto de control cada write_interval_seconds (y siempre al pasar a la hora
+        siguiente o en flush()/close()/set_output_dir()). Un corte de energía pierde como máximo las
+        muestras de los últimos write_interval_seconds (en modo asíncrono el escritor también guarda
+        los pendientes cuando el productor calla). Devuelve los archivos escritos en esta llamada.
+        """
+        now = timestamp if timestamp is not None else datetime.now()
+        date_str = now.strftime("%Y-%m-%d")
+        interval_end_str = self.get_current_interval_end(acquisition_interval, now)
+        hour_key = (date_str, now.strftime("%H"))
         self._lock.acquire()
         try:
-            for interval_end_str, entry in self.data_accumulator.items():
-                date_str = entry["FECHA"]
-                time_str = entry["TIEMPO"]
-                hour_str = time_str[:2] + "00"
-                tipo_sufijo = str(self.tipo).upper()
-                directory = get_dta_path(date_str, tipo_folder=tipo_sufijo)
-                file_date = date_str.replace("-", "")
-                filename = os.path.join(directory, f"EC.{self.station_name}.{tipo_sufijo}_{self.model}_{self.serial_number}_{file_date}_{hour_str}.json")
+            saved_files = []
+            # Hora nueva: las anteriores ya no reciben datos y se escriben ahora
+            for key in [k for k in self.data_accumulator if k < hour_key]:
+                filename = self._save_accumulated_file(key, self.data_accumulator.pop(key))
+                if filename:
+                    saved_files.append(filename)
+            acc = self.data_accumulator.get(hour_key)
+            if acc is None:
+                acc = self.data_accumulator[hour_key] = self._load_accumulated_file(hour_key)
+            entry = acc["index"].get(interval_end_str)
+            if entry is None:
+                entry = acc["index"][interval_end_str] = {"FECHA": date_str, "TIEMPO": interval_end_str, "DATOS": []}
+                acc["data"]["LECTURAS"].append(entry)
+            entry["DATOS"].append(data)
+            acc["dirty"] = True
+            # Punto de control: acota la pérdida ante un corte a write_interval_seconds
+            if time.time() - acc["last_write_ts"] >= self.write_interval_seconds:
+                filename = self._save_accumulated_file(hour_key, acc)
+                if filename:
+                    saved_files.append(filename)
+            return saved_files
+        finally:
+            self._lock.release()
 
-                if os.path.exists(filename):
-                    with open(filename, 'r') as file:
-                        try:
-                            data = json.load(file)
-                        except json.JSONDecodeError:
-                            data = self.create_empty_structure()
-                else:
-                    data = self.create_empty_structure()
+    def _accumulation_root(self):
+        """Raíz DTA de la acumulación: la ruta actual del almacenamiento o, si no hay, la del servicio de raíces."""
+        if self.output_dir is not None:
+            return self.output_dir
+        if self._storage_roots is None:
+            from utils.storage.storage_roots import get_storage_roots
+            self._storage_roots = get_storage_roots()
+        return self._storage_roots.dta_root
 
-                if not any(interval_end_str == lectura["TIEMPO"] for lectura in data["LECTURAS"]):
-                    data["LECTURAS"].append(entry)
+    def _accumulated_filename(self, hour_key):
+        date_str, hour = hour_key
+        tipo_sufijo = str(self.tipo).upper()
+        directory = os.path.join(self._accumulation_root(), *date_str.split("-"), tipo_sufijo)
+        file_date = date_str.replace("-", "")
+        return directory, os.path.join(
+            directory, f"EC.{self.station_name}.{tipo_sufijo}_{self.model}_{self.serial_number}_{file_date}_{hour}00.json")
 
-                try:
-                    os.makedirs(directory, exist_ok=True)
-                    tmp = filename + ".tmp"
-                    with open(tmp, 'w') as file:
-                        json.dump(data, file, indent=4)
-                        file.flush()
-                        os.fsync(file.fileno())
-                    os.replace(tmp, filename)
-                    try:
-                        dir_fd = os.open(directory, os.O_DIRECTORY)
-                        os.fsync(dir_fd)
-                        os.close(dir_fd)
-                    except Exception:
-                        pass
-                    saved_files.append(filename)
-                except Exception as e:
-                    print(f"Error al guardar datos: {e}")
+    def _load_accumulated_file(self, hour_key):
+        """Estado en memoria de un archivo horario: contenido previo en disco (si hay) e índice por TIEMPO."""
+        _, filename = self._accumulated_filename(hour_key)
+        data = None
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as file:
+                    data = json.load(file)
+            except json.JSONDecodeError:
+                data = None
+        if not isinstance(data, dict) or not isinstance(data.get("LECTURAS"), list):
+            data = self.create_empty_structure()
+        index = {lectura.get("TIEMPO"): lectura for lectura in data["LECTURAS"]}
+        return {"data": data, "index": index, "dirty": False, "last_write_ts": time.time()}
 
-            self.data_accumulator = {}
+    def _save_accumulated_file(self, hour_key, acc):
+        """Reescribe un archivo horario si tiene cambios. Devuelve su ruta o None."""
+        if not acc["dirty"]:
+            return None
+        directory, filename = self._accumulated_filename(hour_key)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            tmp = filename + ".tmp"
+            with open(tmp, 'w') as file:
+                json.dump(acc["data"], file, indent=4)
+                size = file.tell()
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp, filename)
+            if self._mirror is not None:
+                self._mirror.mark_dirty(filename, size)
+            try:
+                dir_fd = os.open(directory, os.O_DIRECTORY)
+                os.fsync(dir_fd)
+                os.close(dir_fd)
+            except Exception:
+                pass
+        except Exception as e:
+            self.logger.error(f"Error al guardar datos acumulados en {filename}: {e}")
+            return None
+        acc["dirty"] = False
+        acc["last_write_ts"] = time.time()
+        return filename
+
+    def save_accumulated_data(self):
+        """Escribe ya los archivos horarios con datos acumulados pendientes. Devuelve las rutas escritas."""
+        self._lock.acquire()
+        try:
+            saved_files = []
+            for hour_key, acc in list(self.data_accumulator.items()):
+                filename = self._save_accumulated_file(hour_key, acc)
+                if filename:
+                    saved_files.append(filename)
             return saved_files
         finally:
             self._lock.release()
@@ -259,12 +1163,22 @@ class BlockStorage:
         Cambia la ruta de almacenamiento y guarda los datos actuales en la nueva ubicación.
         Operación atómica con lock para evitar rutas inconsistentes durante escrituras concurrentes.
         """
+        self._drain()
         self._lock.acquire()
         try:
+            if self._commit_coordinator is not None:
+                # Reemplazos agrupados aún pendientes (<archivo>.N.tmp) en la raíz anterior: confirmarlos antes
+                # de que la migración la recorra
+                self._commit_coordinator.commit_now()
             self.output_dir = new_output_dir
+            # Las carpetas y fds cacheados pertenecen a la raíz anterior (p. ej. una USB retirada)
+            self._drop_paths()
             self.logger.info(f"[{str(self.tipo).upper()}] Ruta de almacenamiento cambiada a: {new_output_dir}")
             # Guardado inmediato en la nueva ubicación
-            self.flush()
+            for state in self._blocks.values():
+                if state.spill_paths:
+                    self._relocate_spill(state)
+            self._flush_locked()
         finally:
             self._lock.release()
 
@@ -274,7 +1188,8 @@ class BlockStorage:
             if seconds < 0:
                 seconds = 0
             self.write_interval_seconds = seconds
-            self._last_write_ts = time.time()
+            for state in self._blocks.values():
+                state.last_write_ts = time.time()
             try:
                 self.logger.info(f"Intervalo de escritura configurado: {seconds} s")
             except Exception:
@@ -0,0 +1,294 @@
+"""
+Catálogo SQLite (modo WAL) de los bloques almacenados, con un resumen por bloque.
+
+Una fila por archivo de bloque (raíz DTA + ruta relativa): tipo, inicio del bloque, cantidad de
+lecturas, primer/último TIEMPO, cantidad de alertas, bytes y sha256 del contenido. Las estadísticas
+(mín/máx/media) de cada canal numérico van en la tabla block_channels. BlockStorage actualiza su fila
+en cada guardado, de modo que listar un mes o ubicar las horas con ALERTA no requiere abrir archivos.
+
+La ruta es la del bloque suelto; si el bloque fue archivado (archivo diario comprimido) la fila se
+conserva y su checksum coincide con el sha256 del miembro en el índice .idx.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from utils.storage import archiver
+from utils.storage.block_names import parse_block_filename
+
+# Claves que no son canales de medición
+NON_CHANNEL_KEYS = frozenset(("FECHA", "TIEMPO", "LATITUD", "LONGITUD", "ALTURA", "ALERTA"))
+_TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    station TEXT,
+    block_start TEXT NOT NULL,
+    readings INTEGER NOT NULL,
+    first_tiempo TEXT,
+    last_tiempo TEXT,
+    alerts INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (root, path)
+);
+CREATE INDEX IF NOT EXISTS blocks_tipo_start ON blocks (tipo, block_start);
+CREATE INDEX IF NOT EXISTS blocks_alerts ON blocks (tipo, block_start) WHERE alerts > 0;
+CREATE TABLE IF NOT EXISTS block_channels (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    min REAL,
+    max REAL,
+    mean REAL,
+    PRIMARY KEY (root, path, channel)
+);
+"""
+
+
+def _numeric(value):
+    """Valor numérico de un canal (los PASA_* llegan como texto '0017'); None si no es numérico."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+class BlockSummary:
+    """Resumen incremental de un bloque (lectura por lectura), para bloques escritos en streaming."""
+
+    def __init__(self):
+        self.readings = 0
+        self.first_tiempo = None
+        self.last_tiempo = None
+        self.alerts = 0
+        self._channels = {}
+
+    def add(self, lec):
+        if self.readings == 0:
+            self.first_tiempo = lec.get("TIEMPO")
+        self.readings += 1
+        self.last_tiempo = lec.get("TIEMPO")
+        if lec.get("ALERTA") is True:
+            self.alerts += 1
+        channels = self._channels
+        for key, value in lec.items():
+            if key in NON_CHANNEL_KEYS:
+                continue
+            v = _numeric(value)
+            if v is None:
+                continue
+            acc = channels.get(key)
+            if acc is None:
+                channels[key] = [1, v, v, v]
+            else:
+                acc[0] += 1
+                if v < acc[1]:
+                    acc[1] = v
+                if v > acc[2]:
+                    acc[2] = v
+                acc[3] += v
+
+    def result(self):
+        return {
+            "readings": self.readings,
+            "first_tiempo": self.first_tiempo,
+            "last_tiempo": self.last_tiempo,
+            "alerts": self.alerts,
+            "channels": {k: (n, lo, hi, total / n) for k, (n, lo, hi, total) in self._channels.items()},
+        }
+
+
+def summarize(lecturas):
+    """Resumen de un bloque: cantidad, primer/último TIEMPO, alertas y {canal: (n, mín, máx, media)}."""
+    summary = BlockSummary()
+    for lec in lecturas:
+        summary.add(lec)
+    return summary.result()
+
+
+class BlockCatalog:
+    """Catálogo de bloques compartido por los almacenamientos del proceso (conexión única con lock)."""
+
+    def __init__(self, db_path, logger=None):
+        self.db_path = db_path
+        self.logger = logger if logger is not None else logging.getLogger("catalog")
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # En WAL, NORMAL mantiene la base consistente ante cortes (solo puede perder el último commit)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _relpath(root, filename):
+        return os.path.relpath(filename, root)
+
+    def record_block(self, root, filename, tipo, block_start, lecturas, payload=None, station=None,
+                     size=None, digest=None, summary=None):
+        """
+        Inserta o actualiza la fila del bloque tras un guardado. Se indica payload (bytes escritos) o,
+        si el bloque se escribió en streaming, su tamaño y sha256 ya calculados (size, digest); en ese
+        caso summary (BlockSummary.result()) reemplaza a lecturas.
+        """
+        if summary is None:
+            summary = summarize(lecturas)
+        path = self._relpath(root, filename)
+        if digest is None:
+            size, digest = len(payload), hashlib.sha256(payload).hexdigest()
+        with self._lock:
+            self._write(root, path, str(tipo).upper(), station, block_start.strftime(_TS_FORMAT),
+                        summary, size, digest)
+
+    def _write(self, root, path, tipo, station, block_start, summary, size, digest):
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO blocks (root, path, tipo, station, block_start, readings, first_tiempo,"
+                " last_tiempo, alerts, bytes, sha256, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (root, path, tipo, station, block_start, summary["readings"], summary["first_tiempo"],
+                 summary["last_tiempo"], summary["alerts"], size, digest, time.time()))
+            conn.execute("DELETE FROM block_channels WHERE root = ? AND path = ?", (root, path))
+            conn.executemany(
+                "INSERT INTO block_channels (root, path, channel, n, min, max, mean) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(root, path, ch, n, lo, hi, mean) for ch, (n, lo, hi, mean) in summary["channels"].items()])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def index_file(self, root, filename):
+        """(Re)cataloga un bloque leyendo su contenido (archivo suelto o miembro archivado). Devuelve True si lo encontró."""
+        name = os.path.basename(filename)
+        info = parse_block_filename(name)
+        if info is None:
+            return False
+        payload = None
+        if os.path.exists(filename):
+            with open(filename, "rb") as f:
+                payload = f.read()
+        else:
+            for codec in archiver.CODECS:
+                archive = archiver.archive_path_for(os.path.dirname(filename), info["day_prefix"], codec)
+                if os.path.exists(archive + archiver.INDEX_SUFFIX):
+                    payload = archiver.read_member(archive, name)
+                    if payload is not None:
+                        break
+        if payload is None:
+            return False
+        try:
+            structure = archiver.decode_member(name, payload)
+        except (ValueError, json.JSONDecodeError) as e:
+            self.logger.warning(f"No se pudo catalogar {filename}: {e}")
+            return False
+        with self._lock:
+            self._write(root, self._relpath(root, filename), info["tipo"].upper(), info["station"],
+                        info["start"].strftime(_TS_FORMAT), summarize(structure.get("LECTURAS", [])),
+                        len(payload), hashlib.sha256(payload).hexdigest())
+        return True
+
+    def rebuild(self, root):
+        """Cataloga todos los bloques bajo root (sueltos y archivados). Para poblar el catálogo por primera vez."""
+        count = 0
+        for current_root, dirs, files in os.walk(root):
+            dirs.sort()
+            names = set(files)
+            for name in files:
+                if archiver.is_index_file(name):
+                    members = archiver.load_index(os.path.join(current_root, name[:-len(archiver.INDEX_SUFFIX)]))["members"]
+                    names.update(members)
+            for name in sorted(names):
+                if parse_block_filename(name) is not None and self.index_file(root, os.path.join(current_root, name)):
+                    count += 1
+        self.logger.info(f"Catálogo reconstruido para {root}: {count} bloques")
+        return count
+
+    def relocate(self, src_root, dest_root, relpath):
+        """Traslada la fila de un bloque migrado a otra raíz (reemplaza la del destino si existía)."""
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN")
+            try:
+                for table in ("blocks", "block_channels"):
+                    conn.execute(f"DELETE FROM {table} WHERE root = ? AND path = ?", (dest_root, relpath))
+                    conn.execute(f"UPDATE {table} SET root = ? WHERE root = ? AND path = ?", (dest_root, src_root, relpath))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def forget(self, root, relpath):
+        with self._lock:
+            for table in ("blocks", "block_channels"):
+                self._conn.execute(f"DELETE FROM {table} WHERE root = ? AND path = ?", (root, relpath))
+
+    def list_blocks(self, tipo=None, start=None, end=None, root=None, alerts_only=False):
+        """Filas de bloques (dicts) ordenadas por inicio; start/end son datetime sobre el inicio del bloque."""
+        clauses, params = [], []
+        if tipo is not None:
+            clauses.append("tipo = ?")
+            params.append(str(tipo).upper())
+        if start is not None:
+            clauses.append("block_start >= ?")
+            params.append(start.strftime(_TS_FORMAT))
+        if end is not None:
+            clauses.append("block_start <= ?")
+            params.append(end.strftime(_TS_FORMAT))
+        if root is not None:
+            clauses.append("root = ?")
+            params.append(root)
+        if alerts_only:
+            clauses.append("alerts > 0")
+        sql = "SELECT * FROM blocks"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY block_start, root, path"
+        with self._lock:
+            cur = self._conn.execute(sql, params)
+            columns = [c[0] for c in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    def alert_blocks(self, tipo, start=None, end=None):
+        """Bloques con al menos una ALERTA."""
+        return self.list_blocks(tipo, start, end, alerts_only=True)
+
+    def channel_stats(self, root, path):
+        """{canal: {n, min, max, mean}} de un bloque."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT channel, n, min, max, mean FROM block_channels WHERE root = ? AND path = ?",
+                (root, path)).fetchall()
+        return {ch: {"n": n, "min": lo, "max": hi, "mean": mean} for ch, n, lo, hi, mean in rows}
+
+
+if __name__ == "__main__":
+    # Uso: python3 -m utils.storage.catalog <catalog.sqlite> rebuild <raíz DTA>
+    #      python3 -m utils.storage.catalog <catalog.sqlite> alerts <TIPO>
+    import sys
+    if len(sys.argv) < 4 or sys.argv[2] not in ("rebuild", "alerts"):
+        print("Uso: python3 -m utils.storage.catalog <catalog.sqlite> rebuild <raíz> | alerts <TIPO>")
+        sys.exit(1)
+    catalog = BlockCatalog(sys.argv[1])
+    if sys.argv[2] == "rebuild":
+        print(catalog.rebuild(os.path.abspath(sys.argv[3])))
+    else:
+        for row in catalog.alert_blocks(sys.argv[3]):
+            print(f"{row['block_start']}  alertas={row['alerts']}  {os.path.join(row['root'], row['path'])}")
@@ -0,0 +1,308 @@
+"""
+Formato binario columnar para bloques de lecturas (extensión .col).
+
+Estructura del archivo (little-endian):
+    b"VPCB" | versión (u8) | largo de cabecera (u32) | cabecera JSON | columnas
+
+La cabecera guarda TIPO/NOMBRE/IDENTIFICADOR, el inicio del bloque, la posición (una sola vez
+por bloque), la cantidad de filas y las excepciones: valores que no caben en su columna de ancho
+fijo (por ejemplo una posición distinta a la del bloque o un PASA_* no numérico). Cada columna es
+un arreglo contiguo de ancho fijo, por lo que una fila puede leerse con seek sin decodificar el resto.
+
+El JSON tradicional (EC.*.json) se reconstruye sin pérdida con read_block()/export_json().
+"""
+import io
+import json
+import os
+import struct
+import sys
+from array import array
+from datetime import date, datetime, timedelta
+
+MAGIC = b"VPCB"
+VERSION = 1
+EXTENSION = ".col"
+_PREFIX = struct.Struct("<4sBI")
+_TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Valores centinela para "sin dato" en cada tipo de columna
+_NULLS = {"B": 0xFF, "H": 0xFFFF, "h": -32768, "i": -2 ** 31}
+
+
+def _seconds_of_day(dt):
+    return dt.hour * 3600 + dt.minute * 60 + dt.second
+
+
+def _time_offset(fecha, tiempo, block_start, day_cache):
+    """Segundos desde block_start para FECHA/TIEMPO, sin strptime (costoso por fila)."""
+    base = day_cache.get(fecha)
+    if base is None:
+        y, m, d = fecha.split("-")
+        base = (date(int(y), int(m), int(d)) - block_start.date()).days * 86400 - _seconds_of_day(block_start)
+        day_cache[fecha] = base
+    return base + int(tiempo[0:2]) * 3600 + int(tiempo[3:5]) * 60 + int(tiempo[6:8])
+
+
+def _enc_pasa(v):
+    # "0013" -> 13; cualquier otra forma va a excepciones
+    if isinstance(v, str) and len(v) == 4 and v.isdigit():
+        return int(v)
+    raise ValueError
+
+
+def _dec_pasa(v):
+    return f"{v:04d}"
+
+
+def _enc_alerta(v):
+    if v is True:
+        return 1
+    if v is False:
+        return 0
+    raise ValueError
+
+
+def _dec_alerta(v):
+    return v == 1
+
+
+def _enc_bateria(v):
+    # Voltios -> mV (int16); solo si la conversión es exacta
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        raise ValueError
+    mv = int(round(v * 1000))
+    if not -32767 <= mv <= 32767 or abs(mv / 1000 - v) > 1e-9:
+        raise ValueError
+    return mv
+
+
+def _dec_bateria(v):
+    return v / 1000
+
+
+# Columnas por tipo: (clave, typecode de array, codificador, decodificador)
+SEISMIC_COLUMNS = (
+    ("ALERTA", "B", _enc_alerta, _dec_alerta),
+    ("PASA_BANDA", "H", _enc_pasa, _dec_pasa),
+    ("PASA_BAJO", "H", _enc_pasa, _dec_pasa),
+    ("PASA_ALTO", "H", _enc_pasa, _dec_pasa),
+    ("BATERIA", "h", _enc_bateria, _dec_bateria),
+)
+POSITION_KEYS = ("LATITUD", "LONGITUD", "ALTURA")
+# Orden de claves del JSON exportado (igual al de seismic_schema)
+SEISMIC_KEY_ORDER = ("FECHA", "TIEMPO") + POSITION_KEYS + tuple(c[0] for c in SEISMIC_COLUMNS)
+
+COLUMNAR_SCHEMAS = {
+    "SIS": (SEISMIC_COLUMNS, SEISMIC_KEY_ORDER),
+}
+
+
+def supports_tipo(tipo):
+    return str(tipo).upper() in COLUMNAR_SCHEMAS
+
+
+def _encode_column(key, code, enc, lecturas, exceptions):
+    """Codifica una columna completa; los valores no representables van a excepciones por fila."""
+    null = _NULLS[code]
+    vals = [lec.get(key) for lec in lecturas]
+    fast = _FAST_PATHS.get(enc)
+    if fast is not None:
+        try:
+            return array(code, fast(vals))
+        except (ValueError, TypeError, OverflowError):
+            pass
+    col = array(code)
+    for row, v in enumerate(vals):
+        if v is None:
+            col.append(null)
+            continue
+        try:
+            col.append(enc(v))
+        except ValueError:
+            col.append(null)
+            exceptions.setdefault(str(row), {})[key] = v
+    return col
+
+
+def _fast_pasa(vals):
+    if not all(v.__class__ is str and len(v) == 4 and v.isdigit() for v in vals):
+        raise ValueError
+    return [int(v) for v in vals]
+
+
+def _fast_alerta(vals):
+    if not all(v is True or v is False for v in vals):
+        raise ValueError
+    return [1 if v else 0 for v in vals]
+
+
+def _fast_bateria(vals):
+    out = [int(round(v * 1000)) for v in vals if v.__class__ is float]
+    if len(out) != len(vals) or not all(abs(mv / 1000 - v) <= 1e-9 for mv, v in zip(out, vals)):
+        raise ValueError
+    return out
+
+
+# Rutas rápidas por columna completa (sin excepciones ni nulos); si fallan se codifica fila a fila
+_FAST_PATHS = {_enc_pasa: _fast_pasa, _enc_alerta: _fast_alerta, _enc_bateria: _fast_bateria}
+
+
+def encode_block(tipo, nombre, identificador, block_start, lecturas):
+    """Codifica las lecturas (lista de dicts, ordenadas) en el formato columnar. Devuelve bytes."""
+    columns, key_order = COLUMNAR_SCHEMAS[str(tipo).upper()]
+    known = set(key_order)
+    exceptions = {}
+    day_cache = {}
+    offsets = array("i", [_time_offset(lec["FECHA"], lec["TIEMPO"], block_start, day_cache) for lec in lecturas])
+    # Posición del bloque: la más frecuente; las filas que difieran se guardan como excepción
+    positions = [(lec.get("LATITUD"), lec.get("LONGITUD"), lec.get("ALTURA")) for lec in lecturas]
+    counts = {}
+    for pos in positions:
+        counts[pos] = counts.get(pos, 0) + 1
+    position = max(counts, key=counts.get) if counts else (None, None, None)
+    if len(counts) > 1:
+        for row, pos in enumerate(positions):
+            if pos != position:
+                exceptions.setdefault(str(row), {}).update(zip(POSITION_KEYS, pos))
+    values = [_encode_column(key, code, enc, lecturas, exceptions) for key, code, enc, _ in columns]
+    for row, lec in enumerate(lecturas):
+        if len(lec) != len(known) or not known.issuperset(lec):
+            extra = {k: v for k, v in lec.items() if k not in known}
+            if extra:
+                exceptions.setdefault(str(row), {}).update(extra)
+    header = {
+        "TIPO": tipo,
+        "NOMBRE": nombre,
+        "IDENTIFICADOR": identificador,
+        "INICIO": block_start.strftime(_TS_FORMAT),
+        "POSICION": list(position),
+        "FILAS": len(lecturas),
+        "COLUMNAS": ["OFFSET"] + [c[0] for c in columns],
+        "EXCEPCIONES": exceptions,
+    }
+    if sys.byteorder != "little":
+        offsets.byteswap()
+        for col in values:
+            col.byteswap()
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    parts = [_PREFIX.pack(MAGIC, VERSION, len(header_bytes)), header_bytes, offsets.tobytes()]
+    parts.extend(col.tobytes() for col in values)
+    return b"".join(parts)
+
+
+def read_header(f):
+    """Lee la cabecera desde un archivo abierto en binario; deja el cursor al inicio de las columnas."""
+    magic, version, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("archivo columnar inválido o versión no soportada")
+    return json.loads(f.read(header_len).decode("utf-8"))
+
+
+def _column_layout(header):
+    """Lista de (clave, typecode, offset relativo al inicio de columnas)."""
+    columns, _ = COLUMNAR_SCHEMAS[str(header["TIPO"]).upper()]
+    n = header["FILAS"]
+    layout = [("OFFSET", "i", 0)]
+    pos = n * array("i").itemsize
+    for key, code, _, _ in columns:
+        layout.append((key, code, pos))
+        pos += n * array(code).itemsize
+    return layout
+
+
+def _read_array(f, base, code, offset, start, count):
+    arr = array(code)
+    f.seek(base + offset + start * arr.itemsize)
+    arr.frombytes(f.read(count * arr.itemsize))
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+
+def read_offsets(f, header, base):
+    """Columna de offsets (segundos desde INICIO), útil para ubicar un rango de filas con bisect."""
+    return _read_array(f, base, "i", 0, 0, header["FILAS"])
+
+
+def read_rows(f, header, base, start=0, stop=None):
+    """Decodifica las filas [start, stop) leyendo solo ese tramo de cada columna."""
+    columns, key_order = COLUMNAR_SCHEMAS[str(header["TIPO"]).upper()]
+    n = header["FILAS"]
+    stop = n if stop is None else min(stop, n)
+    if start >= stop:
+        return []
+    count = stop - start
+    layout = _column_layout(header)
+    arrays = [_read_array(f, base, code, off, start, count) for _, code, off in layout]
+    block_start = datetime.strptime(header["INICIO"], _TS_FORMAT)
+    start_sec = _seconds_of_day(block_start)
+    fechas = {}
+    position = header.get("POSICION") or [None, None, None]
+    exceptions = header.get("EXCEPCIONES", {})
+    decoders = {key: (code, dec) for key, code, _, dec in columns}
+    rows = []
+    for i in range(count):
+        day, sec = divmod(start_sec + arrays[0][i], 86400)
+        fecha = fechas.get(day)
+        if fecha is None:
+            fecha = fechas[day] = (block_start.date() + timedelta(days=day)).isoformat()
+        h, rem = divmod(sec, 3600)
+        lec = {"FECHA": fecha, "TIEMPO": f"{h:02d}:{rem // 60:02d}:{rem % 60:02d}"}
+        for k, v in zip(POSITION_KEYS, position):
+            lec[k] = v
+        for (key, _, _), arr in zip(layout[1:], arrays[1:]):
+            code, dec = decoders[key]
+            v = arr[i]
+            lec[key] = None if v == _NULLS[code] else dec(v)
+        exc = exceptions.get(str(start + i))
+        if exc:
+            lec.update(exc)
+        # Respetar el orden de claves del esquema JSON
+        ordered = {k: lec[k] for k in key_order if k in lec}
+        ordered.update((k, v) for k, v in lec.items() if k not in ordered)
+        rows.append(ordered)
+    return rows
+
+
+def _read_structure(f):
+    header = read_header(f)
+    base = f.tell()
+    return {
+        "TIPO": header["TIPO"],
+        "NOMBRE": header["NOMBRE"],
+        "IDENTIFICADOR": header["IDENTIFICADOR"],
+        "LECTURAS": read_rows(f, header, base),
+    }
+
+
+def read_block(path):
+    """Lee un archivo .col y devuelve la estructura JSON tradicional (TIPO, NOMBRE, IDENTIFICADOR, LECTURAS)."""
+    with open(path, "rb") as f:
+        return _read_structure(f)
+
+
+def decode_block(data):
+    """Como read_block(), a partir de los bytes del bloque (por ejemplo, extraídos de un archivo diario)."""
+    return _read_structure(io.BytesIO(data))
+
+
+def export_json(path, out_path=None):
+    """Exporta un bloque columnar al JSON de siempre (EC.*.json, indent=4). Devuelve la ruta escrita."""
+    if out_path is None:
+        out_path = os.path.splitext(path)[0] + ".json"
+    data = read_block(path)
+    tmp = out_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, out_path)
+    return out_path
+
+
+if __name__ == "__main__":
+    # Uso: python3 -m utils.storage.columnar EC....col [salida.json]
+    if len(sys.argv) < 2:
+        print("Uso: python3 -m utils.storage.columnar <archivo.col> [salida.json]")
+        sys.exit(1)
+    print(export_json(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
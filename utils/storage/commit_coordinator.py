@@ -0,0 +1,208 @@
+import os
+import threading
+import time
+import logging
+from contextlib import nullcontext
+
+
+class CommitCoordinator:
+    """
+    Coordinador de commits compartido por todas las instancias de BlockStorage del proceso.
+
+    En lugar de que cada almacenamiento haga fsync del archivo y del directorio en su propio
+    temporizador, los almacenamientos registran sus bloques sucios y el coordinador ejecuta una
+    única ronda de sincronización por ventana de commit:
+      1. fsync de cada archivo temporal pendiente (solo la última versión de cada bloque)
+      2. os.replace() de cada temporal sobre su archivo final
+      3. fsync de los journals con datos pendientes
+      4. un único fsync por directorio afectado
+
+    Los datos quedan durables como máximo window_seconds después de registrarse. Con io_throttle
+    (utils/storage/io_throttle.py), la ronda tiene prioridad sobre la migración y la latencia media
+    de sus fsync regula la tasa de esta.
+    """
+
+    def __init__(self, window_seconds=5.0, logger=None, report_interval_seconds=3600, io_throttle=None):
+        self.window_seconds = window_seconds
+        self.logger = logger if logger is not None else logging.getLogger("commit_coordinator")
+        self.report_interval_seconds = report_interval_seconds
+        self.io_throttle = io_throttle
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._pending = {}  # archivo final -> (temporal, callback)
+        self._syncs = set()  # journals a sincronizar
+        self._thread = None
+        self._started_ts = time.time()
+        self._last_report_ts = self._started_ts
+        # Métricas
+        self.rounds = 0
+        self.files_committed = 0
+        self.fsyncs_requested = 0  # fsyncs que los almacenamientos habrían hecho por su cuenta
+        self.fsyncs_issued = 0
+        self.commit_errors = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self._total_commit_ms = 0.0
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="commit-coordinator", daemon=True)
+            self._thread.start()
+
+    def register_replace(self, tmp_path, final_path, on_commit=None):
+        """
+        Registra un bloque escrito en tmp_path (sin fsync) que debe reemplazar a final_path.
+        Si el mismo bloque ya tenía una versión pendiente, esta la sustituye y el temporal previo se elimina.
+        on_commit(ok) se invoca desde el hilo del coordinador tras el commit; no debe tomar locks del llamador.
+        """
+        with self._lock:
+            previous = self._pending.get(final_path)
+            self._pending[final_path] = (tmp_path, on_commit)
+            # Sin coordinador: fsync del archivo + fsync del directorio
+            self.fsyncs_requested += 2
+        if previous is not None and previous[0] != tmp_path:
+            try:
+                os.remove(previous[0])
+            except OSError:
+                pass
+
+    def request_sync(self, path):
+        """Solicita fsync de un archivo escrito en modo append (journal) en la próxima ronda."""
+        with self._lock:
+            self._syncs.add(path)
+            self.fsyncs_requested += 1
+
+    def is_pending(self, final_path):
+        with self._lock:
+            return final_path in self._pending
+
+    def commit_now(self):
+        """Ejecuta una ronda de commit inmediata (por ejemplo al cerrar un bloque o al apagar)."""
+        with self._commit_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                syncs, self._syncs = self._syncs, set()
+            if not pending and not syncs:
+                return
+            live = self.io_throttle.live() if self.io_throttle is not None else nullcontext()
+            with live:
+                self._commit_round(pending, syncs)
+
+    def _commit_round(self, pending, syncs):
+        """Sincroniza y reemplaza lo pendiente de una ronda (con _commit_lock tomado)."""
+        t0 = time.perf_counter()
+        issued = 0
+        dirs = set()
+        committed = 0
+        for final_path, (tmp_path, on_commit) in pending.items():
+            ok = False
+            try:
+                fd = os.open(tmp_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                issued += 1
+                os.replace(tmp_path, final_path)
+                dirs.add(os.path.dirname(final_path))
+                committed += 1
+                ok = True
+            except Exception as e:
+                self.commit_errors += 1
+                self.logger.error(f"Commit fallido de {final_path}: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            if on_commit is not None:
+                try:
+                    on_commit(ok)
+                except Exception:
+                    pass
+        for path in syncs:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                issued += 1
+            except FileNotFoundError:
+                # Journal ya compactado y eliminado
+                pass
+            except Exception as e:
+                self.commit_errors += 1
+                self.logger.error(f"fsync fallido de {path}: {e}")
+        for d in dirs:
+            try:
+                dir_fd = os.open(d, os.O_DIRECTORY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+                issued += 1
+            except Exception:
+                pass
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        with self._lock:
+            self.rounds += 1
+            self.files_committed += committed
+            self.fsyncs_issued += issued
+            self.last_commit_ms = elapsed_ms
+            self.max_commit_ms = max(self.max_commit_ms, elapsed_ms)
+            self._total_commit_ms += elapsed_ms
+        if self.io_throttle is not None and issued:
+            self.io_throttle.observe_fsync(elapsed_ms / 1000 / issued)
+
+    def stats(self):
+        """Métricas acumuladas: latencia de commit y fsyncs ahorrados (totales y por hora)."""
+        with self._lock:
+            hours = max((time.time() - self._started_ts) / 3600.0, 1e-9)
+            saved = max(self.fsyncs_requested - self.fsyncs_issued, 0)
+            return {
+                "window_seconds": self.window_seconds,
+                "rounds": self.rounds,
+                "files_committed": self.files_committed,
+                "fsyncs_requested": self.fsyncs_requested,
+                "fsyncs_issued": self.fsyncs_issued,
+                "fsyncs_saved": saved,
+                "fsyncs_saved_per_hour": saved / hours,
+                "commit_errors": self.commit_errors,
+                "last_commit_ms": self.last_commit_ms,
+                "max_commit_ms": self.max_commit_ms,
+                "avg_commit_ms": self._total_commit_ms / self.rounds if self.rounds else 0.0,
+            }
+
+    def _report(self):
+        st = self.stats()
+        self.logger.info(
+            f"Commits agrupados: {st['rounds']} rondas | latencia media {st['avg_commit_ms']:.1f} ms "
+            f"(máx {st['max_commit_ms']:.1f} ms) | fsyncs emitidos {st['fsyncs_issued']} de "
+            f"{st['fsyncs_requested']} | ahorrados/hora: {st['fsyncs_saved_per_hour']:.0f}"
+        )
+
+    def _run(self):
+        while True:
+            time.sleep(self.window_seconds)
+            try:
+                self.commit_now()
+            except Exception as e:
+                self.logger.error(f"Error en ronda de commit: {e}")
+            now = time.time()
+            if self.report_interval_seconds and now - self._last_report_ts >= self.report_interval_seconds:
+                self._last_report_ts = now
+                self._report()
+
+
+_coordinator = None
+_coordinator_lock = threading.Lock()
+
+
+def get_commit_coordinator(window_seconds=5.0, logger=None, io_throttle=None):
+    """Devuelve el coordinador de commits del proceso (lo crea y arranca en la primera llamada)."""
+    global _coordinator
+    with _coordinator_lock:
+        if _coordinator is None:
+            _coordinator = CommitCoordinator(window_seconds=window_seconds, logger=logger, io_throttle=io_throttle)
+            _coordinator.start()
+        return _coordinator
@@ -0,0 +1,94 @@
+"""
+Serializador JSON compacto y en streaming para archivos de bloque (block_format='json_compact').
+
+Produce el mismo documento que el formato 'json' ({"TIPO", "NOMBRE", "IDENTIFICADOR", "LECTURAS"}),
+legible por json.load, pero sin sangría y escrito lectura por lectura: no se arma el diccionario del
+archivo ni el texto completo en memoria. La cabecera (TIPO, NOMBRE, IDENTIFICADOR) y el nombre de
+cada clave se codifican una sola vez por almacenamiento y se reutilizan como fragmentos de bytes.
+
+Las claves de cada lectura salen en orden fijo: el de la primera lectura vista (el que produce el
+extractor); las claves nuevas se agregan al final de ese orden.
+"""
+import json
+import math
+from json.encoder import encode_basestring_ascii
+
+_TRUE, _FALSE, _NULL = b"true", b"false", b"null"
+
+
+def _encode_value(value):
+    """Bytes JSON de un valor escalar (mismo resultado que json.dumps); estructuras anidadas vía json.dumps."""
+    if isinstance(value, str):
+        return encode_basestring_ascii(value).encode("ascii")
+    if value is True:
+        return _TRUE
+    if value is False:
+        return _FALSE
+    if value is None:
+        return _NULL
+    if type(value) is int:
+        return int.__repr__(value).encode("ascii")
+    if type(value) is float and math.isfinite(value):
+        return float.__repr__(value).encode("ascii")
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+class CompactBlockWriter:
+    """Escritor de bloques compacto con fragmentos precalculados (uno por almacenamiento)."""
+
+    def __init__(self, tipo, station_name, identifier):
+        self.header = (
+            b'{"TIPO":' + _encode_value(tipo) +
+            b',"NOMBRE":' + _encode_value(station_name) +
+            b',"IDENTIFICADOR":' + _encode_value(identifier) +
+            b',"LECTURAS":['
+        )
+        self.footer = b"]}"
+        self._key_order = []
+        # clave -> fragmento '"CLAVE":' (las siguientes a la primera llevan la coma delante)
+        self._key_fragments = {}
+
+    def _fragment(self, key, first):
+        cached = self._key_fragments.get(key)
+        if cached is None:
+            name = encode_basestring_ascii(str(key)).encode("ascii") + b":"
+            cached = self._key_fragments[key] = (name, b"," + name)
+            self._key_order.append(key)
+        return cached[0] if first else cached[1]
+
+    def encode_reading(self, lectura):
+        """Bytes de una lectura con las claves en el orden fijo del escritor."""
+        for key in lectura:
+            if key not in self._key_fragments:
+                self._fragment(key, True)
+        parts = [b"{"]
+        first = True
+        for key in self._key_order:
+            if key in lectura:
+                parts.append(self._fragment(key, first))
+                parts.append(_encode_value(lectura[key]))
+                first = False
+        parts.append(b"}")
+        return b"".join(parts)
+
+    def iter_chunks(self, lecturas):
+        """Genera el archivo por partes: cabecera, una lectura por parte y cierre."""
+        yield self.header
+        sep = b""
+        for lectura in lecturas:
+            yield sep + self.encode_reading(lectura)
+            sep = b","
+        yield self.footer
+
+    def write(self, f, lecturas, hasher=None):
+        """Escribe el bloque en f (binario). Devuelve los bytes escritos; actualiza hasher si se indica."""
+        size = 0
+        for chunk in self.iter_chunks(lecturas):
+            f.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            size += len(chunk)
+        return size
+
+    def encode_block(self, lecturas):
+        return b"".join(self.iter_chunks(lecturas))
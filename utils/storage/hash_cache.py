@@ -0,0 +1,134 @@
+"""
+Caché persistente de sha256 de los archivos de una raíz DTA (SQLite en modo WAL).
+
+La base vive junto a la raíz, no dentro (<padre>/<raíz>.hashes.sqlite; p. ej. /media/pi/USB/DTA.hashes.sqlite),
+para que la migración, el archivado y la retención no la recorran como si fuera un bloque. Una fila por
+archivo: ruta relativa a la raíz, tamaño, mtime_ns y sha256. Un hash se reutiliza solo si el archivo
+conserva el tamaño y el mtime con que se registró; si no, se recalcula y se reemplaza.
+
+No se usan dispositivo ni inodo como clave: en vfat/exfat (las USB habituales) el número de inodo se
+asigna en cada montaje y el dispositivo cambia al reconectar (sdb1, sdc1, ...), lo que invalidaría toda
+la caché de la USB en cada conexión. Los bloques siempre se reescriben con un temporal + rename, que
+cambia el mtime, de modo que tamaño + mtime detectan cualquier modificación.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+
+HASH_CACHE_SUFFIX = ".hashes.sqlite"
+_CHUNK_BYTES = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    relpath TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+"""
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def hash_cache_path(root):
+    root = os.path.abspath(root)
+    return os.path.join(os.path.dirname(root), os.path.basename(root) + HASH_CACHE_SUFFIX)
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_BYTES), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class HashCache:
+    """Caché de sha256 de una raíz, compartida entre hilos (conexión única con lock)."""
+
+    def __init__(self, root, logger=None):
+        self.root = os.path.abspath(root)
+        self.db_path = hash_cache_path(self.root)
+        self.logger = logger if logger is not None else logging.getLogger("hash_cache")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Es una caché: perder el último registro ante un corte solo obliga a recalcular ese hash
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def lookup(self, path, st=None):
+        """sha256 registrado si el archivo no cambió (mismo tamaño y mtime); si no, None."""
+        st = st if st is not None else os.stat(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, sha256 FROM hashes WHERE relpath = ?", (self._relpath(path),)).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            return None
+        return row[2]
+
+    def sha256(self, path):
+        """sha256 del archivo: desde la caché si no cambió; si no, lo calcula y lo registra."""
+        st = os.stat(path)
+        digest = self.lookup(path, st)
+        if digest is not None:
+            self.hits += 1
+            return digest
+        self.misses += 1
+        digest = sha256_file(path)
+        # Si el archivo cambió durante la lectura, no se registra (el próximo uso lo recalcula)
+        after = os.stat(path)
+        if after.st_size == st.st_size and after.st_mtime_ns == st.st_mtime_ns:
+            self.record(path, digest, st)
+        return digest
+
+    def record(self, path, digest, st=None):
+        """Registra un sha256 ya conocido (p. ej. el calculado al copiar el archivo)."""
+        st = st if st is not None else os.stat(path)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO hashes (relpath, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                               (self._relpath(path), st.st_size, st.st_mtime_ns, digest))
+
+    def forget(self, path):
+        with self._lock:
+            self._conn.execute("DELETE FROM hashes WHERE relpath = ?", (self._relpath(path),))
+
+    def prune(self):
+        """Elimina las filas de archivos que ya no existen. Devuelve cuántas."""
+        with self._lock:
+            relpaths = [r[0] for r in self._conn.execute("SELECT relpath FROM hashes").fetchall()]
+        stale = [r for r in relpaths if not os.path.exists(os.path.join(self.root, r))]
+        with self._lock:
+            self._conn.executemany("DELETE FROM hashes WHERE relpath = ?", [(r,) for r in stale])
+        return len(stale)
+
+
+def get_hash_cache(root, logger=None):
+    """Caché de la raíz (una por raíz y proceso; se crea en la primera llamada)."""
+    key = os.path.abspath(root)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            os.makedirs(key, exist_ok=True)
+            cache = _caches[key] = HashCache(key, logger)
+        return cache
+
+
+def close_hash_cache(root):
+    """Cierra y olvida la caché de la raíz (p. ej. al desmontar la USB)."""
+    with _caches_lock:
+        cache = _caches.pop(os.path.abspath(root), None)
+    if cache is not None:
+        cache.close()
@@ -0,0 +1,115 @@
+"""
+Presupuesto de E/S (token bucket) para la migración interna -> USB.
+
+La migración descuenta del presupuesto cada porción que escribe en la USB y espera cuando se agota,
+de modo que no llena la cola del dispositivo por delante de los guardados en vivo. Prioridades:
+- Mientras un almacenamiento hace fsync (live() / live_fsync()), la migración no emite nuevas porciones
+  (espera como máximo max_yield_seconds por porción para no quedar detenida indefinidamente).
+- La tasa se adapta a la latencia de fsync que observan los almacenamientos: si supera
+  target_fsync_ms se reduce a la mitad (hasta min_fraction de la tasa configurada) y, mientras se
+  mantenga por debajo, se recupera de a un 10 % por observación (AIMD).
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+class IOThrottle:
+    def __init__(self, rate_mb_s, target_fsync_ms=100, min_fraction=0.1, burst_seconds=0.5,
+                 max_yield_seconds=0.5, logger=None):
+        self.rate_bytes = rate_mb_s * 2 ** 20
+        self.target_fsync_seconds = target_fsync_ms / 1000
+        self.min_fraction = min_fraction
+        self.burst_seconds = burst_seconds
+        self.max_yield_seconds = max_yield_seconds
+        self.logger = logger if logger is not None else logging.getLogger("io_throttle")
+        self._cond = threading.Condition()
+        self._fraction = 1.0
+        self._tokens = self.rate_bytes * burst_seconds
+        self._last_refill = time.monotonic()
+        self._live = 0
+        # Métricas
+        self.bytes_consumed = 0
+        self.wait_seconds = 0.0
+        self.live_fsyncs = 0
+        self.last_fsync_ms = 0.0
+        self.max_fsync_ms = 0.0
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        rate = self.rate_bytes * self._fraction
+        self._tokens = min(self._tokens + (now - self._last_refill) * rate, rate * self.burst_seconds)
+        self._last_refill = now
+
+    def consume(self, nbytes):
+        """
+        Descuenta nbytes del presupuesto (lado de la migración). Si queda en deuda, duerme lo necesario
+        para saldarla a la tasa actual; porciones mayores que la ráfaga se admiten como deuda.
+        """
+        t0 = time.monotonic()
+        with self._cond:
+            # Los guardados en vivo primero
+            deadline = t0 + self.max_yield_seconds
+            while self._live > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._refill_locked()
+            self._tokens -= nbytes
+            self.bytes_consumed += nbytes
+            debt = -self._tokens
+            delay = debt / (self.rate_bytes * self._fraction) if debt > 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+        with self._cond:
+            self.wait_seconds += time.monotonic() - t0
+
+    @contextmanager
+    def live(self):
+        """Marca una escritura en vivo en curso: la migración no emite porciones mientras dure."""
+        with self._cond:
+            self._live += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._live -= 1
+                if self._live == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def live_fsync(self):
+        """live() que además registra la duración del bloque como latencia de un fsync en vivo."""
+        t0 = time.perf_counter()
+        with self.live():
+            yield
+        self.observe_fsync(time.perf_counter() - t0)
+
+    def observe_fsync(self, seconds):
+        """Adapta la tasa a la latencia de un fsync en vivo (AIMD)."""
+        with self._cond:
+            self.live_fsyncs += 1
+            self.last_fsync_ms = seconds * 1000
+            self.max_fsync_ms = max(self.max_fsync_ms, self.last_fsync_ms)
+            previous = self._fraction
+            if seconds > self.target_fsync_seconds:
+                self._fraction = max(self.min_fraction, self._fraction / 2)
+            else:
+                self._fraction = min(1.0, self._fraction + 0.1)
+            reduced = self._fraction < previous
+            rate_mb_s = self.rate_bytes * self._fraction / 2 ** 20
+        if reduced:
+            self.logger.debug(f"Migración: fsync en vivo de {seconds * 1000:.0f} ms, tasa reducida a {rate_mb_s:.2f} MB/s")
+
+    def stats(self):
+        with self._cond:
+            return {
+                "rate_mb_s": self.rate_bytes * self._fraction / 2 ** 20,
+                "bytes_consumed": self.bytes_consumed,
+                "wait_seconds": self.wait_seconds,
+                "live_fsyncs": self.live_fsyncs,
+                "last_fsync_ms": self.last_fsync_ms,
+                "max_fsync_ms": self.max_fsync_ms,
+            }
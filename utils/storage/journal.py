@@ -0,0 +1,100 @@
+import os
+import json
+
+
+class BlockJournal:
+    """
+    Journal append-only de un bloque: cada lectura se agrega como una línea JSON (JSONL).
+    El descriptor se mantiene abierto mientras el bloque está activo para evitar un open() por lectura.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self.bytes_written = 0
+
+    def _open(self):
+        created = not os.path.exists(self.path)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if created:
+            # Asegurar que la entrada de directorio del journal sobreviva a un corte de energía
+            try:
+                dir_fd = os.open(os.path.dirname(self.path) or ".", os.O_DIRECTORY)
+                os.fsync(dir_fd)
+                os.close(dir_fd)
+            except Exception:
+                pass
+
+    def append(self, record, fsync=True):
+        """Agrega un registro al final del journal. Devuelve los bytes escritos."""
+        if self._fd is None:
+            self._open()
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        os.write(self._fd, line)
+        if fsync:
+            os.fsync(self._fd)
+        self.bytes_written += len(line)
+        return len(line)
+
+    def sync(self):
+        """fsync de lo agregado hasta ahora (permite agrupar varias líneas en un solo fsync)."""
+        if self._fd is not None:
+            os.fsync(self._fd)
+
+    def close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except Exception:
+                pass
+            self._fd = None
+
+    def remove(self):
+        """Cierra y elimina el journal (tras compactarlo en el JSON del bloque)."""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            # Ya no existe o el medio fue retirado: las lecturas siguen en memoria
+            pass
+
+
+JOURNAL_SUFFIX = ".jsonl"
+
+
+def journal_path_for(block_filename):
+    """Ruta del journal asociado a un archivo de bloque (EC.*.json -> EC.*.jsonl)."""
+    return os.path.splitext(block_filename)[0] + JOURNAL_SUFFIX
+
+
+# Segmento de desborde de un bloque abierto (lecturas liberadas de memoria, ver BlockStorage)
+SPILL_SUFFIX = ".spill"
+
+
+def spill_path_for(block_filename):
+    """Ruta del segmento de desborde asociado a un archivo de bloque (EC.*.json -> EC.*.spill), mismo formato JSONL."""
+    return os.path.splitext(block_filename)[0] + SPILL_SUFFIX
+
+
+def iter_records(path):
+    """
+    Genera los registros de un journal sin cargarlo entero en memoria. Una última línea truncada
+    (corte durante la escritura) o líneas corruptas se ignoran.
+    """
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+
+
+def read_records(path):
+    """Lista de los registros de un journal (ver iter_records)."""
+    return list(iter_records(path))
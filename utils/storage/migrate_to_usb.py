@@ -2,12 +2,38 @@ import os
 import shutil
 import logging
 import hashlib
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.storage import archiver
+from utils.storage import hash_cache as hash_cache_mod
+from utils.storage import sqlite_storage
+from utils.storage.journal import JOURNAL_SUFFIX, SPILL_SUFFIX
+
+
+# Tamaño de lectura/escritura al copiar y al calcular hashes
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def _is_transient(name):
+    """
+    Temporales y archivos de trabajo que no se migran (igual que en el modo espejo): commits pendientes
+    (.tmp, .mirror.tmp), copias a medias (.migrating), journals y segmentos de desborde de bloques
+    abiertos y sus corridas de fusión (.spill.runN). Un journal copiado junto al bloque ya cerrado en la
+    USB se volvería a aplicar sobre él.
+    """
+    return (name.endswith(".tmp") or name.endswith(JOURNAL_SUFFIX) or name.endswith(SPILL_SUFFIX)
+            or SPILL_SUFFIX + ".run" in name or name.endswith(".migrating"))
+
+
+class MigrationCancelled(Exception):
+    """La migración se canceló (p. ej. se retiró la USB); lo pendiente queda para la próxima corrida."""
 
 
 def _sha256(path):
     h = hashlib.sha256()
     with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+        for chunk in iter(lambda: f.read(COPY_CHUNK_BYTES), b''):
             h.update(chunk)
     return h.hexdigest()
 
@@ -26,61 +52,374 @@ def _remove_empty_dirs(root_dir, logger):
     return removed
 
 
-def migrate_internal_to_usb(internal_dir, usb_dir, logger=None):
+def _catalog_relocate(catalog, internal_dir, usb_dir, src_file):
+    if catalog is not None:
+        catalog.relocate(internal_dir, usb_dir, os.path.relpath(src_file, internal_dir))
+
+
+def _migrate_archive(src_archive, dest_archive, logger, catalog=None, internal_dir=None, usb_dir=None,
+                     io_throttle=None):
+    """Migra un archivo diario con su índice. Devuelve True si se movió o fusionó contenido."""
+    src_index = src_archive + archiver.INDEX_SUFFIX
+    if not os.path.exists(src_index):
+        logger.warning(f"Archivo diario sin índice, se omite: {src_archive}")
+        return False
+    members = list(archiver.load_index(src_archive)["members"])
+    rel_dir = os.path.relpath(os.path.dirname(src_archive), internal_dir) if internal_dir else None
+    if os.path.exists(dest_archive):
+        added = archiver.merge_archive(src_archive, dest_archive)
+        logger.info(f"Archivo diario fusionado: {src_archive} -> {dest_archive} ({added} bloques nuevos)")
+        if catalog is not None:
+            # Los bloques fusionados cambian de contenido: se recatalogan desde el destino
+            for name in members:
+                catalog.forget(internal_dir, os.path.join(rel_dir, name))
+                catalog.index_file(usb_dir, os.path.join(os.path.dirname(dest_archive), name))
+        return added > 0
+    # Primero el índice (copia), luego el archivo: un corte nunca deja en destino un archivo sin índice
+    if io_throttle is not None:
+        io_throttle.consume(os.path.getsize(src_archive) + os.path.getsize(src_index))
+    shutil.copy2(src_index, dest_archive + archiver.INDEX_SUFFIX)
+    shutil.move(src_archive, dest_archive)
+    os.remove(src_index)
+    if catalog is not None:
+        for name in members:
+            catalog.relocate(internal_dir, usb_dir, os.path.join(rel_dir, name))
+    logger.info(f"Migración: {src_archive} -> {dest_archive}")
+    return True
+
+
+def _copy_and_hash(src_file, dest_file, io_throttle=None, stop_event=None):
+    """
+    Copia src_file a dest_file en una sola lectura del origen, calculando su sha256 al vuelo.
+    El temporal se sincroniza, se descarta de la caché de páginas y se relee una vez para verificar
+    que el medio devuelve los mismos bytes; recién entonces se renombra al destino. Devuelve el sha256.
+    Con io_throttle (IOThrottle), cada porción escrita y la relectura se descuentan de su presupuesto.
+    Si stop_event se activa, se descarta el temporal y se lanza MigrationCancelled.
+    """
+    tmp_file = dest_file + ".migrating"
+    h = hashlib.sha256()
+    try:
+        with open(src_file, 'rb') as src, open(tmp_file, 'wb') as dst:
+            st = os.fstat(src.fileno())
+            for chunk in iter(lambda: src.read(COPY_CHUNK_BYTES), b''):
+                if stop_event is not None and stop_event.is_set():
+                    raise MigrationCancelled(src_file)
+                h.update(chunk)
+                if io_throttle is not None:
+                    io_throttle.consume(len(chunk))
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+            if hasattr(os, "posix_fadvise"):
+                # La verificación debe leer del medio, no de la caché
+                os.posix_fadvise(dst.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        digest = h.hexdigest()
+        if io_throttle is not None:
+            io_throttle.consume(st.st_size)
+        if _sha256(tmp_file) != digest:
+            raise IOError(f"Verificación fallida al copiar {src_file} -> {dest_file}")
+        # Conservar la fecha de modificación (el archivado y la retención la usan como antigüedad)
+        os.utime(tmp_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_file, dest_file)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+    return digest
+
+
+def _same_device(src_dir, dest_dir):
+    try:
+        return os.stat(src_dir).st_dev == os.stat(dest_dir).st_dev
+    except OSError:
+        return False
+
+
+def _move_file(src_file, dest_file, same_device, copied=None, io_throttle=None, stop_event=None):
+    """
+    Mueve un archivo: rename si comparten sistema de archivos; si no, copia verificada y borrado del origen.
+    copied(sha256) se invoca con la copia ya verificada y antes de borrar el origen.
+    """
+    if same_device:
+        os.replace(src_file, dest_file)
+        return
+    digest = _copy_and_hash(src_file, dest_file, io_throttle, stop_event)
+    if copied is not None:
+        copied(digest)
+    os.remove(src_file)
+
+
+class _MigrationContext:
+    """Parámetros compartidos por los hilos de una corrida de migración."""
+
+    def __init__(self, internal_dir, usb_dir, logger, catalog, manifest, same_device, hash_cache, io_throttle,
+                 stop_event):
+        self.internal_dir = internal_dir
+        self.usb_dir = usb_dir
+        self.logger = logger
+        self.catalog = catalog
+        self.manifest = manifest
+        self.same_device = same_device
+        self.io_throttle = io_throttle
+        self.stop_event = stop_event
+        # Cachés de sha256 de cada raíz (None = calcular siempre)
+        self.src_hashes = hash_cache_mod.get_hash_cache(internal_dir, logger) if hash_cache else None
+        self.dest_hashes = hash_cache_mod.get_hash_cache(usb_dir, logger) if hash_cache else None
+
+    def src_sha256(self, path):
+        return self.src_hashes.sha256(path) if self.src_hashes is not None else _sha256(path)
+
+    def dest_sha256(self, path):
+        return self.dest_hashes.sha256(path) if self.dest_hashes is not None else _sha256(path)
+
+    def cancelled(self):
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def source_removed(self, path):
+        if self.src_hashes is not None:
+            self.src_hashes.forget(path)
+
+
+def _migrate_file(ctx, src_file, dest_file, dest_root, file):
+    """Migra un archivo suelto. Devuelve 'migrated', 'duplicate', 'conflict', 'error' o 'cancelled'."""
+    logger, manifest = ctx.logger, ctx.manifest
+    relpath = os.path.relpath(src_file, ctx.internal_dir)
+    try:
+        st = os.stat(src_file)
+        entry = manifest.lookup(relpath, st) if manifest is not None else None
+
+        def copied_to(path):
+            def copied(digest):
+                if ctx.dest_hashes is not None:
+                    # La copia ya se verificó con este hash: el destino no se vuelve a leer
+                    ctx.dest_hashes.record(path, digest)
+                if manifest is not None:
+                    manifest.mark(relpath, st, 'copied', digest, ctx.usb_dir)
+            return copied
+
+        def finished():
+            if manifest is not None:
+                manifest.forget(relpath)
+            ctx.source_removed(src_file)
+            _catalog_relocate(ctx.catalog, ctx.internal_dir, ctx.usb_dir, src_file)
+
+        if (entry is not None and entry["state"] == 'copied' and entry["dest_root"] == ctx.usb_dir
+                and os.path.exists(dest_file) and os.path.getsize(dest_file) == st.st_size):
+            # Copia verificada en una corrida anterior (corte antes de borrar el origen): solo resta borrarlo
+            os.remove(src_file)
+            finished()
+            logger.info(f"Migración reanudada: {src_file} -> {dest_file}")
+            return 'migrated'
+        if not os.path.exists(dest_file):
+            if manifest is not None:
+                # Un corte durante la copia deja el temporal .migrating, que la próxima corrida sobrescribe
+                manifest.mark(relpath, st, 'copying', entry["sha256"] if entry else None, ctx.usb_dir)
+            _move_file(src_file, dest_file, ctx.same_device, copied_to(dest_file), ctx.io_throttle,
+                       ctx.stop_event)
+            finished()
+            logger.info(f"Migración: {src_file} -> {dest_file}")
+            return 'migrated'
+        try:
+            src_hash = entry["sha256"] if entry is not None and entry["sha256"] else ctx.src_sha256(src_file)
+            if manifest is not None and entry is None:
+                manifest.mark(relpath, st, 'copying', src_hash, ctx.usb_dir)
+            dest_hash = ctx.dest_sha256(dest_file)
+        except Exception as eh:
+            logger.warning(f"Error comparando hashes, sobrescribiendo: {src_file} -> {dest_file} ({eh})")
+            _move_file(src_file, dest_file, ctx.same_device, copied_to(dest_file), ctx.io_throttle,
+                       ctx.stop_event)
+            finished()
+            logger.info(f"Migración: {src_file} -> {dest_file}")
+            return 'migrated'
+        if src_hash == dest_hash:
+            # Duplicado idéntico: omitir mover, eliminar origen
+            try:
+                os.remove(src_file)
+            except Exception as er:
+                logger.warning(f"No se pudo eliminar duplicado de origen: {src_file} ({er})")
+                return 'error'
+            logger.info(f"Duplicado omitido (idéntico): {src_file} == {dest_file}")
+            finished()
+            return 'duplicate'
+        # Conflicto: conservar ambos
+        conflict_path = os.path.join(dest_root, f"{file}.conflict-{src_hash[:8]}")
+        _move_file(src_file, conflict_path, ctx.same_device, copied_to(conflict_path), ctx.io_throttle,
+                   ctx.stop_event)
+        logger.warning(f"Conflicto de contenido: {src_file} -> {conflict_path} (destino existente: {dest_file})")
+        if manifest is not None:
+            manifest.forget(relpath)
+        ctx.source_removed(src_file)
+        if ctx.catalog is not None:
+            ctx.catalog.forget(ctx.internal_dir, relpath)
+        return 'conflict'
+    except MigrationCancelled:
+        return 'cancelled'
+    except Exception as e:
+        logger.error(f"No se pudo mover {src_file} -> {dest_file}: {e}")
+        return 'error'
+
+
+def _plan(internal_dir, usb_dir):
+    """Recorre internal_dir una vez: lista de (carpeta destino, origen, destino, nombre, bytes) y bytes totales."""
+    tasks = []
+    total = 0
+    for root, dirs, files in os.walk(internal_dir):
+        dirs.sort()
+        rel_path = os.path.relpath(root, internal_dir)
+        dest_root = os.path.join(usb_dir, rel_path) if rel_path != '.' else usb_dir
+        for file in sorted(files):
+            if _is_transient(file):
+                continue
+            src_file = os.path.join(root, file)
+            try:
+                size = os.path.getsize(src_file)
+            except OSError:
+                continue
+            tasks.append((dest_root, src_file, os.path.join(dest_root, file), file, size))
+            total += size
+    return tasks, total
+
+
+def migrate_internal_to_usb(internal_dir, usb_dir, logger=None, catalog=None, workers=4, manifest=None,
+                            progress=None, hash_cache=True, io_throttle=None, stop_event=None,
+                            storage_roots=None):
     """
     Migra archivos de internal_dir a usb_dir preservando estructura.
-    - Si no existe en destino: mover.
+    - Si no existe en destino: mover (entre sistemas de archivos: copia con sha256 al vuelo, verificación
+      con una relectura del destino y borrado del origen).
     - Si existe en destino y es idéntico (sha256): eliminar origen y registrar como duplicado omitido.
     - Si existe y difiere: conservar ambos; se mueve como <nombre>.conflict-<hash8> y se loguea conflicto.
+    - Archivos diarios comprimidos (.gz/.xz + .idx): se mueven junto con su índice; si el destino ya
+      tiene el archivo del día, se incorporan sus miembros (fusionando lecturas por FECHA/TIEMPO).
+    - Base SQLite (SQLiteBlockStorage, con sus -wal/-shm): sus lecturas se incorporan a la base de la USB.
+    - Con catalog (BlockCatalog), las filas de los bloques migrados pasan a la raíz USB.
+    - Los archivos sueltos se procesan en un pool de 'workers' hilos, de modo que la latencia de la
+      USB se solapa con las lecturas de la memoria interna.
+    - Con manifest (MigrationManifest), una corrida interrumpida se retoma: los archivos ya copiados y
+      verificados solo se eliminan del origen y los sha256 calculados no se recalculan.
+    - Con hash_cache, los sha256 de la comparación de duplicados salen de la caché persistente de cada
+      raíz (hash_cache.py): solo se releen los archivos que cambiaron desde la última vez.
+    - Con io_throttle (IOThrottle), lo que se escribe en la USB respeta su presupuesto de E/S: los
+      guardados en vivo de BlockStorage tienen prioridad y su latencia de fsync regula la tasa.
+    - progress(archivos hechos, archivos totales, bytes hechos, bytes totales) se invoca tras cada archivo;
+      el avance también se registra en el log cada 10 %.
+    - Si stop_event (threading.Event) se activa, la corrida termina en cuanto los hilos sueltan la
+      porción en curso; las copias a medio hacer se descartan y lo pendiente se retoma en la próxima.
+    - Con storage_roots (StorageRoots), cada archivo reserva su tamaño del espacio libre estimado de la USB
+      antes de encolarse (sin disk_usage por archivo); si la USB quedaría por debajo del mínimo, la corrida
+      se detiene y el resto queda en la interna. La reserva es conservadora (un duplicado omitido no ocupa
+      espacio) y el próximo refresco del servicio la corrige.
 
     Retorna: cantidad de archivos movidos (excluye duplicados omitidos).
     """
     if logger is None:
         logger = logging.getLogger("migrate_to_usb")
-    files_migrated = 0
-    files_duplicates = 0
-    files_conflicts = 0
-    for root, dirs, files in os.walk(internal_dir):
-        rel_path = os.path.relpath(root, internal_dir)
-        dest_root = os.path.join(usb_dir, rel_path) if rel_path != '.' else usb_dir
-        os.makedirs(dest_root, exist_ok=True)
-        for file in files:
-            src_file = os.path.join(root, file)
-            dest_file = os.path.join(dest_root, file)
+    counts = {'migrated': 0, 'duplicate': 0, 'conflict': 0, 'error': 0, 'cancelled': 0}
+    workers = max(1, workers)
+    pending = set()
+    dest_dirs = set()
+    os.makedirs(usb_dir, exist_ok=True)
+    # Interna y USB suelen ser dispositivos distintos; si no, mover es un rename
+    ctx = _MigrationContext(internal_dir, usb_dir, logger, catalog, manifest, _same_device(internal_dir, usb_dir),
+                            hash_cache, io_throttle, stop_event)
+    if manifest is not None:
+        resumable = manifest.pending()
+        if resumable:
+            logger.info(f"Manifiesto de migración: {resumable} archivos pendientes de una corrida anterior")
+    tasks, total_bytes = _plan(internal_dir, usb_dir)
+    state = {"files": 0, "bytes": 0, "logged": 0}
+    started = time.monotonic()
+
+    def advance(size, status=None):
+        if status is not None:
+            counts[status] += 1
+        if status == 'cancelled':
+            return
+        state["files"] += 1
+        state["bytes"] += size
+        if progress is not None:
+            progress(state["files"], len(tasks), state["bytes"], total_bytes)
+        percent = int(100 * state["bytes"] / total_bytes) if total_bytes else 100
+        if percent >= state["logged"] + 10:
+            state["logged"] = percent - percent % 10
+            elapsed = time.monotonic() - started
+            eta = elapsed * (total_bytes - state["bytes"]) / state["bytes"] if state["bytes"] else 0
+            logger.info(f"Migración: {percent} % ({state['files']}/{len(tasks)} archivos, ~{eta:.0f} s restantes)")
+
+    def collect(done):
+        for future in done:
+            advance(*future.result())
+
+    def run_file(dest_root, src_file, dest_file, file, size):
+        if ctx.cancelled():
+            return size, 'cancelled'
+        return size, _migrate_file(ctx, src_file, dest_file, dest_root, file)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="migrate") as pool:
+        for dest_root, src_file, dest_file, file, size in tasks:
+            if ctx.cancelled():
+                break
+            if storage_roots is not None and not ctx.same_device:
+                if not storage_roots.has_space(usb_dir, size):
+                    logger.warning(f"Migración detenida: {usb_dir} quedaría por debajo del espacio mínimo "
+                                   f"({state['files']}/{len(tasks)} archivos procesados); el resto queda en la interna")
+                    break
+                storage_roots.debit(dest_file, size)
             try:
-                if os.path.exists(dest_file):
-                    try:
-                        src_hash = _sha256(src_file)
-                        dest_hash = _sha256(dest_file)
-                        if src_hash == dest_hash:
-                            # Duplicado idéntico: omitir mover, eliminar origen
-                            try:
-                                os.remove(src_file)
-                                logger.info(f"Duplicado omitido (idéntico): {src_file} == {dest_file}")
-                                files_duplicates += 1
-                            except Exception as er:
-                                logger.warning(f"No se pudo eliminar duplicado de origen: {src_file} ({er})")
-                            continue
-                        else:
-                            # Conflicto: conservar ambos
-                            conflict_name = f"{file}.conflict-{src_hash[:8]}"
-                            conflict_path = os.path.join(dest_root, conflict_name)
-                            shutil.move(src_file, conflict_path)
-                            logger.warning(f"Conflicto de contenido: {src_file} -> {conflict_path} (destino existente: {dest_file})")
-                            files_conflicts += 1
-                            continue
-                    except Exception as eh:
-                        logger.warning(f"Error comparando hashes, sobrescribiendo: {src_file} -> {dest_file} ({eh})")
-                        shutil.move(src_file, dest_file)
-                        files_migrated += 1
-                        logger.info(f"Migración: {src_file} -> {dest_file}")
-                else:
-                    shutil.move(src_file, dest_file)
-                    files_migrated += 1
-                    logger.info(f"Migración: {src_file} -> {dest_file}")
+                os.makedirs(dest_root, exist_ok=True)
+                if archiver.is_index_file(file):
+                    # El índice viaja con su archivo diario; si quedó huérfano (corte a mitad), se descarta
+                    if (os.path.exists(src_file) and not os.path.exists(src_file[:-len(archiver.INDEX_SUFFIX)])
+                            and os.path.exists(dest_file)):
+                        os.remove(src_file)
+                    advance(size)
+                    continue
+                if sqlite_storage.is_database_file(file):
+                    # La base se fusiona por filas (nunca se copia con su WAL por separado)
+                    if file == sqlite_storage.DB_FILENAME and os.path.exists(src_file):
+                        if io_throttle is not None:
+                            io_throttle.consume(size)
+                        copied = sqlite_storage.merge_database(src_file, dest_file)
+                        logger.info(f"Base SQLite fusionada: {src_file} -> {dest_file} ({copied} lecturas)")
+                        counts['migrated'] += 1
+                    advance(size)
+                    continue
+                if archiver.is_archive_file(file):
+                    if _migrate_archive(src_file, dest_file, logger, catalog, internal_dir, usb_dir, io_throttle):
+                        counts['migrated'] += 1
+                    advance(size)
+                    continue
             except Exception as e:
                 logger.error(f"No se pudo mover {src_file} -> {dest_file}: {e}")
-    logger.info(f"Total migrados: {files_migrated} | duplicados omitidos: {files_duplicates} | conflictos: {files_conflicts}")
+                advance(size, 'error')
+                continue
+            pending.add(pool.submit(run_file, dest_root, src_file, dest_file, file, size))
+            dest_dirs.add(dest_root)
+            # Acotar el trabajo en vuelo (árboles con decenas de miles de bloques)
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(wait(pending).done)
+    if ctx.cancelled():
+        logger.warning(f"Migración cancelada: {state['files']}/{len(tasks)} archivos procesados "
+                       f"(migrados: {counts['migrated']}); el resto queda para la próxima corrida")
+        return counts['migrated']
+    # Entradas de directorio nuevas en la USB: un fsync por carpeta, no por archivo
+    for directory in dest_dirs:
+        try:
+            dir_fd = os.open(directory, os.O_DIRECTORY)
+            os.fsync(dir_fd)
+            os.close(dir_fd)
+        except Exception:
+            pass
+    if manifest is not None:
+        manifest.prune(internal_dir)
+    if ctx.src_hashes is not None:
+        ctx.src_hashes.prune()
+    logger.info(f"Total migrados: {counts['migrated']} | duplicados omitidos: {counts['duplicate']} | "
+                f"conflictos: {counts['conflict']} | errores: {counts['error']}")
     # Limpieza de directorios vacíos en almacenamiento interno (mantiene la raíz)
     try:
         removed_dirs = _remove_empty_dirs(internal_dir, logger)
@@ -88,4 +427,4 @@ def migrate_internal_to_usb(internal_dir, usb_dir, logger=None):
             logger.info(f"Directorios vacíos eliminados en {internal_dir}: {removed_dirs}")
     except Exception as e:
         logger.warning(f"Error durante la limpieza de directorios vacíos en {internal_dir}: {e}")
-    return files_migrated
+    return counts['migrated']
@@ -0,0 +1,119 @@
+"""
+Migración interna -> USB como trabajo en segundo plano.
+
+El monitor de hotplug solo inicia o cancela el trabajo; la migración corre en su propio hilo y publica
+su avance (archivos, bytes, tasa y tiempo restante estimado). Cancelar es inmediato para el monitor:
+activa el evento de parada y la corrida termina en cuanto sus hilos sueltan la porción en curso. Lo
+pendiente se retoma en la próxima conexión (con MigrationManifest, sin recalcular lo ya verificado).
+Reiniciar tampoco bloquea al monitor: el hilo nuevo espera a que termine la corrida cancelada (nunca
+corren dos a la vez) y avisa en el log si la espera supera handoff_timeout.
+"""
+import logging
+import threading
+import time
+
+from utils.storage.hash_cache import close_hash_cache
+from utils.storage.migrate_to_usb import migrate_internal_to_usb
+
+
+class MigrationJob:
+    """Un trabajo de migración a la vez; start() sobre un trabajo en curso lo cancela y lo reemplaza."""
+
+    def __init__(self, logger=None, on_done=None, handoff_timeout=10.0, **migrate_options):
+        # migrate_options: argumentos de migrate_internal_to_usb (catalog, workers, manifest, hash_cache, io_throttle)
+        self.logger = logger if logger is not None else logging.getLogger("migration_job")
+        self.on_done = on_done
+        self.handoff_timeout = handoff_timeout
+        self.migrate_options = migrate_options
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._status = {"state": "idle"}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, internal_dir, usb_dir):
+        """Inicia la migración a usb_dir en segundo plano; si la anterior sigue corriendo la cancela sin esperarla."""
+        self.cancel()
+        previous = self._thread
+        stop = threading.Event()
+        with self._lock:
+            self._stop = stop
+            self._status = {
+                "state": "running", "usb_dir": usb_dir, "started": time.time(),
+                "files_done": 0, "files_total": 0, "bytes_done": 0, "bytes_total": 0,
+                "rate_bytes": 0.0, "eta_seconds": None, "migrated": None,
+            }
+        self._thread = threading.Thread(target=self._run, args=(internal_dir, usb_dir, stop, previous),
+                                        name="migration-job", daemon=True)
+        self._thread.start()
+
+    def cancel(self, wait=False, timeout=None):
+        """Solicita la cancelación. Con wait=True espera a que el hilo termine (como máximo timeout s)."""
+        self._stop.set()
+        thread = self._thread
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def status(self):
+        """Copia del estado: state ('idle', 'running', 'done', 'cancelled', 'failed') y avance."""
+        with self._lock:
+            return dict(self._status)
+
+    def _progress(self, stop, files_done, files_total, bytes_done, bytes_total):
+        with self._lock:
+            if self._stop is not stop:
+                # Corrida cancelada y ya reemplazada: no pisar el estado de la nueva
+                return
+            elapsed = time.time() - self._status["started"]
+            rate = bytes_done / elapsed if elapsed > 0 else 0.0
+            self._status.update(
+                files_done=files_done, files_total=files_total, bytes_done=bytes_done, bytes_total=bytes_total,
+                rate_bytes=rate, eta_seconds=(bytes_total - bytes_done) / rate if rate > 0 else None,
+            )
+
+    def _await_previous(self, previous, stop):
+        """Espera a que termine la corrida cancelada. Devuelve False si esta también se canceló mientras tanto."""
+        waited = 0.0
+        while previous.is_alive():
+            previous.join(self.handoff_timeout)
+            if not previous.is_alive():
+                break
+            waited += self.handoff_timeout
+            self.logger.warning(f"La migración cancelada no terminó tras {waited:.0f} s; la nueva sigue en espera")
+            if stop.is_set():
+                return False
+        return not stop.is_set()
+
+    def _finish(self, stop, state, migrated):
+        with self._lock:
+            if self._stop is stop:
+                self._status.update(state=state, migrated=migrated, eta_seconds=None, finished=time.time())
+
+    def _run(self, internal_dir, usb_dir, stop, previous=None):
+        if previous is not None and not self._await_previous(previous, stop):
+            self._finish(stop, "cancelled", None)
+            return
+        state = "failed"
+        migrated = None
+        try:
+            migrated = migrate_internal_to_usb(internal_dir, usb_dir, self.logger,
+                                               progress=lambda *p: self._progress(stop, *p),
+                                               stop_event=stop, **self.migrate_options)
+            state = "cancelled" if stop.is_set() else "done"
+        except Exception as e:
+            self.logger.error(f"Error en la migración a {usb_dir}: {e}")
+        finally:
+            if state != "done":
+                # USB retirada o corrida fallida: la caché de hashes de esa raíz se reabre en la próxima conexión
+                close_hash_cache(usb_dir)
+            self._finish(stop, state, migrated)
+        if state == "done":
+            self.logger.info(f"Migración completada. Archivos migrados: {migrated}")
+            if self.on_done is not None:
+                try:
+                    self.on_done(usb_dir, migrated)
+                except Exception as e:
+                    self.logger.error(f"Error tras la migración a {usb_dir}: {e}")
@@ -0,0 +1,82 @@
+"""
+Manifiesto persistente de la migración interna -> USB (SQLite en modo WAL, fuera del árbol DTA).
+
+Una fila por archivo en tránsito: ruta relativa, tamaño, mtime, sha256 y estado:
+- 'copying': se está copiando (un corte deja el temporal .migrating en la USB; se recopia desde cero)
+- 'copied': la copia quedó verificada en la USB pero el origen aún no se eliminó
+
+Cuando el origen se elimina la fila se borra, de modo que el manifiesto solo contiene el trabajo
+pendiente. Una nueva corrida consulta la fila del archivo (búsqueda por clave primaria) y, si el
+origen no cambió (mismo tamaño y mtime), reutiliza su sha256 o completa el paso pendiente sin volver
+a leer el archivo. Vive en el almacenamiento interno para sobrevivir a cambios de USB.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    relpath TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT,
+    state TEXT NOT NULL,
+    dest_root TEXT,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class MigrationManifest:
+    """Manifiesto de migración compartido por los hilos de la migración (conexión única con lock)."""
+
+    def __init__(self, db_path, logger=None):
+        self.db_path = db_path
+        self.logger = logger if logger is not None else logging.getLogger("migration_manifest")
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # En WAL, NORMAL mantiene la base consistente ante cortes (solo puede perder el último commit)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def lookup(self, relpath, st):
+        """Fila del archivo como dict si el origen no cambió desde que se registró (st: os.stat); si no, None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, sha256, state, dest_root FROM entries WHERE relpath = ?", (relpath,)).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            return None
+        return {"sha256": row[2], "state": row[3], "dest_root": row[4]}
+
+    def mark(self, relpath, st, state, sha256=None, dest_root=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (relpath, size, mtime_ns, sha256, state, dest_root, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (relpath, st.st_size, st.st_mtime_ns, sha256, state, dest_root, time.time()))
+
+    def forget(self, relpath):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE relpath = ?", (relpath,))
+
+    def pending(self):
+        """Cantidad de filas (archivos con trabajo pendiente de una corrida anterior)."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def prune(self, internal_dir):
+        """Elimina filas cuyo origen ya no existe (borrado por retención o a mano). Devuelve cuántas."""
+        with self._lock:
+            relpaths = [r[0] for r in self._conn.execute("SELECT relpath FROM entries").fetchall()]
+        stale = [r for r in relpaths if not os.path.exists(os.path.join(internal_dir, r))]
+        with self._lock:
+            self._conn.executemany("DELETE FROM entries WHERE relpath = ?", [(r,) for r in stale])
+        return len(stale)
@@ -0,0 +1,403 @@
+"""
+Modo espejo: los almacenamientos escriben siempre en una raíz primaria rápida (memoria interna o tmpfs)
+y un reconciliador replica a la USB en segundo plano.
+
+- Seguimiento de sucios: cada guardado confirmado marca su archivo (mark_dirty). Un bloque que se
+  reescribe cientos de veces por hora se copia una sola vez por ronda, con su última versión.
+- Rondas por lotes: cada interval_seconds (o antes, si lo sucio supera batch_bytes) se escriben todos
+  los temporales en orden de ruta, luego un fsync por temporal, los rename y un fsync por carpeta, de
+  modo que la USB recibe pocas escrituras grandes y secuenciales en lugar de una por lectura.
+- Retirar la USB nunca pierde datos ni bloquea a los sensores: la primaria siempre tiene la versión
+  completa, mark_dirty solo agrega a un conjunto, y lo que no se pudo copiar vuelve a quedar sucio.
+- Al fijar un destino (set_target) se compara la primaria con la USB (tamaño y mtime, que la copia
+  conserva) para recuperar lo que quedó pendiente tras un reinicio o mientras no había USB.
+- Recorte de la primaria (trim_after_seconds): como mucho una vez por hora, los bloques cerrados que
+  ya están en la USB con el mismo tamaño y mtime se eliminan de la primaria. Son elegibles si su fin
+  y su última modificación quedaron hace más de trim_after_seconds y no tienen journal ni segmentos
+  de desborde. Lo que aún no se replicó nunca se recorta. Sin recorte (None), la primaria solo se
+  libera con la retención de su raíz (RetentionManager.add_root, ver main.py).
+- Un bloque recortado que vuelve a escribirse (lectura tardía) no pisa su copia completa: BlockStorage
+  lo restaura desde el destino antes de guardarlo (restore), y si aun así la copia del destino es más
+  grande o más nueva que la primaria (p. ej. escrito sin USB), la ronda fusiona ambas por
+  (FECHA, TIEMPO) en lugar de reemplazarla.
+
+En modo journal, el JSON de un bloque existe recién al cerrarlo: la USB recibe el bloque cerrado.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from utils.storage import columnar
+from utils.storage.block_names import block_end, parse_block_filename
+from utils.storage.journal import JOURNAL_SUFFIX, SPILL_SUFFIX
+
+_COPY_CHUNK_BYTES = 1024 * 1024
+# Período mínimo entre recorridos de recorte de la primaria
+_TRIM_SWEEP_SECONDS = 3600
+
+
+def _is_transient(name):
+    """Temporales y archivos de trabajo de la primaria que no se replican."""
+    return (name.endswith(".tmp") or name.endswith(JOURNAL_SUFFIX) or name.endswith(SPILL_SUFFIX)
+            or SPILL_SUFFIX + ".run" in name or name.endswith(".migrating"))
+
+
+class MirrorReconciler:
+    def __init__(self, primary_root, interval_seconds=300, batch_bytes=8 * 2 ** 20, io_throttle=None,
+                 trim_after_seconds=None, block_type='hour', on_trimmed=None, logger=None):
+        self.primary_root = os.path.abspath(primary_root)
+        self.interval_seconds = interval_seconds
+        self.batch_bytes = batch_bytes
+        self.io_throttle = io_throttle
+        self.trim_after_seconds = trim_after_seconds
+        self.block_type = block_type
+        # on_trimmed(ruta, destino): avisa cada bloque recortado de la primaria (retención, catálogo)
+        self.on_trimmed = on_trimmed
+        self._last_trim = 0.0
+        self.logger = logger if logger is not None else logging.getLogger("mirror")
+        self._lock = threading.Lock()
+        self._dirty = {}  # ruta en la primaria -> bytes (último tamaño conocido)
+        self._dirty_bytes = 0
+        self._target = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # Métricas
+        self.rounds = 0
+        self.files_copied = 0
+        self.bytes_copied = 0
+        self.copy_errors = 0
+        self.files_trimmed = 0
+
+    # ---------------- lado de los almacenamientos ----------------
+
+    def mark_dirty(self, path, size=0):
+        """Marca un archivo de la primaria para replicar en la próxima ronda (no hace E/S)."""
+        with self._lock:
+            previous = self._dirty.get(path, 0)
+            self._dirty[path] = size
+            self._dirty_bytes += size - previous
+            wake = self._target is not None and self._dirty_bytes >= self.batch_bytes
+        if wake:
+            self._wake.set()
+
+    # ---------------- destino (hotplug) ----------------
+
+    @property
+    def target(self):
+        return self._target
+
+    def set_target(self, target_root):
+        """Fija la raíz de la USB y marca lo que la primaria tiene y la USB no (o tiene desactualizado)."""
+        target_root = os.path.abspath(target_root)
+        pending = 0
+        for current, dirs, files in os.walk(self.primary_root):
+            dirs.sort()
+            rel = os.path.relpath(current, self.primary_root)
+            for name in files:
+                if _is_transient(name):
+                    continue
+                src = os.path.join(current, name)
+                dest = os.path.normpath(os.path.join(target_root, rel, name))
+                try:
+                    st = os.stat(src)
+                except OSError:
+                    continue
+                try:
+                    dst = os.stat(dest)
+                    if dst.st_size == st.st_size and dst.st_mtime_ns == st.st_mtime_ns:
+                        continue
+                except OSError:
+                    pass
+                self.mark_dirty(src, st.st_size)
+                pending += 1
+        with self._lock:
+            self._target = target_root
+        self.logger.info(f"Espejo: destino {target_root} ({pending} archivos pendientes de replicar)")
+        self._wake.set()
+
+    def clear_target(self):
+        """La USB se retiró: lo sucio se conserva para el próximo destino."""
+        with self._lock:
+            self._target = None
+        self.logger.info("Espejo: sin destino (USB retirada); la primaria conserva todo")
+
+    # ---------------- hilo reconciliador ----------------
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="mirror-reconciler", daemon=True)
+            self._thread.start()
+
+    def stop(self, flush=True):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        if flush:
+            self.reconcile()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval_seconds)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.reconcile()
+            except Exception as e:
+                self.logger.error(f"Error en la ronda de espejo: {e}")
+            if self.trim_after_seconds is not None and time.time() - self._last_trim >= _TRIM_SWEEP_SECONDS:
+                self._last_trim = time.time()
+                try:
+                    self.trim()
+                except Exception as e:
+                    self.logger.error(f"Error al recortar la primaria del espejo: {e}")
+
+    def reconcile(self):
+        """Una ronda: replica lo sucio al destino. Devuelve la cantidad de archivos copiados."""
+        with self._lock:
+            target = self._target
+            if target is None or not self._dirty:
+                return 0
+            batch, self._dirty, self._dirty_bytes = self._dirty, {}, 0
+        t0 = time.perf_counter()
+        staged = []  # (origen, temporal, destino, stat del origen)
+        failed = []
+        # 1) Temporales en orden de ruta: escrituras secuenciales en la USB
+        for src in sorted(batch):
+            rel = os.path.relpath(src, self.primary_root)
+            if rel.startswith(os.pardir):
+                continue
+            dest = os.path.join(target, rel)
+            try:
+                if self._conflicts(src, dest):
+                    st = self._stage_merged(src, dest, dest + ".mirror.tmp")
+                else:
+                    st = self._stage(src, dest + ".mirror.tmp")
+            except FileNotFoundError:
+                # Eliminado en la primaria (archivado, retención) antes de replicarse
+                continue
+            except Exception as e:
+                self.copy_errors += 1
+                self.logger.warning(f"Espejo: no se pudo copiar {src}: {e}")
+                failed.append(src)
+                continue
+            staged.append((src, dest + ".mirror.tmp", dest, st))
+        # 2) fsync de cada temporal, rename y un fsync por carpeta
+        dirs = set()
+        copied = 0
+        copied_bytes = 0
+        for src, tmp, dest, st in staged:
+            try:
+                fd = os.open(tmp, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                os.replace(tmp, dest)
+                dirs.add(os.path.dirname(dest))
+                copied += 1
+                copied_bytes += st.st_size
+            except Exception as e:
+                self.copy_errors += 1
+                self.logger.warning(f"Espejo: no se pudo confirmar {dest}: {e}")
+                failed.append(src)
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                continue
+            # Si la primaria cambió durante la ronda, se vuelve a copiar en la próxima
+            try:
+                now = os.stat(src)
+                if now.st_size != st.st_size or now.st_mtime_ns != st.st_mtime_ns:
+                    failed.append(src)
+            except OSError:
+                pass
+        for directory in dirs:
+            try:
+                dir_fd = os.open(directory, os.O_DIRECTORY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            except OSError:
+                pass
+        for src in failed:
+            try:
+                size = os.path.getsize(src)
+            except OSError:
+                continue
+            with self._lock:
+                if src not in self._dirty:
+                    self._dirty[src] = size
+                    self._dirty_bytes += size
+        self.rounds += 1
+        self.files_copied += copied
+        self.bytes_copied += copied_bytes
+        self.logger.info(f"Espejo: {copied} archivos ({copied_bytes / 2 ** 20:.2f} MB) replicados a {target} "
+                         f"en {time.perf_counter() - t0:.2f} s")
+        return copied
+
+    def trim(self):
+        """Elimina de la primaria los bloques cerrados ya replicados sin cambios. Devuelve cuántos eliminó."""
+        with self._lock:
+            target = self._target
+            dirty = {os.path.abspath(p) for p in self._dirty}
+        if target is None or self.trim_after_seconds is None:
+            return 0
+        cutoff = time.time() - self.trim_after_seconds
+        cutoff_dt = datetime.fromtimestamp(cutoff)
+        trimmed = 0
+        trimmed_bytes = 0
+        for current, dirs, files in os.walk(self.primary_root):
+            rel = os.path.relpath(current, self.primary_root)
+            names = set(files)
+            for name in files:
+                info = parse_block_filename(name)
+                if info is None or block_end(info["start"], self.block_type) > cutoff_dt:
+                    continue
+                stem = os.path.splitext(name)[0]
+                if stem + JOURNAL_SUFFIX in names or stem + SPILL_SUFFIX in names:
+                    continue
+                src = os.path.join(current, name)
+                if src in dirty:
+                    continue
+                try:
+                    st = os.stat(src)
+                    dst = os.stat(os.path.normpath(os.path.join(target, rel, name)))
+                except OSError:
+                    continue  # Aún no replicado (o USB retirada durante el recorrido)
+                if (st.st_mtime > cutoff or dst.st_size != st.st_size
+                        or dst.st_mtime_ns != st.st_mtime_ns):
+                    continue
+                try:
+                    os.remove(src)
+                except OSError as e:
+                    self.logger.warning(f"Espejo: no se pudo recortar {src}: {e}")
+                    continue
+                trimmed += 1
+                trimmed_bytes += st.st_size
+                if self.on_trimmed is not None:
+                    try:
+                        self.on_trimmed(src, target)
+                    except Exception as e:
+                        self.logger.warning(f"Espejo: error al informar el recorte de {src}: {e}")
+        self.files_trimmed += trimmed
+        if trimmed:
+            self.logger.info(f"Espejo: {trimmed} bloques ({trimmed_bytes / 2 ** 20:.2f} MB) recortados de la "
+                             f"primaria (ya replicados en {target})")
+        return trimmed
+
+    def target_path(self, path):
+        """Ruta de la copia de path en el destino actual (None sin destino o si path está fuera de la primaria)."""
+        target = self._target
+        rel = os.path.relpath(os.path.abspath(path), self.primary_root)
+        if target is None or rel.startswith(os.pardir):
+            return None
+        return os.path.join(target, rel)
+
+    def restore(self, path):
+        """
+        Trae de vuelta a la primaria un bloque que ya no está en ella (recortado) desde su copia en el
+        destino, para que un guardado posterior parta de todas sus lecturas. Devuelve True si lo restauró.
+        """
+        copy = self.target_path(path)
+        if copy is None or os.path.exists(path) or not os.path.exists(copy):
+            return False
+        try:
+            self._stage(copy, path + ".mirror.tmp")
+            os.replace(path + ".mirror.tmp", path)
+        except OSError as e:
+            self.logger.warning(f"Espejo: no se pudo restaurar {path} desde {copy}: {e}")
+            try:
+                os.remove(path + ".mirror.tmp")
+            except OSError:
+                pass
+            return False
+        self.logger.info(f"Espejo: {path} restaurado desde el destino (bloque reescrito tras el recorte)")
+        return True
+
+    @staticmethod
+    def _conflicts(src, dest):
+        """¿La copia del destino de un bloque es más grande o más nueva que la primaria? (no se reemplaza a ciegas)"""
+        if parse_block_filename(os.path.basename(src)) is None:
+            return False
+        try:
+            st, dst = os.stat(src), os.stat(dest)
+        except OSError:
+            return False
+        return dst.st_size > st.st_size or dst.st_mtime_ns > st.st_mtime_ns
+
+    @staticmethod
+    def _load_block(path):
+        if path.endswith(columnar.EXTENSION):
+            return columnar.read_block(path)
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _stage_merged(self, src, dest, tmp):
+        """
+        Escribe en tmp la unión de las lecturas del destino y de la primaria (ante el mismo
+        (FECHA, TIEMPO) gana la primaria), con el formato de la primaria. Devuelve el stat del origen.
+        """
+        st = os.stat(src)
+        structure = self._load_block(src)
+        try:
+            existing = self._load_block(dest).get("LECTURAS", [])
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Espejo: copia ilegible en el destino, se reemplaza: {dest} ({e})")
+            return self._stage(src, tmp)
+        merged = {(l.get("FECHA"), l.get("TIEMPO")): l for l in existing if isinstance(l, dict)}
+        for l in structure.get("LECTURAS", []):
+            merged[(l.get("FECHA"), l.get("TIEMPO"))] = l
+        structure["LECTURAS"] = [merged[k] for k in sorted(merged)]
+        if src.endswith(columnar.EXTENSION):
+            start = parse_block_filename(os.path.basename(src))["start"]
+            payload = columnar.encode_block(structure["TIPO"], structure["NOMBRE"], structure["IDENTIFICADOR"],
+                                            start, structure["LECTURAS"])
+        else:
+            with open(src, "rb") as f:
+                indented = b"\n" in f.read(_COPY_CHUNK_BYTES)
+            payload = (json.dumps(structure, indent=4) if indented
+                       else json.dumps(structure, separators=(",", ":"))).encode("utf-8")
+        os.makedirs(os.path.dirname(tmp), exist_ok=True)
+        if self.io_throttle is not None:
+            self.io_throttle.consume(len(payload))
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.logger.warning(f"Espejo: {dest} fusionado con la primaria ({len(existing)} lecturas en el destino, "
+                            f"{len(structure['LECTURAS'])} tras la fusión)")
+        return st
+
+    def _stage(self, src, tmp):
+        """Copia src al temporal tmp (sin fsync) conservando el mtime. Devuelve el stat del origen copiado."""
+        os.makedirs(os.path.dirname(tmp), exist_ok=True)
+        with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+            st = os.fstat(fsrc.fileno())
+            for chunk in iter(lambda: fsrc.read(_COPY_CHUNK_BYTES), b""):
+                if self.io_throttle is not None:
+                    self.io_throttle.consume(len(chunk))
+                fdst.write(chunk)
+        # Mismo mtime que la primaria: set_target compara tamaño y mtime para saber qué falta
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        return st
+
+    def stats(self):
+        with self._lock:
+            return {
+                "target": self._target,
+                "dirty_files": len(self._dirty),
+                "dirty_bytes": self._dirty_bytes,
+                "rounds": self.rounds,
+                "files_copied": self.files_copied,
+                "bytes_copied": self.bytes_copied,
+                "copy_errors": self.copy_errors,
+                "files_trimmed": self.files_trimmed,
+            }
@@ -0,0 +1,128 @@
+"""
+Detección de conexión/retiro de USB por eventos de la tabla de montajes.
+
+El kernel señala POLLPRI|POLLERR en /proc/self/mountinfo cada vez que cambia la tabla de montajes,
+de modo que el monitor puede dormir en poll() sin despertarse mientras nada cambia y reaccionar en
+milisegundos a un montaje o desmontaje. Si el archivo no admite esa señal (otro sistema, o un
+mountinfo falso en pruebas) se usa sondeo: se relee el archivo cada poll_interval segundos y se
+compara su contenido.
+
+Prueba con un mountinfo falso:
+    watcher = MountWatcher("/tmp/mountinfo", media_base="/media/pi", poll_interval=0.1)
+    # escribir una línea con punto de montaje /media/pi/USB en /tmp/mountinfo
+    watcher.wait_for_change(1.0)  # -> True; watcher.media_mounts() -> ['/media/pi/USB']
+"""
+import logging
+import os
+import re
+import select
+import time
+
+PROC_MOUNTINFO = "/proc/self/mountinfo"
+
+_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+def _unescape(field):
+    # mountinfo escapa espacio, tabulación, salto de línea y barra invertida como \ooo (octal)
+    return _ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), field)
+
+
+def parse_mountinfo(text):
+    """Puntos de montaje (quinto campo de cada línea) de un texto con formato mountinfo."""
+    mounts = []
+    for line in text.splitlines():
+        fields = line.split(" ")
+        if len(fields) >= 5:
+            mounts.append(_unescape(fields[4]))
+    return mounts
+
+
+class MountWatcher:
+    def __init__(self, mountinfo_path=PROC_MOUNTINFO, media_base="/media/pi", poll_interval=5.0,
+                 use_events=None, logger=None):
+        """
+        use_events: True fuerza poll() sobre POLLPRI, False fuerza sondeo y None lo decide por la ruta
+        (eventos solo para archivos de /proc).
+        """
+        self.mountinfo_path = mountinfo_path
+        self.media_base = os.path.abspath(media_base)
+        self.poll_interval = poll_interval
+        self.logger = logger if logger is not None else logging.getLogger("mount_watcher")
+        if use_events is None:
+            use_events = os.path.abspath(mountinfo_path).startswith("/proc/")
+        self._file = None
+        self._poller = None
+        self._text = ""
+        self.mounts = []
+        # Métricas
+        self.wakeups = 0
+        self.changes = 0
+        if use_events:
+            try:
+                self._file = open(mountinfo_path, "rb")
+                self._poller = select.poll()
+                self._poller.register(self._file.fileno(), select.POLLPRI | select.POLLERR)
+            except (OSError, AttributeError) as e:
+                self.logger.warning(f"Sin eventos de montaje en {mountinfo_path} ({e}); se usa sondeo")
+                self.close()
+        self._refresh()
+
+    @property
+    def event_driven(self):
+        return self._poller is not None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._poller = None
+
+    def _read(self):
+        if self._file is not None:
+            # Releer desde el inicio rearma la notificación del kernel
+            self._file.seek(0)
+            return self._file.read().decode("utf-8", "replace")
+        try:
+            with open(self.mountinfo_path, "rb") as f:
+                return f.read().decode("utf-8", "replace")
+        except OSError:
+            return ""
+
+    def _refresh(self):
+        """Relee la tabla. Devuelve True si cambió."""
+        text = self._read()
+        if text == self._text:
+            return False
+        self._text = text
+        self.mounts = parse_mountinfo(text)
+        return True
+
+    def media_mounts(self):
+        """Puntos de montaje directamente bajo media_base (candidatos a USB), en orden de la tabla."""
+        return [m for m in self.mounts if os.path.dirname(m.rstrip("/")) == self.media_base]
+
+    def is_mounted(self, path):
+        return os.path.abspath(path) in self.mounts
+
+    def wait_for_change(self, timeout=None):
+        """
+        Bloquea hasta que la tabla de montajes cambie (True) o pase timeout segundos (False).
+        Con eventos y timeout=None no hay despertares mientras la tabla no cambie.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if self.event_driven:
+                events = self._poller.poll(None if remaining is None else remaining * 1000)
+                self.wakeups += 1
+                if not events:
+                    return False
+            else:
+                time.sleep(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+                self.wakeups += 1
+            if self._refresh():
+                self.changes += 1
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
@@ -0,0 +1,407 @@
+"""
+Retención y cuotas de almacenamiento por raíz DTA y por tipo.
+
+El uso se calcula con un único recorrido al registrar la raíz y luego se mantiene de forma
+incremental: BlockStorage informa cada guardado (note_write) y el propio gestor descuenta lo que
+comprime o elimina. El espacio libre del dispositivo sale del servicio de raíces (StorageRoots), el
+mismo que consulta el camino de escritura: BlockStorage le debita cada guardado y la retención le
+acredita lo que libera. Solo para una raíz que ese servicio no conoce se lee una vez aquí y se debita
+con las escrituras.
+
+Cuando una raíz o un tipo supera su presupuesto:
+  1. Nivel 1: se comprimen los bloques sueltos más antiguos en su archivo diario (archiver.py),
+     a partir de compress_at * presupuesto.
+  2. Nivel 2: si aún se excede, se eliminan las unidades más antiguas (archivo diario con su índice
+     o bloque suelto).
+
+Nunca se toca un bloque abierto: solo son elegibles las unidades cuyo fin (inicio + duración del
+bloque, o el día completo para un archivo diario) y cuya última modificación quedaron hace más de
+min_age_seconds, y que no tienen journal ni segmentos de desborde.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+
+from utils.storage import archiver
+from utils.storage.block_names import block_minutes, parse_block_filename
+from utils.storage.journal import JOURNAL_SUFFIX, SPILL_SUFFIX
+
+# Tipos de entrada en el registro de uso
+_BLOCK, _ARCHIVE, _INDEX, _OTHER = "block", "archive", "index", "other"
+
+
+def _classify(name):
+    """(tipo, clave de antigüedad, clase) de un archivo dentro del árbol DTA."""
+    info = parse_block_filename(name)
+    if info is not None:
+        return info["tipo"].upper(), info["date"] + info["hhmm"], _BLOCK
+    for suffix in (JOURNAL_SUFFIX, SPILL_SUFFIX):
+        if name.endswith(suffix):
+            info = parse_block_filename(name[:-len(suffix)] + ".json")
+            if info is not None:
+                return info["tipo"].upper(), info["date"] + info["hhmm"], _OTHER
+    if archiver.is_index_file(name) or archiver.is_archive_file(name):
+        kind = _INDEX if name.endswith(archiver.INDEX_SUFFIX) else _ARCHIVE
+        base = name[:-len(archiver.INDEX_SUFFIX)] if kind == _INDEX else name
+        stem = os.path.splitext(base)[0]  # EC.<estación>.<tipo>_..._YYYYMMDD
+        tipo = stem.split(".", 2)[-1].split("_", 1)[0].upper()
+        return tipo, stem[-8:] + "0000", kind
+    return None, "", _OTHER
+
+
+class _RootUsage:
+    def __init__(self, root, budget_bytes, storage_roots=None):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.entries = {}  # ruta -> [bytes, tipo, clave de antigüedad, clase]
+        self.total = 0
+        self.by_tipo = {}
+        # Espacio libre: del servicio de raíces si conoce la raíz; si no, medido aquí (free_bytes)
+        self.storage_roots = storage_roots
+        self.free_bytes = None
+        self.written_bytes = 0  # crecimiento acumulado desde la última medición de tasa
+
+    def free(self):
+        if self.storage_roots is not None:
+            return self.storage_roots.free_bytes(self.root)
+        return self.free_bytes
+
+    def set_size(self, path, size, debited=False):
+        """Registra el tamaño de path (None: eliminado). debited: el cambio ya se descontó del espacio libre."""
+        entry = self.entries.get(path)
+        if entry is None:
+            if size is None:
+                return 0
+            tipo, key, kind = _classify(os.path.basename(path))
+            entry = self.entries[path] = [0, tipo, key, kind]
+        delta = (size or 0) - entry[0]
+        self.total += delta
+        self.by_tipo[entry[1]] = self.by_tipo.get(entry[1], 0) + delta
+        if size is None:
+            del self.entries[path]
+        else:
+            entry[0] = size
+        if self.storage_roots is not None:
+            if delta and not debited:
+                self.storage_roots.debit(path, delta)
+        elif self.free_bytes is not None:
+            self.free_bytes -= delta
+        return delta
+
+
+class RetentionManager:
+    """
+    Gestor de retención para una o más raíces DTA.
+
+    budget_bytes: presupuesto por raíz (None = solo se protege min_free_bytes del dispositivo).
+    tipo_budgets: {tipo: bytes} aplicado dentro de cada raíz.
+    block_type: tipo de bloque de los almacenamientos ('hour', 'day' o 'Nmin'); define dónde termina cada bloque.
+    storage_roots: servicio de raíces compartido (StorageRoots) del que se lee el espacio libre.
+    """
+
+    def __init__(self, tipo_budgets=None, min_free_bytes=0, compress_at=0.8, min_age_seconds=7200,
+                 codec="gzip", interval_seconds=600, catalog=None, block_type='hour', storage_roots=None,
+                 logger=None):
+        self.tipo_budgets = {str(k).upper(): v for k, v in (tipo_budgets or {}).items()}
+        self.min_free_bytes = min_free_bytes
+        self.compress_at = compress_at
+        self.min_age_seconds = min_age_seconds
+        self.block_seconds = block_minutes(block_type) * 60
+        self.codec = codec
+        self.interval_seconds = interval_seconds
+        self.catalog = catalog
+        self.storage_roots = storage_roots
+        self.logger = logger if logger is not None else logging.getLogger("retention")
+        self._roots = {}
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._rate_ts = time.time()
+        self._rate_bytes_per_s = None  # crecimiento suavizado (EWMA)
+        self.report_interval_seconds = 3600
+        self._last_report_ts = time.time()
+
+    # ---------------- registro de raíces y uso ----------------
+
+    def add_root(self, root, budget_bytes=None):
+        """Registra una raíz y mide su uso con un único recorrido."""
+        root = os.path.abspath(root)
+        shared = self.storage_roots is not None and self.storage_roots.free_bytes(root) is not None
+        usage = _RootUsage(root, budget_bytes, self.storage_roots if shared else None)
+        for current_root, _, files in os.walk(root):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(current_root, name)
+                try:
+                    usage.set_size(path, os.path.getsize(path), debited=True)
+                except OSError:
+                    pass
+        if not shared:
+            try:
+                usage.free_bytes = shutil.disk_usage(root).free
+            except OSError:
+                usage.free_bytes = None
+        with self._lock:
+            previous = self._roots.get(root)
+            if previous is not None:
+                usage.written_bytes = previous.written_bytes
+            self._roots[root] = usage
+        self.logger.info(f"Retención: {root} usa {usage.total / 2 ** 20:.1f} MB en {len(usage.entries)} archivos")
+        self._wake.set()
+        return usage.total
+
+    def rescan(self, root):
+        """Vuelve a medir una raíz (por ejemplo después de una migración)."""
+        root = os.path.abspath(root)
+        with self._lock:
+            usage = self._roots.get(root)
+        if usage is not None:
+            self.add_root(root, usage.budget_bytes)
+
+    def remove_root(self, root):
+        with self._lock:
+            self._roots.pop(os.path.abspath(root), None)
+
+    def _usage_for(self, path):
+        for root, usage in self._roots.items():
+            if path.startswith(root + os.sep):
+                return usage
+        return None
+
+    def note_write(self, path, size):
+        """Informa el tamaño actual de un archivo recién escrito (O(1), sin stat ni recorrido)."""
+        path = os.path.abspath(path)
+        with self._lock:
+            usage = self._usage_for(path)
+            if usage is None:
+                return
+            # Con servicio de raíces, BlockStorage ya le debitó este guardado
+            delta = usage.set_size(path, size, debited=usage.storage_roots is not None)
+            if delta > 0:
+                usage.written_bytes += delta
+            over = self._over_budget(usage, threshold=1.0)
+        if over:
+            self._wake.set()
+
+    def note_removed(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            usage = self._usage_for(path)
+            if usage is not None:
+                usage.set_size(path, None)
+
+    # ---------------- políticas ----------------
+
+    def _over_budget(self, usage, threshold):
+        """Lista de (tipo o None, exceso en bytes) para la raíz, según el umbral relativo del presupuesto."""
+        over = []
+        if usage.budget_bytes is not None and usage.total > usage.budget_bytes * threshold:
+            over.append((None, usage.total - usage.budget_bytes * threshold))
+        for tipo, budget in self.tipo_budgets.items():
+            used = usage.by_tipo.get(tipo, 0)
+            if used > budget * threshold:
+                over.append((tipo, used - budget * threshold))
+        free = usage.free()
+        if free is not None and free < self.min_free_bytes:
+            over.append((None, self.min_free_bytes - free))
+        return over
+
+    def _candidates(self, usage, tipo, kinds):
+        """Entradas más antiguas primero, solo las que terminaron hace más de min_age_seconds."""
+        cutoff = time.time() - self.min_age_seconds
+        # Fin = inicio + duración: basta comparar la clave de inicio con el corte menos la duración
+        block_cutoff = time.strftime("%Y%m%d%H%M", time.localtime(cutoff - self.block_seconds))
+        day_cutoff = time.strftime("%Y%m%d%H%M", time.localtime(cutoff - 86400))
+        with self._lock:
+            return sorted(
+                (entry[2], path) for path, entry in usage.entries.items()
+                if entry[3] in kinds and (tipo is None or entry[1] == tipo)
+                and entry[2] <= (block_cutoff if entry[3] == _BLOCK else day_cutoff)
+            )
+
+    def _in_use(self, usage, path):
+        """True si el bloque puede seguir escribiéndose: journal o desborde abiertos, o modificado hace poco."""
+        if usage.entries.get(path, [None] * 4)[3] != _BLOCK:
+            return False  # Archivo diario de un día ya terminado (solo crece con bloques cerrados)
+        stem = os.path.splitext(path)[0]
+        if stem + JOURNAL_SUFFIX in usage.entries or stem + SPILL_SUFFIX in usage.entries:
+            return True
+        try:
+            return os.path.getmtime(path) > time.time() - self.min_age_seconds
+        except FileNotFoundError:
+            return False
+
+    def _compress(self, usage, tipo, excess):
+        """Nivel 1: comprime bloques sueltos antiguos hasta cubrir el exceso. Devuelve bytes liberados."""
+        freed = 0
+        for _, path in self._candidates(usage, tipo, (_BLOCK,)):
+            if freed >= excess:
+                break
+            if self._in_use(usage, path):
+                continue
+            try:
+                archive = archiver.archive_block_file(path, self.codec)
+            except Exception as e:
+                self.logger.warning(f"Retención: no se pudo comprimir {path}: {e}")
+                continue
+            with self._lock:
+                before = usage.total
+                if archive is None:
+                    # Reescrito durante el archivado: el original sigue en disco (el archivo diario creció igual)
+                    day_prefix = parse_block_filename(os.path.basename(path))["day_prefix"]
+                    archive = archiver.archive_path_for(os.path.dirname(path), day_prefix, self.codec)
+                else:
+                    usage.set_size(path, None)
+                for p in (archive, archive + archiver.INDEX_SUFFIX):
+                    try:
+                        usage.set_size(p, os.path.getsize(p))
+                    except OSError:
+                        pass
+                freed += before - usage.total
+        return freed
+
+    def _evict(self, usage, tipo, excess):
+        """Nivel 2: elimina las unidades más antiguas hasta cubrir el exceso. Devuelve bytes liberados."""
+        freed = 0
+        evicted = 0
+        for _, path in self._candidates(usage, tipo, (_BLOCK, _ARCHIVE)):
+            if freed >= excess:
+                break
+            paths = [path]
+            entry = usage.entries.get(path)
+            if entry is None or self._in_use(usage, path):
+                continue
+            if entry[3] == _ARCHIVE:
+                paths.append(path + archiver.INDEX_SUFFIX)
+                members = list(archiver.load_index(path)["members"])
+            else:
+                members = [os.path.basename(path)]
+            for p in paths:
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    self.logger.error(f"Retención: no se pudo eliminar {p}: {e}")
+                    continue
+                with self._lock:
+                    entry = usage.entries.get(p)
+                    if entry is not None:
+                        freed += entry[0]
+                        usage.set_size(p, None)
+            if self.catalog is not None:
+                rel_dir = os.path.relpath(os.path.dirname(path), usage.root)
+                for name in members:
+                    try:
+                        self.catalog.forget(usage.root, os.path.join(rel_dir, name))
+                    except Exception:
+                        pass
+            evicted += 1
+            self.logger.warning(f"Retención: eliminado por cuota {path}")
+        if evicted:
+            self.logger.warning(f"Retención: {evicted} unidades eliminadas en {usage.root} ({freed / 2 ** 20:.1f} MB)")
+        return freed
+
+    def run_once(self):
+        """Aplica ambos niveles en todas las raíces. Devuelve bytes liberados."""
+        freed = 0
+        with self._lock:
+            roots = list(self._roots.values())
+        for usage in roots:
+            for tipo, excess in self._over_budget(usage, self.compress_at):
+                freed += self._compress(usage, tipo, excess)
+            for tipo, excess in self._over_budget(usage, 1.0):
+                freed += self._evict(usage, tipo, excess)
+        self._update_rate()
+        now = time.time()
+        if now - self._last_report_ts >= self.report_interval_seconds:
+            self._last_report_ts = now
+            self._report()
+        return freed
+
+    def _report(self):
+        for root, st in self.status().items():
+            budget = f"{st['budget_bytes'] / 2 ** 20:.0f} MB" if st["budget_bytes"] is not None else "sin límite"
+            headroom = f"{st['headroom_days']:.1f} días" if st["headroom_days"] is not None else "sin estimación"
+            self.logger.info(f"Retención: {root} usa {st['used_bytes'] / 2 ** 20:.1f} MB "
+                             f"(presupuesto {budget}) | margen: {headroom}")
+
+    # ---------------- métricas ----------------
+
+    def _update_rate(self):
+        now = time.time()
+        with self._lock:
+            elapsed = now - self._rate_ts
+            if elapsed < 60:
+                return
+            written = sum(u.written_bytes for u in self._roots.values())
+            for u in self._roots.values():
+                u.written_bytes = 0
+            rate = written / elapsed
+            self._rate_bytes_per_s = rate if self._rate_bytes_per_s is None else (
+                0.8 * self._rate_bytes_per_s + 0.2 * rate)
+            self._rate_ts = now
+
+    def headroom_days(self, root):
+        """Días hasta alcanzar el presupuesto (o el mínimo libre) al ritmo de escritura observado; None si no hay datos."""
+        root = os.path.abspath(root)
+        with self._lock:
+            usage = self._roots.get(root)
+            rate = self._rate_bytes_per_s
+            if usage is None:
+                return None
+            if rate is None:
+                # Aún sin medición suavizada: usar lo escrito desde el inicio
+                elapsed = max(time.time() - self._rate_ts, 1.0)
+                rate = usage.written_bytes / elapsed
+            limits = []
+            if usage.budget_bytes is not None:
+                limits.append(usage.budget_bytes - usage.total)
+            free = usage.free()
+            if free is not None:
+                limits.append(free - self.min_free_bytes)
+        if not limits or rate <= 0:
+            return None
+        return max(min(limits), 0) / (rate * 86400)
+
+    def status(self):
+        """Resumen por raíz: usado, presupuesto, libre estimado, uso por tipo y días de margen."""
+        with self._lock:
+            roots = list(self._roots.values())
+        return {
+            u.root: {
+                "used_bytes": u.total,
+                "budget_bytes": u.budget_bytes,
+                "free_bytes": u.free(),
+                "by_tipo": dict(u.by_tipo),
+                "headroom_days": self.headroom_days(u.root),
+            }
+            for u in roots
+        }
+
+    # ---------------- hilo ----------------
+
+    def request_run(self):
+        """Adelanta la próxima pasada (p. ej. ante poco espacio libre en el camino de escritura)."""
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except Exception:
+            pass
+        while True:
+            self._wake.wait(self.interval_seconds)
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                self.logger.error(f"Error en retención: {e}")
@@ -0,0 +1,88 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class RolloverScheduler:
+    """
+    Planificador de cierres de bloque compartido por todos los almacenamientos del proceso.
+
+    Mantiene un único heap de temporizadores (hora de reloj de pared, callback) atendido por un solo
+    hilo. Cada BlockStorage agenda el cierre de su bloque abierto para el fin del bloque, de modo que
+    el bloque se finaliza aunque el sensor deje de enviar datos.
+
+    Se usa la hora de pared (time.time) y la espera se parte en tramos cortos: si el reloj del sistema
+    se corrige (sincronización GPS/NTP), el cierre se reevalúa como máximo max_wait_seconds después.
+    """
+
+    def __init__(self, logger=None, max_wait_seconds=30.0):
+        self.logger = logger if logger is not None else logging.getLogger("rollover")
+        self.max_wait_seconds = max_wait_seconds
+        self._heap = []  # (instante, secuencia)
+        self._callbacks = {}  # secuencia -> callback (ausente = cancelado)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="block-rollover", daemon=True)
+                self._thread.start()
+
+    def schedule(self, when_ts, callback):
+        """Agenda callback() para el instante when_ts (epoch). Devuelve un token para cancel()."""
+        with self._cond:
+            token = next(self._seq)
+            self._callbacks[token] = callback
+            heapq.heappush(self._heap, (when_ts, token))
+            self._cond.notify()
+        return token
+
+    def cancel(self, token):
+        if token is None:
+            return
+        with self._cond:
+            # Borrado perezoso: la entrada del heap se descarta al llegar a la cima
+            self._callbacks.pop(token, None)
+
+    def pending(self):
+        with self._cond:
+            return len(self._callbacks)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._heap and self._heap[0][1] not in self._callbacks:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait(self.max_wait_seconds)
+                    continue
+                when_ts, token = self._heap[0]
+                delay = when_ts - time.time()
+                if delay > 0:
+                    self._cond.wait(min(delay, self.max_wait_seconds))
+                    continue
+                heapq.heappop(self._heap)
+                callback = self._callbacks.pop(token)
+            # Fuera del lock: el callback toma el lock de su almacenamiento y puede reagendar
+            try:
+                callback()
+            except Exception as e:
+                self.logger.error(f"Error en cierre programado de bloque: {e}")
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_rollover_scheduler(logger=None):
+    """Devuelve el planificador de cierres del proceso (lo crea y arranca en la primera llamada)."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RolloverScheduler(logger=logger)
+            _scheduler.start()
+        return _scheduler
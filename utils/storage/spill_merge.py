@@ -0,0 +1,177 @@
+"""
+Fusión en streaming de un bloque desbordado (ver BlockStorage._spill) al cerrarlo.
+
+Un bloque desbordado puede tener muchas más lecturas que max_resident_readings, de modo que su
+archivo final se arma sin cargar en memoria los segmentos ni el archivo previo:
+
+1. Corridas: los segmentos .spill se leen en orden de escritura por tramos de run_size lecturas;
+   cada tramo se deduplica por intervalo (gana la última), se ordena por (FECHA, TIEMPO) y se
+   escribe como corrida JSONL temporal junto al bloque (<bloque>.spill.runN).
+2. Fusión: heapq.merge de las corridas y de lo residente en memoria. Las lecturas de un mismo
+   intervalo quedan contiguas y gana la más reciente (corrida posterior; memoria al final).
+3. Base: el archivo del bloque ya existente (guardado antes del desborde o en otra ejecución) se lee
+   en streaming y se intercala; ante el mismo (FECHA, TIEMPO) prevalece lo desbordado. Un bloque que
+   solo sigue en su archivo diario se lee de allí completo (un miembro).
+
+En memoria hay a lo sumo un tramo de run_size lecturas (paso 1) y una lectura por corrida (pasos 2
+y 3). Si la base no está ordenada o está dañada, iter_base_readings lanza ValueError y el llamador
+vuelve a la fusión en memoria.
+"""
+import heapq
+import json
+import os
+
+from utils.storage import columnar
+from utils.storage.archiver import find_archived_block
+from utils.storage.journal import iter_records
+
+RUN_SIZE = 10000
+_READ_CHUNK = 64 * 1024
+_COLUMNAR_ROWS = 4096
+
+
+def _reading_key(rec):
+    return rec.get("FECHA"), rec.get("TIEMPO")
+
+
+def write_runs(segment_paths, slot_key, run_prefix, run_size=RUN_SIZE):
+    """Corridas ordenadas y deduplicadas de los segmentos (en orden de escritura). Devuelve sus rutas."""
+    runs = []
+    chunk = {}
+
+    def flush():
+        path = f"{run_prefix}.run{len(runs)}"
+        with open(path, "w") as f:
+            for rec in sorted(chunk.values(), key=_reading_key):
+                f.write(json.dumps(rec, separators=(",", ":")) + "\n")
+        runs.append(path)
+        chunk.clear()
+
+    try:
+        for segment in segment_paths:
+            for rec in iter_records(segment):
+                key = slot_key(rec)
+                chunk.pop(key, None)
+                chunk[key] = rec
+                if len(chunk) >= run_size:
+                    flush()
+        if chunk:
+            flush()
+    except BaseException:
+        remove_runs(runs)
+        raise
+    return runs
+
+
+def remove_runs(runs):
+    for path in runs:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def merge_spilled(runs, resident, slot_key):
+    """Lecturas de las corridas y de memoria, una por intervalo (la más reciente), en orden (FECHA, TIEMPO)."""
+    def tagged(seq, records):
+        for pos, rec in enumerate(records):
+            yield _reading_key(rec), seq, pos, rec
+
+    streams = [tagged(seq, iter_records(path)) for seq, path in enumerate(runs)]
+    streams.append(tagged(len(runs), sorted(resident, key=_reading_key)))
+    group, best = None, None
+    for _, seq, pos, rec in heapq.merge(*streams, key=lambda item: item[:3]):
+        slot = slot_key(rec)
+        if slot != group:
+            if best is not None:
+                yield best[1]
+            group, best = slot, ((seq, pos), rec)
+        elif (seq, pos) > best[0]:
+            best = ((seq, pos), rec)
+    if best is not None:
+        yield best[1]
+
+
+def merge_with_base(spilled, base):
+    """Intercala la base con lo desbordado (ambos ordenados); ante el mismo (FECHA, TIEMPO) gana lo desbordado."""
+    spilled, base = iter(spilled), iter(base)
+    a, b = next(spilled, None), next(base, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and _reading_key(a) <= _reading_key(b)):
+            if b is not None and _reading_key(a) == _reading_key(b):
+                b = next(base, None)
+            yield a
+            a = next(spilled, None)
+        else:
+            yield b
+            b = next(base, None)
+
+
+def _checked_order(readings, path):
+    """Exige orden estricto por (FECHA, TIEMPO), el que producen los guardados de BlockStorage."""
+    last = None
+    for rec in readings:
+        if not isinstance(rec, dict):
+            raise ValueError(f"lectura inválida en {path}")
+        key = _reading_key(rec)
+        if last is not None and not key > last:
+            raise ValueError(f"bloque no ordenado: {path}")
+        last = key
+        yield rec
+
+
+def _iter_json_readings(path):
+    """Elementos de LECTURAS de un bloque JSON (con o sin sangría), decodificados de a uno."""
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buf = ""
+        pos = -1
+        while pos < 0:
+            more = f.read(_READ_CHUNK)
+            if not more:
+                return
+            buf += more
+            start = buf.find('"LECTURAS"')
+            if start >= 0:
+                bracket = buf.find("[", start)
+                if bracket >= 0:
+                    pos = bracket + 1
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                if pos >= len(buf):
+                    raise json.JSONDecodeError("fin del búfer", buf, pos)
+                rec, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                more = f.read(_READ_CHUNK)
+                if not more:
+                    raise ValueError(f"bloque truncado: {path}")
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield rec
+            if pos > _READ_CHUNK:
+                buf, pos = buf[pos:], 0
+
+
+def _iter_columnar_readings(path):
+    with open(path, "rb") as f:
+        header = columnar.read_header(f)
+        base = f.tell()
+        for start in range(0, header["FILAS"], _COLUMNAR_ROWS):
+            yield from columnar.read_rows(f, header, base, start, start + _COLUMNAR_ROWS)
+
+
+def iter_base_readings(path, block_format):
+    """Lecturas del archivo de bloque existente, en streaming y verificando su orden."""
+    if not os.path.exists(path):
+        # Solo archivado (archivo diario): el miembro se descomprime entero, como en _load_existing_block
+        archived = find_archived_block(path)
+        readings = archived.get("LECTURAS", []) if isinstance(archived, dict) else []
+    elif block_format == "columnar":
+        readings = _iter_columnar_readings(path)
+    else:
+        readings = _iter_json_readings(path)
+    return _checked_order(readings, path)
@@ -0,0 +1,234 @@
+"""
+Almacenamiento de lecturas en SQLite, alternativo a los archivos JSON de BlockStorage.
+
+Expone la misma interfaz que usan los managers y main.py (add_data, flush, set_output_dir, close) y
+guarda las lecturas en una base por raíz (<raíz DTA>/volcpi.sqlite) en modo WAL. Las inserciones se
+agrupan en una transacción cada write_interval_seconds o batch_size lecturas.
+
+La deduplicación por intervalo es la misma: una lectura por (FECHA, hora, minuto // interval_minutes);
+prevalece la de TIEMPO más reciente (también al fusionar la base interna con la de la USB). Los EC.*.json de siempre se generan a pedido con export_json().
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from utils.log_utils import setup_logger
+from utils.storage.block_names import block_basename, block_end, block_floor, block_minutes
+
+DB_FILENAME = "volcpi.sqlite"
+_DB_SUFFIXES = ("", "-wal", "-shm")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    tipo TEXT NOT NULL,
+    station TEXT NOT NULL,
+    model TEXT NOT NULL,
+    serial TEXT NOT NULL,
+    identifier TEXT,
+    fecha TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    tiempo TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (tipo, station, model, serial, fecha, slot)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS readings_time ON readings (tipo, fecha, tiempo);
+"""
+
+# Ante la misma clave de intervalo gana la lectura de TIEMPO más reciente (una anterior nunca pisa a una nueva)
+_ON_CONFLICT = (" ON CONFLICT (tipo, station, model, serial, fecha, slot) DO UPDATE SET"
+                " identifier = excluded.identifier, tiempo = excluded.tiempo, data = excluded.data"
+                " WHERE excluded.tiempo {} readings.tiempo")
+_UPSERT = ("INSERT INTO readings (tipo, station, model, serial, identifier, fecha, slot, tiempo, data)"
+           " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)" + _ON_CONFLICT.format(">="))
+# Fusión entre bases: ante el mismo TIEMPO se conserva la fila del destino
+_MERGE = ("INSERT INTO main.readings SELECT * FROM src.readings WHERE true" + _ON_CONFLICT.format(">"))
+
+
+def is_database_file(name):
+    return any(name == DB_FILENAME + suffix for suffix in _DB_SUFFIXES)
+
+
+def open_database(path):
+    """Conexión en modo WAL con el esquema creado (autocommit; las transacciones se abren explícitamente)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # En WAL, NORMAL solo arriesga la última transacción ante un corte de energía (nunca corrompe la base)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def merge_database(src_path, dest_path):
+    """
+    Incorpora las lecturas de una base (p. ej. la interna) en otra (p. ej. la de la USB) y elimina el origen.
+    Ante la misma clave de intervalo prevalece la lectura de TIEMPO más reciente, venga de donde venga.
+    Devuelve la cantidad de filas copiadas.
+    """
+    conn = open_database(dest_path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS src", (src_path,))
+        conn.execute("BEGIN")
+        cur = conn.execute(_MERGE)
+        copied = cur.rowcount
+        conn.execute("COMMIT")
+        conn.execute("DETACH DATABASE src")
+    finally:
+        conn.close()
+    for suffix in _DB_SUFFIXES:
+        try:
+            os.remove(src_path + suffix)
+        except FileNotFoundError:
+            pass
+    return copied
+
+
+class SQLiteBlockStorage:
+    def __init__(self, station_name, identifier, model, serial_number, logger=None, output_dir=None,
+                 block_type='hour', tipo="GENERIC", interval_minutes=1, extractor_func=None, batch_size=500,
+                 **block_storage_options):
+        # block_storage_options: opciones propias de BlockStorage (write_mode, block_format, catalog, ...).
+        # Se aceptan para que main.py pueda usar cualquiera de los dos backends con los mismos argumentos.
+        self.station_name = station_name
+        self.identifier = identifier
+        self.model = model
+        self.serial_number = serial_number
+        self.tipo = tipo
+        if logger is not None:
+            self.logger = logger
+        else:
+            self.logger = setup_logger("block_storage", log_file="block_storage.log")
+        block_minutes(block_type)
+        self.block_type = block_type
+        self.interval_minutes = interval_minutes
+        self.extractor_func = extractor_func
+        self.batch_size = batch_size
+        # Igual que BlockStorage: se confirma en disco cada N segundos
+        self.write_interval_seconds = 10
+        self._last_write_ts = time.time()
+        self._pending = []
+        self._lock = threading.RLock()
+        self.output_dir = output_dir
+        self._conn = open_database(self.db_path) if output_dir else None
+
+    @property
+    def db_path(self):
+        return os.path.join(self.output_dir, DB_FILENAME)
+
+    def _row(self, data):
+        tiempo = data["TIEMPO"]
+        # Misma clave de intervalo que BlockStorage._slot_key: (FECHA, hora, minuto // interval_minutes)
+        slot = int(tiempo[:2]) * 100 + int(tiempo[3:5]) // self.interval_minutes
+        return (str(self.tipo).upper(), self.station_name, self.model, self.serial_number, str(self.identifier),
+                data["FECHA"], slot, tiempo, json.dumps(data, separators=(",", ":")))
+
+    def add_data(self, raw, timestamp=None):
+        now = timestamp if timestamp is not None else datetime.now()
+        with self._lock:
+            data = self.extractor_func(raw, now) if self.extractor_func else raw
+            if not data:
+                return
+            self._pending.append(self._row(data))
+            if (len(self._pending) >= self.batch_size or
+                    time.time() - self._last_write_ts >= self.write_interval_seconds):
+                self._commit_locked()
+
+    def _commit_locked(self):
+        """Inserta lo pendiente en una sola transacción."""
+        self._last_write_ts = time.time()
+        if not self._pending or self._conn is None:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(_UPSERT, rows)
+            self._conn.execute("COMMIT")
+        except Exception as e:
+            try:
+                self._conn.execute("ROLLBACK")
+            except Exception:
+                pass
+            # Conservar las lecturas para el próximo intento
+            self._pending = rows + self._pending
+            self.logger.error(f"[{str(self.tipo).upper()}] Error al guardar en {self.db_path}: {e}")
+            return
+        self.logger.info(f"{self.tipo} data saved: {self.db_path} ({len(rows)} lecturas)")
+
+    def flush(self):
+        with self._lock:
+            self._commit_locked()
+
+    def close(self):
+        with self._lock:
+            self._commit_locked()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def set_output_dir(self, new_output_dir):
+        """Cambia la raíz: lo pendiente se guarda en la nueva base (igual que BlockStorage)."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self.output_dir = new_output_dir
+            self._conn = open_database(self.db_path)
+            self.logger.info(f"[{str(self.tipo).upper()}] Ruta de almacenamiento cambiada a: {new_output_dir}")
+            self._commit_locked()
+
+    def set_write_interval(self, seconds: int):
+        with self._lock:
+            self.write_interval_seconds = max(seconds, 0)
+            self._last_write_ts = time.time()
+
+    def create_empty_structure(self):
+        return {
+            "TIPO": self.tipo,
+            "NOMBRE": self.station_name,
+            "IDENTIFICADOR": self.identifier,
+            "LECTURAS": []
+        }
+
+    def read_block(self, block_start):
+        """Lecturas del bloque que empieza en block_start, ordenadas por (FECHA, TIEMPO)."""
+        end = block_end(block_start, self.block_type)
+        lo = (block_start.strftime("%Y-%m-%d"), block_start.strftime("%H:%M:%S"))
+        hi = (end.strftime("%Y-%m-%d"), end.strftime("%H:%M:%S"))
+        with self._lock:
+            self._commit_locked()
+            rows = self._conn.execute(
+                "SELECT data FROM readings WHERE tipo = ? AND station = ? AND model = ? AND serial = ?"
+                " AND (fecha, tiempo) >= (?, ?) AND (fecha, tiempo) < (?, ?) ORDER BY fecha, tiempo",
+                (str(self.tipo).upper(), self.station_name, self.model, self.serial_number) + lo + hi).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def export_json(self, start, end=None, out_root=None):
+        """
+        Genera los EC.*.json (mismo formato y rutas que BlockStorage) para los bloques de [start, end].
+        Devuelve la lista de archivos escritos.
+        """
+        out_root = out_root or self.output_dir
+        end = end or start
+        written = []
+        block_start = block_floor(start, self.block_type)
+        while block_start <= end:
+            lecturas = self.read_block(block_start)
+            if lecturas:
+                directory = os.path.join(out_root, block_start.strftime("%Y"), block_start.strftime("%m"),
+                                         block_start.strftime("%d"), str(self.tipo).upper())
+                os.makedirs(directory, exist_ok=True)
+                filename = os.path.join(directory, block_basename(
+                    self.station_name, self.tipo, self.model, self.serial_number, block_start, self.block_type))
+                file_data = self.create_empty_structure()
+                file_data["LECTURAS"] = lecturas
+                tmp = filename + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(file_data, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, filename)
+                written.append(filename)
+            block_start = block_end(block_start, self.block_type)
+        return written
@@ -0,0 +1,168 @@
+"""
+Servicio de raíces de almacenamiento: raíz actual (USB o interna) y espacio libre, en memoria.
+
+Una exploración de /media (listdir, ismount, access y disk_usage por candidato) solo ocurre en
+refresh(): al arrancar, ante un cambio de la tabla de montajes (el monitor de hotplug lo invoca) y
+cada refresh_seconds desde un hilo propio. Entre refrescos, cada guardado descuenta sus bytes del
+espacio libre de su raíz (debit), de modo que has_space() en el camino de escritura es una resta y
+una comparación. El descuento es conservador (un bloque reescrito descuenta su tamaño completo); el
+próximo refresh vuelve al valor real del sistema de archivos.
+
+Lo consultan BlockStorage (has_space antes de cada guardado), RetentionManager (espacio libre de sus
+raíces y lo que libera), startup_diagnostics, la migración y get_storage_base()/get_dta_path().
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+
+from utils.storage.storage_utils import list_mounted_usb, select_usb
+
+_roots = None
+_roots_lock = threading.Lock()
+
+
+def _is_under(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+class StorageRoots:
+    def __init__(self, internal_dir, min_free_mb=50, refresh_seconds=60, watcher=None, logger=None):
+        self.internal_dir = os.path.abspath(internal_dir)
+        os.makedirs(self.internal_dir, exist_ok=True)
+        self.min_free_bytes = min_free_mb * 2 ** 20
+        self.refresh_seconds = refresh_seconds
+        self.watcher = watcher
+        self.logger = logger if logger is not None else logging.getLogger("storage_roots")
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._usb_path = None  # primera USB con espacio suficiente
+        self._mounted_usb = None  # primera USB montada y escribible (aunque no tenga espacio)
+        self._free = {}  # raíz (punto de montaje USB o internal_dir) -> bytes libres estimados
+        self._low = set()  # raíces ya advertidas por poco espacio
+        self.refreshed_ts = 0.0
+        # Métricas
+        self.refreshes = 0
+        self.debits = 0
+
+    # ---------------- refresco ----------------
+
+    def refresh(self):
+        """Explora las USB montadas y mide el espacio libre real. Devuelve la ruta de la USB utilizable."""
+        mounts = self.watcher.media_mounts() if self.watcher is not None else None
+        candidates = list_mounted_usb(mounts)
+        free = dict(candidates)
+        try:
+            free[self.internal_dir] = shutil.disk_usage(self.internal_dir).free
+        except OSError:
+            pass
+        usb_path = select_usb(candidates, self.min_free_bytes // 2 ** 20)
+        with self._lock:
+            previous = self._usb_path
+            self._usb_path = usb_path
+            self._mounted_usb = candidates[0][0] if candidates else None
+            self._free = free
+            self._low = {root for root in self._low if free.get(root, 0) < self.min_free_bytes}
+            self.refreshed_ts = time.time()
+            self.refreshes += 1
+        if usb_path != previous:
+            self.logger.info(f"Raíz de almacenamiento: {os.path.join(usb_path, 'DTA') if usb_path else self.internal_dir}")
+        return usb_path
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="storage-roots", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.error(f"Error al refrescar las raíces de almacenamiento: {e}")
+
+    # ---------------- consultas (sin E/S) ----------------
+
+    @property
+    def usb_path(self):
+        """Punto de montaje de la USB con espacio suficiente (None si no hay)."""
+        return self._usb_path
+
+    @property
+    def mounted_usb(self):
+        """Punto de montaje de la USB aunque no tenga el espacio mínimo (para lecturas)."""
+        return self._mounted_usb
+
+    @property
+    def dta_root(self):
+        """Raíz DTA donde escribir: la de la USB si hay una utilizable; si no, la interna."""
+        usb_path = self._usb_path
+        return os.path.join(usb_path, "DTA") if usb_path else self.internal_dir
+
+    def storage_base(self):
+        """Mismo resultado que get_storage_base(): punto de montaje de la USB o la raíz interna."""
+        return self._usb_path or self.internal_dir
+
+    def _root_for(self, path):
+        path = os.path.abspath(path)
+        for root in self._free:
+            if root != self.internal_dir and _is_under(path, root):
+                return root
+        return self.internal_dir if _is_under(path, self.internal_dir) else None
+
+    def free_bytes(self, path):
+        """Espacio libre estimado de la raíz que contiene path (None si no es una raíz conocida)."""
+        with self._lock:
+            root = self._root_for(path)
+            return self._free.get(root) if root is not None else None
+
+    def has_space(self, path, nbytes=0):
+        """¿Quedan al menos nbytes más el mínimo configurado en la raíz de path? Sin datos: True."""
+        free = self.free_bytes(path)
+        return free is None or free - nbytes >= self.min_free_bytes
+
+    def debit(self, path, nbytes):
+        """Descuenta nbytes escritos en path del espacio libre estimado de su raíz (negativo: bytes liberados)."""
+        warn = None
+        with self._lock:
+            root = self._root_for(path)
+            if root is None or root not in self._free:
+                return
+            self._free[root] -= nbytes
+            self.debits += 1
+            if self._free[root] >= self.min_free_bytes:
+                self._low.discard(root)
+            elif root not in self._low:
+                self._low.add(root)
+                warn = (root, self._free[root])
+        if warn is not None:
+            self.logger.warning(f"Espacio bajo en {warn[0]}: ~{max(warn[1], 0) // 2 ** 20} MB libres "
+                                f"(mínimo {self.min_free_bytes // 2 ** 20} MB)")
+
+
+def get_storage_roots(internal_dir=None, min_free_mb=None, refresh_seconds=None, watcher=None, logger=None):
+    """
+    Servicio de raíces del proceso (lo crea y lo refresca en la primera llamada; en las siguientes los
+    argumentos se ignoran). Por defecto usa INTERNAL_BACKUP_DIR, MIN_FREE_MB y STORAGE_ROOTS_REFRESH_SECONDS.
+    """
+    global _roots
+    with _roots_lock:
+        if _roots is None:
+            from config import INTERNAL_BACKUP_DIR, MIN_FREE_MB, STORAGE_ROOTS_REFRESH_SECONDS
+            _roots = StorageRoots(internal_dir or INTERNAL_BACKUP_DIR,
+                                  MIN_FREE_MB if min_free_mb is None else min_free_mb,
+                                  refresh_seconds=refresh_seconds or STORAGE_ROOTS_REFRESH_SECONDS,
+                                  watcher=watcher, logger=logger)
+            _roots.refresh()
+        return _roots
+
+
+def current_storage_roots():
+    """Servicio de raíces si ya fue creado (None si no)."""
+    return _roots
@@ -7,28 +7,48 @@ logger = setup_logger("storage")
 
 from config import INTERNAL_BACKUP_DIR, MIN_FREE_MB, MEDIA_BASE_PATH
 
-def find_mounted_usb(min_free_mb=MIN_FREE_MB):
+def list_mounted_usb(mounts=None):
     """
-    Busca la primera USB montada que tenga al menos 'min_free_mb' megabytes disponibles.
-    Si ninguna cumple, devuelve None.
+    Memorias USB montadas y escribibles bajo MEDIA_BASE_PATH: lista de (ruta, bytes libres) en orden de exploración.
+    mounts: puntos de montaje ya conocidos bajo MEDIA_BASE_PATH (p. ej. MountWatcher.media_mounts());
+    evita listar el directorio y consultar ismount en cada candidato.
     """
+    found = []
     try:
         logger.debug(f"Explorando dispositivos en {MEDIA_BASE_PATH}")
-        candidates = [os.path.join(MEDIA_BASE_PATH, d) for d in os.listdir(MEDIA_BASE_PATH)]
+        if mounts is not None:
+            candidates, known_mounts = list(mounts), True
+        else:
+            candidates, known_mounts = [os.path.join(MEDIA_BASE_PATH, d) for d in os.listdir(MEDIA_BASE_PATH)], False
         for path in candidates:
             logger.debug(f"Verificando dispositivo: {path}")
-            if os.path.ismount(path) and os.access(path, os.W_OK):
-                free_mb = shutil.disk_usage(path).free // (1024 * 1024)
-                logger.debug(f"Espacio libre en {path}: {free_mb} MB")
-                if free_mb >= min_free_mb:
-                    logger.debug(f"USB válida detectada en {path} - {free_mb} MB libres")
-                    return path
-                else:
-                    logger.warning(f"Espacio insuficiente en {path} ({free_mb} MB)")
+            if (known_mounts or os.path.ismount(path)) and os.access(path, os.W_OK):
+                free = shutil.disk_usage(path).free
+                logger.debug(f"Espacio libre en {path}: {free // (1024 * 1024)} MB")
+                found.append((path, free))
     except Exception as e:
         logger.warning(f"No se pudo explorar {MEDIA_BASE_PATH}: {e}")
+    return found
+
+
+def select_usb(candidates, min_free_mb=MIN_FREE_MB):
+    """Primera USB de list_mounted_usb() con al menos 'min_free_mb' megabytes libres, o None."""
+    for path, free in candidates:
+        free_mb = free // (1024 * 1024)
+        if free_mb >= min_free_mb:
+            logger.debug(f"USB válida detectada en {path} - {free_mb} MB libres")
+            return path
+        logger.warning(f"Espacio insuficiente en {path} ({free_mb} MB)")
     return None
 
+
+def find_mounted_usb(min_free_mb=MIN_FREE_MB, mounts=None):
+    """
+    Busca la primera USB montada que tenga al menos 'min_free_mb' megabytes disponibles.
+    Si ninguna cumple, devuelve None. mounts: ver list_mounted_usb.
+    """
+    return select_usb(list_mounted_usb(mounts), min_free_mb)
+
 def has_enough_space(path, min_mb=MIN_FREE_MB):
     """Verifica si el dispositivo tiene al menos 'min_mb' megabytes libres."""
     try:
@@ -42,6 +62,11 @@ def has_enough_space(path, min_mb=MIN_FREE_MB):
 
 def get_storage_base():
     """Devuelve el directorio base de almacenamiento (USB o respaldo local)."""
+    from utils.storage.storage_roots import current_storage_roots
+    roots = current_storage_roots()
+    if roots is not None:
+        # Servicio de raíces del proceso: ruta y espacio en memoria, sin explorar /media en cada llamada
+        return roots.storage_base()
     usb_path = find_mounted_usb()
     if usb_path and has_enough_space(usb_path):
         free_gb = shutil.disk_usage(usb_path).free / (1024 ** 3)